@@ -0,0 +1,192 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from cosmicops import CosmicOps
+from cosmicops.simulator import CosmicSimulator, create_server, generate_inventory
+
+RESULTS_VERSION = 1
+
+BENCHMARKS = {}
+
+
+def benchmark(name, sizes):
+    """Register a benchmark function which is called with a Measurement and the size of the run."""
+
+    def decorator(func):
+        BENCHMARKS[name] = (func, sizes)
+        return func
+
+    return decorator
+
+
+@dataclass
+class Measurement:
+    """Collects the counters of a single benchmark run, the timed part of the run is wrapped in measure()."""
+
+    wall_time: float = 0.
+    api_calls: Counter = field(default_factory=Counter)
+    sql_queries: int = 0
+    _start: float = None
+
+    def start(self):
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.wall_time += time.perf_counter() - self._start
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    size: int
+    wall_times: list
+    api_calls: dict
+    sql_queries: int
+
+    @property
+    def median(self):
+        return statistics.median(self.wall_times)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'size': self.size,
+            'repeat': len(self.wall_times),
+            'min': round(min(self.wall_times), 6),
+            'median': round(self.median, 6),
+            'max': round(max(self.wall_times), 6),
+            'api_calls': sum(self.api_calls.values()),
+            'api_commands': dict(sorted(self.api_calls.items())),
+            'sql_queries': self.sql_queries
+        }
+
+
+class SimulatedBackend(object):
+    """Management server simulator with a CosmicOps client connected to it over HTTP."""
+
+    def __init__(self, dry_run=True, time_scale=0., **inventory_args):
+        self.simulator = CosmicSimulator(generate_inventory(**inventory_args), key='benchmark', secret='benchmark',
+                                         time_scale=time_scale)
+        self.server = create_server(self.simulator, port=0)
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/client/api"
+        self.co = None
+        self.dry_run = dry_run
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.co = CosmicOps(endpoint=self.endpoint, key=self.simulator.key, secret=self.simulator.secret,
+                            dry_run=self.dry_run)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def inventory(self):
+        return self.simulator.inventory
+
+    def reset_counters(self):
+        self.simulator.command_counts.clear()
+
+    def collect(self, measurement):
+        measurement.api_calls.update(self.simulator.command_counts)
+
+
+def run_benchmark(name, size, repeat=3):
+    (func, _) = BENCHMARKS[name]
+
+    wall_times = []
+    api_calls = Counter()
+    sql_queries = 0
+    for _ in range(repeat):
+        measurement = Measurement()
+        func(measurement, size)
+        wall_times.append(measurement.wall_time)
+
+        # Call counts should not differ between repetitions, keep the ones of the last run
+        api_calls = measurement.api_calls
+        sql_queries = measurement.sql_queries
+
+    return BenchmarkResult(name, size, wall_times, api_calls, sql_queries)
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def results_document(results):
+    return {
+        'version': RESULTS_VERSION,
+        'commit': get_commit(),
+        'timestamp': round(time.time()),
+        'python': platform.python_version(),
+        'results': [result.to_dict() for result in results]
+    }
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """Compare two results documents, returns a row per benchmark and whether it regressed.
+
+    A benchmark regresses when its median wall time grows by more than threshold, or when it makes more API calls or
+    SQL queries than before. Call counts are deterministic, so any increase is reported.
+    """
+
+    baseline_results = {(result['name'], result['size']): result for result in baseline['results']}
+
+    rows = []
+    for result in current['results']:
+        previous = baseline_results.get((result['name'], result['size']))
+        if not previous:
+            continue
+
+        change = (result['median'] - previous['median']) / previous['median'] if previous['median'] else 0.
+        regressed = change > threshold or result['api_calls'] > previous['api_calls'] or \
+            result['sql_queries'] > previous['sql_queries']
+
+        rows.append({
+            'name': result['name'],
+            'size': result['size'],
+            'baseline_median': previous['median'],
+            'median': result['median'],
+            'change': round(change, 3),
+            'baseline_api_calls': previous['api_calls'],
+            'api_calls': result['api_calls'],
+            'baseline_sql_queries': previous['sql_queries'],
+            'sql_queries': result['sql_queries'],
+            'regressed': regressed
+        })
+
+    return rows
@@ -0,0 +1,368 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from invoke import Result
+
+import list_virtual_machines
+from cosmicops import CosmicOps, CosmicSQL, SnapshotIndex, VolumeMigrationScheduler, VolumeMigrationTracker
+from cosmicops.objects import CosmicStoragePool, CosmicVolume
+from cosmicops.simulator import VOLUME_MIGRATION_SPEED
+from .harness import benchmark, SimulatedBackend
+
+REPOSITORY = Path(__file__).parent.parent
+VMS_PER_HOST = 25
+FIND_OUTPUT_CHUNK_SIZE = 64 * 1024
+
+
+class VirtualClock(object):
+    """Clock shared by the simulator and the polling loops, sleeping advances it without waiting."""
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeHost(object):
+    """Host which answers the commands of CosmicStoragePool.get_file_list() with a synthetic file list."""
+
+    def __init__(self, mount_point, find_output):
+        self.mount_point = mount_point
+        self.find_output = find_output
+
+    def execute(self, command, hide_stdout=True, out_stream=None, **kwargs):
+        if command.startswith('cat /proc/mounts'):
+            return Result(stdout=f"10.0.0.1:/pool {self.mount_point} nfs rw 0 0\n")
+
+        for offset in range(0, len(self.find_output), FIND_OUTPUT_CHUNK_SIZE):
+            out_stream.write(self.find_output[offset:offset + FIND_OUTPUT_CHUNK_SIZE])
+
+        return Result()
+
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = ()
+
+    def execute(self, query, args=()):
+        self.connection.queries += 1
+        self.rows = self.connection.rows_for(query)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """Database connection returning synthetic rows for the CosmicSQL queries used in the benchmarks."""
+
+    def __init__(self, size):
+        self.size = size
+        self.queries = 0
+        self.autocommit = True
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rows_for(self, query):
+        if 'FROM vm_instance vm' in query:
+            return tuple(
+                (f"cluster{i % 4}", f"vm{i}", 20 * 1024 ** 3, 'Template', 2048, 2, f"i-1-{i}-VM", f"hv{i % 40}",
+                 'domain', 'account', None, '2020-01-01 00:00:00', '6.4.0') for i in range(self.size))
+        elif 'FROM vm_instance' in query:
+            return tuple((f"i-1-{i}-VM", i) for i in range(self.size))
+
+        return ()
+
+
+@benchmark('list_virtual_machines', sizes=[100, 500, 2000])
+def bench_list_virtual_machines(measurement, size):
+    """Run list_virtual_machines on a zone with size user VMs spread over two clusters"""
+
+    hosts = max(1, size // (2 * VMS_PER_HOST))
+    with SimulatedBackend(hosts=hosts, vms=VMS_PER_HOST) as backend, tempfile.TemporaryDirectory() as home:
+        config = Path(home) / '.cloudmonkey' / 'config'
+        config.parent.mkdir()
+        config.write_text(f"[benchmark]\nurl = {backend.endpoint}\napikey = {backend.simulator.key}\n"
+                          f"secretkey = {backend.simulator.secret}\n")
+
+        with patch.dict(os.environ, {'HOME': home}):
+            backend.reset_counters()
+            with measurement:
+                result = CliRunner().invoke(list_virtual_machines.main,
+                                            ['--profile', 'benchmark', '--verbosity', 'WARNING'])
+
+        if result.exit_code != 0:
+            raise RuntimeError(f"list_virtual_machines failed: {result.output}") from result.exception
+
+        backend.collect(measurement)
+
+
+@benchmark('host_empty_planning', sizes=[10, 50, 100])
+def bench_host_empty_planning(measurement, size):
+    """Plan the migrations of a host with size VMs in dry-run mode"""
+
+    with SimulatedBackend(dry_run=True, clusters=1, hosts=8, vms=size) as backend:
+        host = backend.co.get_host(name=backend.inventory['hosts'][0]['name'])
+
+        backend.reset_counters()
+        with measurement:
+            (_, _, failed) = host.empty()
+
+        if failed:
+            raise RuntimeError(f"Failed to plan the migration of {failed} VMs")
+
+        backend.collect(measurement)
+
+
+@benchmark('find_migration_host', sizes=[10, 50, 200])
+def bench_find_migration_host(measurement, size):
+    """Find a migration host for ten VMs in a cluster of size hosts"""
+
+    with SimulatedBackend(clusters=1, hosts=size, vms=1, routers=0) as backend:
+        cluster = backend.co.get_cluster(name=backend.inventory['clusters'][0]['name'])
+        vms = backend.co.get_all_vms()[:10]
+
+        backend.reset_counters()
+        with measurement:
+            for vm in vms:
+                cluster.find_migration_host(vm)
+
+        backend.collect(measurement)
+
+
+@benchmark('find_migration_host_capacity', sizes=[10, 50, 200])
+def bench_find_migration_host_capacity(measurement, size):
+    """Find a migration host for ten VMs in a cluster of size hosts, sharing one capacity model"""
+
+    with SimulatedBackend(clusters=1, hosts=size, vms=1, routers=0) as backend:
+        cluster = backend.co.get_cluster(name=backend.inventory['clusters'][0]['name'])
+        vms = backend.co.get_all_vms()[:10]
+
+        backend.reset_counters()
+        with measurement:
+            capacity = cluster.get_capacity_model()
+            for vm in vms:
+                cluster.find_migration_host(vm, capacity=capacity)
+
+        backend.collect(measurement)
+
+
+def _check_snapshots(backend, measurement, size, load):
+    vms = [(vm, vm.get_volumes()) for vm in backend.co.get_all_vms()[:size]]
+
+    backend.reset_counters()
+    with measurement:
+        snapshots = SnapshotIndex(backend.co)
+        if load:
+            snapshots.load()
+
+        for (vm, volumes) in vms:
+            snapshots.get_vm_snapshots(vm)
+            for volume in volumes:
+                snapshots.get_volume_snapshots(volume)
+
+    backend.collect(measurement)
+
+
+@benchmark('snapshot_precheck', sizes=[10, 50, 200])
+def bench_snapshot_precheck(measurement, size):
+    """Check size VMs and their volumes for snapshots, one VM and volume at a time"""
+
+    with SimulatedBackend(clusters=1, hosts=1, vms=size, routers=0) as backend:
+        _check_snapshots(backend, measurement, size, load=False)
+
+
+@benchmark('snapshot_precheck_index', sizes=[10, 50, 200])
+def bench_snapshot_precheck_index(measurement, size):
+    """Check size VMs and their volumes for snapshots with one SnapshotIndex"""
+
+    with SimulatedBackend(clusters=1, hosts=1, vms=size, routers=0) as backend:
+        _check_snapshots(backend, measurement, size, load=True)
+
+
+@benchmark('get_file_list', sizes=[10000, 100000, 500000])
+def bench_get_file_list(measurement, size):
+    """Parse the find output of a storage pool holding size files"""
+
+    mount_point = '/mnt/pool'
+    find_output = ''.join(f"{i * 4096}\t{i * 8}\t1600000000.0\t{mount_point}/{i:036d}\n" for i in range(size))
+    # The storage pool never calls the API while listing files
+    co = CosmicOps(endpoint='http://127.0.0.1/client/api', key='benchmark', secret='benchmark')
+    storage_pool = CosmicStoragePool(co, {'id': 'pool', 'name': 'pool', 'ipaddress': '10.0.0.1', 'path': '/pool'})
+    host = FakeHost(mount_point, find_output)
+
+    with measurement:
+        files = storage_pool.get_file_list(host)
+
+    if len(files) != size:
+        raise RuntimeError(f"Parsed {len(files)} of {size} files")
+
+
+@benchmark('cosmicsql_queries', sizes=[1000, 10000, 50000])
+def bench_cosmicsql_queries(measurement, size):
+    """Prefetch and look up size instance ids, then build an inventory of size VMs"""
+
+    connection = FakeConnection(size)
+    with patch('pymysql.connect', return_value=connection):
+        sql = CosmicSQL(server='benchmark', password='benchmark', dry_run=True)
+
+    instance_names = [f"i-1-{i}-VM" for i in range(size)]
+
+    with measurement:
+        sql.prefetch_instance_ids(instance_names)
+        for instance_name in instance_names:
+            sql.get_instance_id_from_name(instance_name)
+        sql.get_inventory_vms()
+
+    measurement.sql_queries = connection.queries
+
+
+@benchmark('wait_for_job', sizes=[10, 60, 600])
+def bench_wait_for_job(measurement, size):
+    """Poll a volume migration job which takes size seconds on the management server"""
+
+    clock = VirtualClock()
+    with SimulatedBackend(time_scale=1., clusters=2, hosts=1, vms=1, routers=0) as backend:
+        backend.simulator.clock = clock
+
+        volume = backend.inventory['volumes'][0]
+        volume['size'] = size * VOLUME_MIGRATION_SPEED
+        storage_pool = next(p for p in backend.inventory['storagepools'] if p['id'] != volume['storageid'])
+        job_id = backend.co.cs.migrateVolume(volumeid=volume['id'], storageid=storage_pool['id'])['jobid']
+
+        backend.reset_counters()
+        with patch('time.sleep', side_effect=clock.sleep), measurement:
+            status = backend.co.wait_for_job(job_id)
+
+        if not status:
+            raise RuntimeError(f"Job '{job_id}' failed")
+
+        backend.collect(measurement)
+
+
+@benchmark('wait_for_volume_migration_job', sizes=[5, 60, 600])
+def bench_wait_for_volume_migration_job(measurement, size):
+    """Wait for a volume migration which takes size seconds on the management server"""
+
+    clock = VirtualClock()
+    with SimulatedBackend(time_scale=1., clusters=2, hosts=1, vms=4, routers=0) as backend:
+        backend.simulator.clock = clock
+
+        # Volumes of projects are only listed with a projectid, like on a real management server
+        volume = next(v for v in backend.inventory['volumes'] if 'projectid' not in v)
+        volume['size'] = size * VOLUME_MIGRATION_SPEED
+        storage_pool = next(p for p in backend.inventory['storagepools'] if p['id'] != volume['storageid'])
+        job_id = backend.co.cs.migrateVolume(volumeid=volume['id'], storageid=storage_pool['id'])['jobid']
+
+        backend.reset_counters()
+        with patch('time.sleep', side_effect=clock.sleep), measurement:
+            status = backend.co.wait_for_volume_migration_job(volume['id'], job_id)
+
+        if not status:
+            raise RuntimeError(f"Job '{job_id}' failed")
+        elif clock.now > size * 1.5 + 2:
+            raise RuntimeError(f"Job of {size}s was only noticed after {clock.now:.0f}s")
+
+        backend.collect(measurement)
+
+
+@benchmark('parallel_volume_migration', sizes=[2, 4, 8])
+def bench_parallel_volume_migration(measurement, size):
+    """Migrate size volumes of one to size minutes each side by side to one storage pool"""
+
+    clock = VirtualClock()
+    with SimulatedBackend(dry_run=False, time_scale=1., clusters=2, hosts=1, vms=size * 3, routers=0) as backend:
+        backend.simulator.clock = clock
+
+        target_pool = backend.inventory['storagepools'][-1]
+        volumes = [v for v in backend.inventory['volumes'] if 'projectid' not in v and v['storageid'] !=
+                   target_pool['id']][:size]
+        storage_pools = {p['id']: CosmicStoragePool(backend.co, p) for p in backend.inventory['storagepools']}
+        tracker = VolumeMigrationTracker(backend.co, max_per_source_pool=size, max_per_target_pool=size)
+        for (minutes, volume) in enumerate(volumes, start=1):
+            volume['size'] = minutes * 60 * VOLUME_MIGRATION_SPEED
+            tracker.add(CosmicVolume(backend.co, volume), storage_pools[volume['storageid']],
+                        storage_pools[target_pool['id']])
+
+        backend.reset_counters()
+        with patch('time.sleep', side_effect=clock.sleep), measurement:
+            status = tracker.run()
+
+        if not status:
+            raise RuntimeError('Not all volume migrations succeeded')
+        elif clock.now > size * 60 * 1.5:
+            raise RuntimeError(f"Migrations of at most {size} minutes took {clock.now:.0f}s")
+
+        backend.collect(measurement)
+
+
+@benchmark('plan_volume_migrations', sizes=[1000, 10000, 50000])
+def bench_plan_volume_migrations(measurement, size):
+    """Plan the migration of size volumes of a cluster to the storage pools of another one"""
+
+    with SimulatedBackend(clusters=2, hosts=size // 100, vms=50, routers=0) as backend:
+        (source_cluster, destination_cluster) = backend.inventory['clusters']
+        volumes = [v for v in backend.inventory['volumes'] if v['clusterid'] == source_cluster['id']]
+        pools = {p['id']: CosmicStoragePool(backend.co, p) for p in backend.inventory['storagepools']}
+        destination_pools = [p for p in pools.values() if p['clusterid'] == destination_cluster['id']]
+        for pool in destination_pools:
+            pool['disksizetotal'] = pool['disksizeused'] + sum(v['size'] for v in volumes)
+        scheduler = VolumeMigrationScheduler(backend.co, destination_pools)
+
+        with measurement:
+            for volume in volumes:
+                scheduler.add(CosmicVolume(backend.co, volume), pools[volume['storageid']])
+            scheduler.plan()
+
+        if len(scheduler.tracker.migrations) != len(volumes):
+            raise RuntimeError(f"Planned {len(scheduler.tracker.migrations)} of {len(volumes)} volume migrations")
+
+
+def _run_startup(measurement, script, size):
+    for _ in range(size):
+        with measurement:
+            subprocess.run([sys.executable, script, '--help'], cwd=REPOSITORY, check=True, stdout=subprocess.DEVNULL)
+
+
+@benchmark('startup_sql_tool', sizes=[5])
+def bench_startup_sql_tool(measurement, size):
+    """Start who_has_this_ip.py, which only needs the database, size times"""
+
+    _run_startup(measurement, 'who_has_this_ip.py', size)
+
+
+@benchmark('startup_api_tool', sizes=[5])
+def bench_startup_api_tool(measurement, size):
+    """Start rolling_reboot.py, which imports the API client and the host objects, size times"""
+
+    _run_startup(measurement, 'rolling_reboot.py', size)
@@ -12,8 +12,55 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
+
 from .config import get_config
 from .log import logging
-from .objects.host import RebootAction
-from .ops import CosmicOps
-from .sql import CosmicSQL
+from .metrics import metrics
+
+# Loaded on first use, so the SQL tools don't pay for importing the API client, fabric and libvirt
+LAZY_ATTRIBUTES = {
+    'AdaptivePoll': '.poll',
+    'ConvergencePolicy': '.converge',
+    'CosmicOps': '.ops',
+    'CosmicSQL': '.sql',
+    'HostEvacuationScheduler': '.migration',
+    'MigrationClients': '.migration',
+    'MigrationWindowScheduler': '.migration',
+    'RebootAction': '.objects.host',
+    'RsyncEngine': '.rsync',
+    'SnapshotIndex': '.snapshots',
+    'VolumeMigrationScheduler': '.migration',
+    'VolumeMigrationTracker': '.migration',
+    'history': '.migration_history'
+}
+
+__all__ = ['get_config', 'logging', 'metrics', *LAZY_ATTRIBUTES]
+
+
+def __getattr__(name):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    value = getattr(importlib.import_module(LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return __all__
+
+
+def _enable_history(event):
+    # The history is only loaded once an event finished, it's replaced by the listener of the history if it's enabled
+    logging.event_listeners.remove(_enable_history)
+
+    history = __getattr__('history')
+    if not history.enabled:
+        history.enable_from_config()
+        if history.enabled:
+            history.observe_event(event)
+
+
+logging.event_listeners.append(_enable_history)
@@ -0,0 +1,149 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import math
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+from .lazy import lazy_import
+from .log import logging
+
+humanfriendly = lazy_import('humanfriendly')
+tabulate = lazy_import('tabulate')
+
+HISTOGRAM_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.
+
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+
+    return ordered[index]
+
+
+@dataclass
+class ApiCommandStats:
+    count: int = 0
+    errors: int = 0
+    bytes: int = 0
+    latencies: list = field(default_factory=list)
+
+    @property
+    def total_time(self):
+        return sum(self.latencies)
+
+    @property
+    def histogram(self):
+        buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for latency in self.latencies:
+            buckets[bisect_left(HISTOGRAM_BUCKETS, latency)] += 1
+
+        return dict(zip([str(bucket) for bucket in HISTOGRAM_BUCKETS] + ['+Inf'], buckets))
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'total_time': round(self.total_time, 3),
+            'p50': round(percentile(self.latencies, 50), 3),
+            'p95': round(percentile(self.latencies, 95), 3),
+            'p99': round(percentile(self.latencies, 99), 3),
+            'max': round(max(self.latencies, default=0.), 3),
+            'histogram': self.histogram
+        }
+
+
+class CosmicApiProfiler(object):
+    """Proxy for the CloudStack client which records the count, response size and latency of every API command.
+
+    Calls are grouped per phase, which is the task set on the logging context at the time of the call. Measuring the
+    response size serializes every response again, so it's only done with measure_size.
+    """
+
+    def __init__(self, client, measure_size=False):
+        self._client = client
+        self._lock = threading.Lock()
+        self.measure_size = measure_size
+        self.stats = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def profiled_command(*args, **kwargs):
+            start = time.monotonic()
+            failed = False
+            result = None
+            try:
+                result = attr(*args, **kwargs)
+                return result
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self.record(logging.task, name, time.monotonic() - start, result, failed)
+
+        return profiled_command
+
+    def wrap_client(self, client):
+        """Profile another client, like the one of a worker thread, into the same stats."""
+
+        profiler = CosmicApiProfiler(client, self.measure_size)
+        profiler._lock = self._lock
+        profiler.stats = self.stats
+
+        return profiler
+
+    def record(self, phase, command, latency, result=None, failed=False):
+        size = len(json.dumps(result, default=str)) if self.measure_size and result is not None else 0
+
+        with self._lock:
+            stats = self.stats.setdefault((phase, command), ApiCommandStats())
+            stats.count += 1
+            stats.errors += int(failed)
+            stats.bytes += size
+            stats.latencies.append(latency)
+
+    def summary(self):
+        table_headers = ['Phase', 'Command', 'Calls', 'Errors', 'Response size', 'Total (s)', 'p50 (s)', 'p95 (s)',
+                         'p99 (s)', 'Max (s)']
+
+        table = []
+        for ((phase, command), stats) in sorted(self.stats.items(), key=lambda item: -item[1].total_time):
+            details = stats.to_dict()
+            table.append([phase, command, details['count'], details['errors'],
+                          humanfriendly.format_size(details['bytes'], binary=True) if self.measure_size else '-',
+                          details['total_time'],
+                          details['p50'], details['p95'], details['p99'], details['max']])
+
+        return tabulate.tabulate(table, headers=table_headers, tablefmt='pretty')
+
+    def to_dict(self):
+        phases = {}
+        for ((phase, command), stats) in self.stats.items():
+            phases.setdefault(phase, {})[command] = stats.to_dict()
+
+        return phases
+
+    def dump(self, json_file):
+        with open(json_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,144 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import json
+import threading
+import time
+
+from .lazy import lazy_import
+from .log import logging
+
+pymysql = lazy_import('pymysql')
+
+# Listings of the inventory that rarely changes, cached by the daemon
+CACHED_COMMANDS = [
+    'listAccounts',
+    'listClusters',
+    'listDiskOfferings',
+    'listDomains',
+    'listNetworks',
+    'listPods',
+    'listProjects',
+    'listServiceOfferings',
+    'listTemplates',
+    'listVPCs',
+    'listZones'
+]
+
+
+class CachingClient(object):
+    """Proxy for the CloudStack client which serves the cached inventory listings from the API cache."""
+
+    def __init__(self, client, cache):
+        self._client = client
+        self._cache = cache
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def caching_command(*args, **kwargs):
+            return self._cache.call(self._client, name, kwargs, lambda: attr(*args, **kwargs))
+
+        return caching_command
+
+
+class ApiCache(object):
+    """Cache of inventory listings shared by all CosmicOps instances in the daemon.
+
+    Entries expire after ttl seconds. Any command that is not a listing may change the inventory, so it empties the
+    cache.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.ttl = 300
+        self._lock = threading.Lock()
+        self._responses = {}
+
+    def enable(self, ttl=300):
+        self.enabled = True
+        self.ttl = ttl
+
+    def wrap_client(self, client):
+        return CachingClient(client, self)
+
+    def clear(self):
+        with self._lock:
+            self._responses = {}
+
+    def call(self, client, command, kwargs, func):
+        if command not in CACHED_COMMANDS:
+            if not command.startswith('list'):
+                self.clear()
+            return func()
+
+        key = (client.endpoint, client.key, command, json.dumps(kwargs, sort_keys=True, default=str))
+        with self._lock:
+            (expires, response) = self._responses.get(key, (None, None))
+
+        if expires is None or expires <= time.monotonic():
+            response = func()
+            with self._lock:
+                self._responses[key] = (time.monotonic() + self.ttl, response)
+
+        # Callers modify the objects they get back, so never hand out the cached ones
+        return copy.deepcopy(response)
+
+
+class SQLConnectionPool(object):
+    """Keeps database connections open between the commands run by the daemon.
+
+    When the pool is disabled every call opens a new connection.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def connect(self, **kwargs):
+        if not self.enabled:
+            return pymysql.connect(**kwargs)
+
+        key = tuple(sorted(kwargs.items()))
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is not None:
+                try:
+                    conn.ping(reconnect=True)
+                    return conn
+                except pymysql.Error as e:
+                    logging.debug(f"Dropping pooled connection to '{kwargs.get('host')}': {e}")
+
+            conn = pymysql.connect(**kwargs)
+            self._connections[key] = conn
+
+        return conn
+
+    def reset(self):
+        """Roll back whatever a command left uncommitted, like the queries of a dry run."""
+
+        with self._lock:
+            for (key, conn) in list(self._connections.items()):
+                try:
+                    conn.rollback()
+                except pymysql.Error:
+                    self._connections.pop(key)
+
+
+api_cache = ApiCache()
+sql_pool = SQLConnectionPool()
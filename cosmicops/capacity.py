@@ -0,0 +1,138 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import bisect
+import threading
+from dataclasses import dataclass
+
+
+@dataclass
+class HostCapacity:
+    host: object
+    index: int
+    group: object
+    memory_free: int
+    memory_allocated: int = 0
+    cpu_total: int = 0
+    cpu_allocated: float = 0.
+
+    # Hosts with the same memory keep the order of the host listing
+    @property
+    def free_key(self):
+        return self.memory_free, -self.index, self.host['name']
+
+    @property
+    def allocated_key(self):
+        return self.memory_allocated, self.index, self.host['name']
+
+
+def _get_cpu_allocated(host):
+    cpu_allocated = host.get('cpuallocated')
+    if not cpu_allocated:
+        return 0.
+
+    return float(str(cpu_allocated).rstrip('%')) / 100 * host.get('cpunumber', 0)
+
+
+class ClusterCapacityModel(object):
+    """Memory and CPU headroom of the hosts of a cluster, built from a single host listing.
+
+    Only enabled hosts which are up are taken into account. Dedicated hosts are grouped by their dedication group,
+    the other hosts are in group None. Every group is kept sorted by allocated memory and by free memory, reserving
+    capacity for a planned migration only moves that host within its group. The groups are sorted lists, so moving a
+    host is O(n) in the size of its group, which stays small for the hosts of a cluster.
+
+    CPU is only checked with a cpu_overcommit factor, hosts then fit a VM while their allocated cores stay within the
+    number of cores times the factor. Callers sharing the model between threads hold lock while finding and
+    reserving a host.
+    """
+
+    def __init__(self, hosts, cpu_overcommit=None):
+        self.cpu_overcommit = cpu_overcommit
+        self.lock = threading.Lock()
+        self._hosts = {}
+        self._by_allocated = {}
+        self._by_free = {}
+
+        for (index, host) in enumerate(hosts):
+            if host['resourcestate'] != 'Enabled' or host['state'] != 'Up':
+                continue
+
+            capacity = HostCapacity(host, index, host.get('affinitygroupid') if host.get('dedicated') else None,
+                                    host['memorytotal'] - host['memoryallocated'], host['memoryallocated'],
+                                    host.get('cpunumber', 0), _get_cpu_allocated(host))
+            self._hosts[host['name']] = capacity
+            self._by_allocated.setdefault(capacity.group, []).append(capacity.allocated_key)
+            self._by_free.setdefault(capacity.group, []).append(capacity.free_key)
+
+        for keys in (*self._by_allocated.values(), *self._by_free.values()):
+            keys.sort()
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def get(self, host_name):
+        return self._hosts.get(host_name)
+
+    def find_host(self, memory, group=None, cpu=0, exclude=(), best_fit=False):
+        """Return a host of the group with at least memory bytes free, or None.
+
+        By default the host with the least memory allocated that fits is returned, which spreads the load over the
+        cluster. With best_fit it's the host with the least free memory that still fits, found with a binary search,
+        which keeps room for large VMs.
+        """
+
+        if best_fit:
+            keys = self._by_free.get(group, [])
+            candidates = (keys[i] for i in range(bisect.bisect_left(keys, (memory,)), len(keys)))
+        else:
+            candidates = self._by_allocated.get(group, [])
+
+        for (_, _, host_name) in candidates:
+            capacity = self._hosts[host_name]
+            if capacity.memory_free < memory or host_name in exclude or not self._fits_cpu(capacity, cpu):
+                continue
+
+            return capacity.host
+
+        return None
+
+    def reserve(self, host_name, memory, cpu=0):
+        self._update(host_name, memory, cpu)
+
+    def release(self, host_name, memory, cpu=0):
+        self._update(host_name, -memory, -cpu)
+
+    def _fits_cpu(self, capacity, cpu):
+        if not self.cpu_overcommit or not cpu or not capacity.cpu_total:
+            return True
+
+        return capacity.cpu_allocated + cpu <= capacity.cpu_total * self.cpu_overcommit
+
+    def _update(self, host_name, memory, cpu):
+        capacity = self._hosts.get(host_name)
+        if capacity is None:
+            return
+
+        by_allocated = self._by_allocated[capacity.group]
+        by_free = self._by_free[capacity.group]
+        del by_allocated[bisect.bisect_left(by_allocated, capacity.allocated_key)]
+        del by_free[bisect.bisect_left(by_free, capacity.free_key)]
+
+        capacity.memory_allocated += memory
+        capacity.memory_free -= memory
+        capacity.cpu_allocated += cpu
+        bisect.insort(by_allocated, capacity.allocated_key)
+        bisect.insort(by_free, capacity.free_key)
@@ -0,0 +1,116 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+from dataclasses import dataclass
+
+from .log import logging
+
+# Maximum downtime QEMU uses unless it's told otherwise, in milliseconds
+DEFAULT_MAX_DOWNTIME = 300
+
+
+@dataclass(frozen=True)
+class ConvergencePolicy:
+    """Limits within which a live migration which doesn't converge may be tuned.
+
+    A migration doesn't converge when the data remaining didn't drop by min_progress (a fraction) within window
+    seconds. The bandwidth in MiB/s is raised to max_bandwidth first, unless it's already higher, then the maximum
+    downtime in milliseconds is doubled until it reaches max_downtime. A limit of 0 leaves the setting alone, and a
+    setting which fails to change is skipped. With abort, a migration which still doesn't converge at the limits is
+    aborted, otherwise it's left running.
+    """
+
+    window: float = 30.
+    min_progress: float = .1
+    max_bandwidth: int = 0
+    max_downtime: int = 0
+    abort: bool = False
+
+
+class ConvergenceController(object):
+    """Watches the job stats of a running live migration, and tunes the migration when it doesn't converge."""
+
+    def __init__(self, host, instancename, policy):
+        self.host = host
+        self.instancename = instancename
+        self.policy = policy
+        self.bandwidth = None
+        self.downtime = DEFAULT_MAX_DOWNTIME
+        self.exhausted = False
+        self._samples = []
+
+    def update(self, djstats):
+        if self.exhausted or not djstats.dataRemaining:
+            return
+
+        now = time.monotonic()
+        self._samples.append((now, djstats.dataRemaining))
+
+        # The first sample is the most recent one which is at least a window old
+        while len(self._samples) > 1 and now - self._samples[1][0] >= self.policy.window:
+            self._samples.pop(0)
+
+        (start, remaining) = self._samples[0]
+        if now - start < self.policy.window or djstats.dataRemaining < remaining * (1 - self.policy.min_progress):
+            return
+
+        logging.warning(
+            f"Migration of '{self.instancename}' is not converging, {djstats.dataRemaining} bytes remaining "
+            f"(memory dirty rate {djstats.memDirtyRate} pages/s)")
+        self._tune()
+
+        # The new settings get a full window to take effect
+        self._samples = []
+
+    def _tune(self):
+        if self._raise_bandwidth() or self._raise_downtime():
+            return
+
+        self.exhausted = True
+        if self.policy.abort:
+            logging.error(f"Aborting migration of '{self.instancename}', it doesn't converge within the policy")
+            self.host.abort_job(self.instancename)
+        else:
+            logging.warning(f"Migration of '{self.instancename}' doesn't converge within the policy, leaving it")
+
+    def _raise_bandwidth(self):
+        if not self.policy.max_bandwidth or self.bandwidth is not None:
+            return False
+
+        # A speed which is already at least the maximum of the policy is not lowered
+        current = self.host.get_migration_max_speed(self.instancename)
+        if current is not None and current >= self.policy.max_bandwidth:
+            self.bandwidth = current
+            return False
+
+        logging.info(f"Raising migration bandwidth of '{self.instancename}' to {self.policy.max_bandwidth} MiB/s")
+        if not self.host.set_migration_max_speed(self.instancename, self.policy.max_bandwidth):
+            return False
+
+        self.bandwidth = self.policy.max_bandwidth
+        return True
+
+    def _raise_downtime(self):
+        if not self.policy.max_downtime or self.downtime >= self.policy.max_downtime:
+            return False
+
+        downtime = min(self.downtime * 2, self.policy.max_downtime)
+        logging.info(f"Raising maximum migration downtime of '{self.instancename}' to {downtime} ms")
+        if not self.host.set_migration_max_downtime(self.instancename, downtime):
+            return False
+
+        self.downtime = downtime
+        return True
@@ -0,0 +1,230 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import contextvars
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+from .cache import api_cache, sql_pool
+from .log import logging
+
+DEFAULT_SOCKET_PATH = Path.home() / '.cosmicops' / 'daemon.sock'
+
+# Short running tools which forward their arguments to the daemon when it is running
+DAEMON_COMMANDS = [
+    'kill_jobs',
+    'list_ha_workers',
+    'list_virtual_machines',
+    'reboot_router_vm',
+    'updateHostTags',
+    'who_has_this_ip',
+    'who_has_this_mac'
+]
+
+
+def get_socket_path():
+    return Path(os.environ.get('COSMICOPS_DAEMON_SOCKET', DEFAULT_SOCKET_PATH))
+
+
+class DaemonStream(io.TextIOBase):
+    """File object which sends everything written to it to the client."""
+
+    def __init__(self, wfile, name):
+        self.wfile = wfile
+        self.name = name
+        self.disconnected = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # click probes for binary streams by writing bytes
+        if not isinstance(data, str):
+            raise TypeError(f"write() argument must be str, not {type(data).__name__}")
+
+        if data and not self.disconnected:
+            try:
+                self.wfile.write(json.dumps({self.name: data}).encode('utf-8') + b'\n')
+                self.wfile.flush()
+            except OSError:
+                # The command keeps running when the client goes away
+                self.disconnected = True
+
+        return len(data)
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        exit_code = self.server.cosmic_daemon.execute(request.get('command'), request.get('args', []),
+                                                      request.get('cwd', os.getcwd()),
+                                                      DaemonStream(self.wfile, 'stdout'),
+                                                      DaemonStream(self.wfile, 'stderr'))
+
+        try:
+            self.wfile.write(json.dumps({'exit_code': exit_code}).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+
+
+class CosmicDaemon(object):
+    """Runs the short running tools in a warm process, listening on a Unix socket.
+
+    The tools, the API client and the database driver are imported once, database connections are pooled and
+    inventory listings are cached. Commands run one at a time, with the working directory of the client and a clean
+    logging context.
+    """
+
+    def __init__(self, socket_path=None, commands=None, cache_ttl=300):
+        self.socket_path = Path(socket_path or get_socket_path())
+        self.commands = DAEMON_COMMANDS if commands is None else commands
+        self.cache_ttl = cache_ttl
+        self.server = None
+        self._lock = threading.Lock()
+        self._modules = {}
+
+    def start(self):
+        for command in self.commands:
+            self._modules[command] = importlib.import_module(command)
+
+        api_cache.enable(self.cache_ttl)
+        sql_pool.enabled = True
+
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+        self.server = socketserver.UnixStreamServer(str(self.socket_path), DaemonRequestHandler)
+        self.server.cosmic_daemon = self
+        os.chmod(self.socket_path, 0o600)
+
+        logging.info(f"Listening on '{self.socket_path}' for {', '.join(self.commands)}")
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self.server:
+            self.server.server_close()
+            self.server = None
+
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+        api_cache.enabled = False
+        api_cache.clear()
+        sql_pool.enabled = False
+
+    def execute(self, command, args, cwd, stdout, stderr):
+        """Run a command, returns its exit code or None when the client should run it by itself."""
+
+        if command not in self._modules:
+            return None
+
+        root_logger = logging.getLogger()
+
+        with self._lock:
+            previous_cwd = os.getcwd()
+            previous_handlers = list(root_logger.handlers)
+            previous_level = root_logger.level
+
+            try:
+                os.chdir(cwd)
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    # A new context, so logging fields of the previous command don't leak into this one
+                    return contextvars.Context().run(self._invoke, command, args)
+            finally:
+                os.chdir(previous_cwd)
+                root_logger.handlers = previous_handlers
+                root_logger.setLevel(previous_level)
+                sql_pool.reset()
+
+    def _invoke(self, command, args):
+        logging.debug(f"Running '{command}' with arguments {args}")
+
+        try:
+            self._modules[command].main.main(args=args, prog_name=f"{command}.py")
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+        return 0
+
+
+def forward(command, args, socket_path=None, stdout=None, stderr=None):
+    """Run a command in the daemon, returns its exit code or None when no daemon is available."""
+
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+
+    socket_path = Path(socket_path or get_socket_path())
+    if os.environ.get('COSMICOPS_NO_DAEMON') or not socket_path.exists():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile('rb') as response:
+        sock.sendall(json.dumps({'command': command, 'args': args, 'cwd': os.getcwd()}).encode('utf-8') + b'\n')
+
+        for line in response:
+            message = json.loads(line)
+            if 'stdout' in message:
+                stdout.write(message['stdout'])
+                stdout.flush()
+            elif 'stderr' in message:
+                stderr.write(message['stderr'])
+                stderr.flush()
+            elif 'exit_code' in message:
+                return message['exit_code']
+
+    print('error: Lost the connection to the cosmicops daemon', file=stderr)
+    return 1
+
+
+def forward_or_run(command):
+    """Entry point of the tools in DAEMON_COMMANDS, runs the click command in the daemon when one is listening."""
+
+    exit_code = forward(Path(sys.argv[0]).stem, sys.argv[1:])
+    if exit_code is None:
+        command()
+    else:
+        sys.exit(exit_code)
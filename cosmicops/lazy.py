@@ -0,0 +1,65 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+# importlib.util.LazyLoader isn't thread safe before Python 3.12, threads using a module for the first time at once
+# could see it half loaded. Re-entrant, as loading a module can use another lazily imported module.
+_lock = threading.RLock()
+
+
+class MissingModule(types.ModuleType):
+    """Placeholder for a module that is not installed, raises on first use instead of at import time."""
+
+    def __getattr__(self, item):
+        raise ModuleNotFoundError(f"No module named '{self.__name__}'", name=self.__name__)
+
+
+class LazyModule(types.ModuleType):
+    """Placeholder for a module that is imported on first attribute access."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._module = None
+
+    def __getattr__(self, item):
+        module = self._module
+        if module is None:
+            with _lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.__name__)
+                module = self._module
+
+        return getattr(module, item)
+
+
+def lazy_import(name):
+    """Import a module on first attribute access.
+
+    Tools that never touch the module, like the SQL lookups that don't need libvirt or fabric, skip the cost of
+    loading it.
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if importlib.util.find_spec(name) is None:
+        return MissingModule(name)
+
+    return LazyModule(name)
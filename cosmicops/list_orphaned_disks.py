@@ -14,13 +14,37 @@
 # limitations under the License.
 
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import humanfriendly
 from tabulate import tabulate
 
 from cosmicops import CosmicOps, logging
+from cosmicops.manifest import CosmicManifest
+from cosmicops.objects.storagepool import FileInfo
+
+
+def _get_cluster_details(cluster):
+    return cluster, cluster.get_storage_pools(), cluster.get_all_hosts().pop()
+
+
+def _get_file_list(storage_pool, host, ssh_sessions, manifest):
+    with ssh_sessions:
+        if manifest:
+            return storage_pool.get_incremental_file_list(host, manifest)
 
+        return storage_pool.get_file_list(host)
 
-def list_orphaned_disks(profile, cluster, zone_name):
+
+def _format_size_change(size_change):
+    sign = '-' if size_change < 0 else '+'
+
+    return f"{sign}{humanfriendly.format_size(abs(size_change), binary=True)}"
+
+
+def list_orphaned_disks(profile, cluster, zone_name, max_workers=8, max_ssh_sessions=2, incremental=False,
+                        manifest_file=None):
     """Search primary storage pools in ZONE for orphaned disks."""
 
     # Disable dry run so we can connect to hosts to fetch additional data
@@ -58,23 +82,46 @@ def list_orphaned_disks(profile, cluster, zone_name):
         'Real space used (GB)'
     ]
 
+    trend_table_headers = [
+        'Cluster',
+        'Storage pool',
+        'New orphans',
+        'Cleared orphans',
+        'Real space used',
+        'Change since last run'
+    ]
+
     orphaned_disks_output = ""
 
+    manifest = CosmicManifest(manifest_file) if incremental else None
+
     storage_pool_table = []
-    for cluster in clusters:
-        storage_pools = cluster.get_storage_pools()
-        random_host = cluster.get_all_hosts().pop()
+    trend_table = []
+    scans = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for (cluster, storage_pools, random_host) in executor.map(_get_cluster_details, clusters):
+            # All pools of a cluster are listed through the same host
+            ssh_sessions = threading.BoundedSemaphore(max_ssh_sessions)
 
-        for storage_pool in storage_pools:
+            # The SSH file listing and the API volume listing of every pool run side by side
+            for storage_pool in storage_pools:
+                scans.append((cluster, storage_pool,
+                              executor.submit(_get_file_list, storage_pool, random_host, ssh_sessions, manifest),
+                              executor.submit(storage_pool.get_orphaned_volumes)))
+
+        for (cluster, storage_pool, file_list_future, orphans_future) in scans:
             orphan_table = []
+            orphan_sizes = {}
             used_space = 0
 
-            storage_pool_file_list = storage_pool.get_file_list(random_host)
+            storage_pool_file_list = file_list_future.result()
 
-            orphans = storage_pool.get_orphaned_volumes()
+            orphans = orphans_future.result()
             for orphan in orphans:
-                real_size = int(storage_pool_file_list.get(orphan['path'], 0))
+                real_size = storage_pool_file_list.get(orphan['path'], FileInfo()).allocated_size
                 used_space += real_size
+                orphan_sizes[orphan['path']] = real_size
                 is_orphaned = 'Y' if real_size > 0 else 'N'
 
                 orphan_table.append(
@@ -89,7 +136,23 @@ def list_orphaned_disks(profile, cluster, zone_name):
             storage_pool_table.append([cluster['name'], storage_pool['name'], len(orphans),
                                        humanfriendly.format_size(used_space, binary=True)])
 
+            if manifest:
+                previous_orphans = manifest.get_orphans(storage_pool['id'])
+                last_run = manifest.get_last_run(storage_pool['id'])
+                manifest.record_run(storage_pool['id'], orphan_sizes)
+
+                trend_table.append([cluster['name'], storage_pool['name'],
+                                    len(set(orphan_sizes) - set(previous_orphans)),
+                                    len(set(previous_orphans) - set(orphan_sizes)),
+                                    humanfriendly.format_size(used_space, binary=True),
+                                    _format_size_change(used_space - last_run[2]) if last_run else 'First run'])
+
     orphaned_disks_output += '\n'
     orphaned_disks_output += tabulate(storage_pool_table, headers=storage_pool_table_headers, tablefmt='pretty')
 
+    if manifest:
+        manifest.close()
+        orphaned_disks_output += '\n'
+        orphaned_disks_output += tabulate(trend_table, headers=trend_table_headers, tablefmt='pretty')
+
     return orphaned_disks_output
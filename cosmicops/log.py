@@ -12,27 +12,102 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import contextvars
+import json
 import logging as logging_module
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from functools import wraps
 from logging import DEBUG, WARNING, ERROR, INFO
 from urllib.error import HTTPError, URLError
 
-from slack_webhook import Slack
-
 from cosmicops import get_config
+from .lazy import lazy_import
+
+slack_webhook = lazy_import('slack_webhook')
+
+SLACK_QUEUE_SIZE = 1000
+SLACK_BATCH_SIZE = 20
+SLACK_BATCH_WINDOW = 1
+SLACK_RETRIES = 3
+SLACK_RETRY_DELAY = 2
+SLACK_FLUSH_TIMEOUT = 30
+
+
+CONTEXT_FIELDS = ['slack_title', 'slack_value', 'task', 'instance_name', 'vm_name', 'cluster', 'zone_name']
+
+
+class ContextField(object):
+    """Logging context attribute, stored in a ContextVar so threads and tasks don't overwrite each other."""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        return instance._context_vars[self.name].get()
+
+    def __set__(self, instance, value):
+        instance._context_vars[self.name].set(value)
+
+
+class CosmicEvent(object):
+    def __init__(self, operation, object_id, **fields):
+        self.operation = operation
+        self.object_id = object_id
+        self.fields = fields
+        self.outcome = 'success'
+        self.retries = 0
+        self.start = datetime.now()
+        self.end = None
+        self._start_time = time.monotonic()
+        self.duration = None
+
+    def finish(self):
+        self.end = datetime.now()
+        self.duration = round(time.monotonic() - self._start_time, 3)
+
+    def to_dict(self):
+        return {
+            'operation': self.operation,
+            'object_id': self.object_id,
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat() if self.end else None,
+            'duration': self.duration,
+            'outcome': self.outcome,
+            'retries': self.retries,
+            **self.fields
+        }
 
 
 class CosmicLog(object):
+    slack_title = ContextField()
+    slack_value = ContextField()
+    task = ContextField()
+    instance_name = ContextField()
+    vm_name = ContextField()
+    cluster = ContextField()
+    zone_name = ContextField()
+
     def __init__(self):
+        self._context_vars = {field: contextvars.ContextVar(f'cosmiclog_{field}', default='Undefined') for field in
+                              CONTEXT_FIELDS}
         self._slack = self._configure_slack()
-        self.slack_title = 'Undefined'
-        self.slack_value = 'Undefined'
-        self.task = 'Undefined'
-        self.instance_name = 'Undefined'
-        self.vm_name = 'Undefined'
-        self.cluster = 'Undefined'
-        self.zone_name = 'Undefined'
+        self._slack_queue = queue.Queue(maxsize=SLACK_QUEUE_SIZE)
+        self._slack_sender = None
+        self._slack_sender_lock = threading.Lock()
+        self.slack_retry_delay = SLACK_RETRY_DELAY
+        atexit.register(self.flush)
         self.timestamp_format = self._configure_log()
+        self.event_file = self._configure_events()
+        self._event_lock = threading.Lock()
+        self.event_listeners = []
 
     @staticmethod
     def _configure_slack():
@@ -41,7 +116,7 @@ class CosmicLog(object):
         slack_hook_url = config.get('slack', 'hookurl', fallback=None)
 
         if slack_hook_url:
-            return Slack(url=slack_hook_url)
+            return slack_webhook.Slack(url=slack_hook_url)
         else:
             print(f"warning: No Slack connection details found in configuration file")
             return None
@@ -60,11 +135,35 @@ class CosmicLog(object):
 
         return None
 
+    @staticmethod
+    def _configure_events():
+        config = get_config()
+
+        return config.get('logging', 'events', fallback=None)
+
+    @contextmanager
+    def context(self, **fields):
+        """Set logging context fields for the duration of the block, restoring the previous values afterwards."""
+
+        unknown_fields = set(fields) - set(CONTEXT_FIELDS)
+        if unknown_fields:
+            raise ValueError(f"Unknown logging context fields: {', '.join(sorted(unknown_fields))}")
+
+        tokens = [(self._context_vars[field], self._context_vars[field].set(value)) for (field, value) in
+                  fields.items()]
+        try:
+            yield self
+        finally:
+            for (context_var, token) in reversed(tokens):
+                context_var.reset(token)
+
     def _log(self, log_level, message, log_to_slack):
-        prefix = ''
-        if self.timestamp_format:
-            prefix = datetime.now().strftime(self.timestamp_format)
-        logging_module.log(log_level, "%s%s" % (prefix, message))
+        # Skip the timestamp formatting when nothing would be logged
+        if logging_module.getLogger().isEnabledFor(log_level):
+            prefix = ''
+            if self.timestamp_format:
+                prefix = datetime.now().strftime(self.timestamp_format)
+            logging_module.log(log_level, "%s%s" % (prefix, message))
 
         if log_to_slack and self._slack:
             if log_level == ERROR:
@@ -77,7 +176,7 @@ class CosmicLog(object):
             self._send_slack_message(message, color)
 
     def _send_slack_message(self, message, color='good'):
-        attachments = []
+        # The attachment is built right away, the context fields may change before it's posted
         attachment = {'text': message, 'color': color, 'mrkdwn_in': ['text', 'pretext', 'fields'], 'mrkdwn': 'true',
                       'fields': [
                           {
@@ -116,11 +215,107 @@ class CosmicLog(object):
                           }
                       ]}
 
+        self._start_slack_sender()
+
+        try:
+            self._slack_queue.put_nowait(attachment)
+        except queue.Full:
+            print('warning: Slack queue is full, dropping message')
+
+    def _start_slack_sender(self):
+        with self._slack_sender_lock:
+            if self._slack_sender and self._slack_sender.is_alive():
+                return
+
+            self._slack_sender = threading.Thread(target=self._process_slack_queue, name='slack-sender', daemon=True)
+            self._slack_sender.start()
+
+    def _process_slack_queue(self):
+        stop = False
+
+        while not stop:
+            attachment = self._slack_queue.get()
+            if attachment is None:
+                break
+
+            # Coalesce bursts of messages into a single post
+            attachments = [attachment]
+            deadline = time.monotonic() + SLACK_BATCH_WINDOW
+            while len(attachments) < SLACK_BATCH_SIZE:
+                try:
+                    attachment = self._slack_queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+                if attachment is None:
+                    stop = True
+                    break
+
+                attachments.append(attachment)
+
+            self._post_slack_attachments(attachments)
+
+    def _post_slack_attachments(self, attachments):
+        for attempt in range(SLACK_RETRIES):
+            try:
+                self._slack.post(attachments=attachments, icon_emoji=':robot_face:', username='cosmicOps')
+                return True
+            except (HTTPError, URLError, TimeoutError):
+                if attempt < SLACK_RETRIES - 1:
+                    time.sleep(self.slack_retry_delay * 2 ** attempt)
+
+        print('warning: Slack post failed.')
+        return False
+
+    def flush(self, timeout=SLACK_FLUSH_TIMEOUT):
+        with self._slack_sender_lock:
+            sender = self._slack_sender
+            if not sender or not sender.is_alive():
+                return
+
+            try:
+                self._slack_queue.put(None, timeout=timeout)
+            except queue.Full:
+                print('warning: Unable to flush Slack queue')
+                return
+
+        sender.join(timeout)
+
+    @contextmanager
+    def event(self, operation, object_id, **fields):
+        event = CosmicEvent(operation, object_id, **fields)
+
+        try:
+            yield event
+        except BaseException:
+            event.outcome = 'error'
+            raise
+        finally:
+            event.finish()
+            self._write_event(event)
+
+            # Copied, listeners may add or remove listeners while the event is passed on
+            for listener in list(self.event_listeners):
+                listener(event)
+
+    def _write_event(self, event):
+        if not self.event_file:
+            return
+
+        record = {
+            **event.to_dict(),
+            'task': self.task,
+            'cluster': self.cluster,
+            'zone_name': self.zone_name,
+            'instance_name': self.instance_name,
+            'vm_name': self.vm_name
+        }
+
         try:
-            attachments.append(attachment)
-            self._slack.post(attachments=attachments, icon_emoji=':robot_face:', username='cosmicOps')
-        except (HTTPError, URLError):
-            print('warning: Slack post failed.')
+            with self._event_lock, open(self.event_file, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+        except OSError as e:
+            print(f"warning: Failed to write event to '{self.event_file}': {e}")
 
     # noinspection PyPep8Naming
     @staticmethod
@@ -141,3 +336,21 @@ class CosmicLog(object):
 
 
 logging = CosmicLog()
+
+
+def timed_event(operation):
+    """Record a timed event for a CosmicObject method, a False result is recorded as a failure."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with logging.event(operation, self.get('id'), name=self.get('name'), dry_run=self.dry_run) as event:
+                result = func(self, *args, **kwargs)
+                if result is False:
+                    event.outcome = 'failure'
+
+                return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,124 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from cosmicops.objects.storagepool import FileInfo
+from .log import logging
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS directories (
+        pool_id TEXT NOT NULL,
+        path TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        PRIMARY KEY (pool_id, path)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS files (
+        pool_id TEXT NOT NULL,
+        path TEXT NOT NULL,
+        apparent_size INTEGER NOT NULL,
+        allocated_size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        PRIMARY KEY (pool_id, path)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS orphans (
+        pool_id TEXT NOT NULL,
+        volume_path TEXT NOT NULL,
+        allocated_size INTEGER NOT NULL,
+        PRIMARY KEY (pool_id, volume_path)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        pool_id TEXT NOT NULL,
+        timestamp REAL NOT NULL,
+        orphan_count INTEGER NOT NULL,
+        orphan_size INTEGER NOT NULL
+    )
+    """
+]
+
+
+def get_default_manifest_path():
+    return str(Path.home() / '.cosmicops' / 'manifest.db')
+
+
+class CosmicManifest(object):
+    def __init__(self, path=None):
+        self.path = path or get_default_manifest_path()
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        logging.debug(f"Using storage pool manifest '{self.path}'")
+
+        # Storage pools are scanned from worker threads, access is serialized with a lock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+        with self._lock, self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+    def get_directories(self, pool_id):
+        with self._lock:
+            rows = self.conn.execute('SELECT path, mtime FROM directories WHERE pool_id = ?', (pool_id,)).fetchall()
+
+        return {path: mtime for (path, mtime) in rows}
+
+    def get_files(self, pool_id):
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT apparent_size, allocated_size, mtime, path FROM files WHERE pool_id = ?', (pool_id,)).fetchall()
+
+        return [FileInfo(*row) for row in rows]
+
+    def update(self, pool_id, directories, files):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM directories WHERE pool_id = ?', (pool_id,))
+            self.conn.execute('DELETE FROM files WHERE pool_id = ?', (pool_id,))
+            self.conn.executemany('INSERT INTO directories VALUES (?, ?, ?)',
+                                  [(pool_id, path, mtime) for (path, mtime) in directories.items()])
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                  [(pool_id, f.path, f.apparent_size, f.allocated_size, f.mtime) for f in files])
+
+    def get_orphans(self, pool_id):
+        with self._lock:
+            rows = self.conn.execute('SELECT volume_path, allocated_size FROM orphans WHERE pool_id = ?',
+                                     (pool_id,)).fetchall()
+
+        return {volume_path: allocated_size for (volume_path, allocated_size) in rows}
+
+    def get_last_run(self, pool_id):
+        with self._lock:
+            return self.conn.execute(
+                'SELECT timestamp, orphan_count, orphan_size FROM runs WHERE pool_id = ? ORDER BY timestamp DESC LIMIT 1',
+                (pool_id,)).fetchone()
+
+    def record_run(self, pool_id, orphans):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM orphans WHERE pool_id = ?', (pool_id,))
+            self.conn.executemany('INSERT INTO orphans VALUES (?, ?, ?)',
+                                  [(pool_id, volume_path, size) for (volume_path, size) in orphans.items()])
+            self.conn.execute('INSERT INTO runs VALUES (?, ?, ?, ?)',
+                              (pool_id, time.time(), len(orphans), sum(orphans.values())))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,126 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from .log import logging
+
+METRIC_PREFIX = 'cosmicops'
+
+METRIC_TYPES = {
+    'operations_total': ('counter', 'Number of finished operations'),
+    'operation_duration_seconds_total': ('counter', 'Time spent in operations'),
+    'bytes_transferred_total': ('counter', 'Bytes transferred by migrations'),
+    'migration_throughput_bytes_per_second': ('gauge', 'Throughput of the last finished migration'),
+    'hosts_processed_total': ('counter', 'Number of hosts processed'),
+    'host_duration_seconds': ('gauge', 'Time spent processing a host'),
+    'last_update_timestamp_seconds': ('gauge', 'Time of the last metrics update')
+}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in
+               labels.values())
+
+    return '{' + ','.join(f'{name}="{value}"' for (name, value) in zip(labels.keys(), escaped)) + '}'
+
+
+class CosmicMetrics(object):
+    """Metrics exporter writing the node_exporter textfile format.
+
+    Operations timed with logging.event() are picked up automatically, scripts can add their own counters and gauges.
+    """
+
+    def __init__(self):
+        self.textfile = None
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def enable(self, textfile):
+        self.textfile = textfile
+        if self.observe_event not in logging.event_listeners:
+            logging.event_listeners.append(self.observe_event)
+
+        self.write()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, name, **labels):
+        return self._values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def observe_event(self, event):
+        task = logging.task
+
+        self.inc('operations_total', operation=event.operation, outcome=event.outcome, task=task)
+        self.inc('operation_duration_seconds_total', event.duration, operation=event.operation, task=task)
+
+        bytes_transferred = event.fields.get('bytes_transferred')
+        if bytes_transferred:
+            self.inc('bytes_transferred_total', bytes_transferred, operation=event.operation, task=task)
+            if event.duration:
+                self.set('migration_throughput_bytes_per_second', bytes_transferred / event.duration,
+                         operation=event.operation, task=task)
+
+        self.write()
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        lines = []
+        for (name, (metric_type, description)) in METRIC_TYPES.items():
+            samples = [(dict(labels), value) for ((metric, labels), value) in values if metric == name]
+            if not samples:
+                continue
+
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            for (labels, value) in samples:
+                lines.append(f"{METRIC_PREFIX}_{name}{_format_labels(labels)} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        if not self.textfile:
+            return
+
+        self.set('last_update_timestamp_seconds', time.time())
+
+        # node_exporter may read the file at any moment, so replace it atomically
+        directory = Path(self.textfile).parent
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.cosmicops', delete=False) as f:
+                f.write(self.render())
+            os.chmod(f.name, 0o644)
+            os.replace(f.name, self.textfile)
+        except OSError as e:
+            logging.warning(f"Failed to write metrics to '{self.textfile}': {e}")
+
+
+metrics = CosmicMetrics()
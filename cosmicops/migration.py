@@ -0,0 +1,528 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import contextvars
+import heapq
+import statistics
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+
+from .api_profiler import CosmicApiProfiler
+from .lazy import lazy_import
+from .log import logging
+from .migration_history import history
+from .ops import CosmicOps
+from .poll import AdaptivePoll
+from .sql import CosmicSQL
+
+cs = lazy_import('cs')
+
+# Failed job status queries after which a migration is given up
+JOB_RETRIES = 10
+
+# Throughput assumed for duration predictions until a migration has finished, in bytes per second
+DEFAULT_THROUGHPUT = 100 * 1024 * 1024
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+@dataclass
+class VolumeMigration:
+    volume: object
+    source_pool: object
+    target_pool: object
+    source_host: object = None
+    vm_instancename: str = None
+    state: str = PENDING
+    job_id: str = None
+    volume_state: str = None
+    bytes_copied: int = 0
+    bytes_total: int = 0
+    retries: int = 0
+    event: object = field(default=None, repr=False)
+    _events: ExitStack = field(default=None, repr=False)
+
+
+class VolumeMigrationTracker(object):
+    """Runs volume migrations side by side, limiting the number of running migrations per storage pool.
+
+    The jobs of all running migrations are polled from a single loop, together with their libvirt block jobs when the
+    source host is known. The volumes of a VM are moved in about the time of its largest volume.
+
+    Migrations start in the order they were added. With max_bytes_per_second, a migration of a volume reserves its
+    size from the byte rate budget of its source and target pool, the next migration on a pool waits until the budget
+    has been paid back.
+    """
+
+    def __init__(self, ops, max_per_source_pool=1, max_per_target_pool=2, live_migrate=True, log_to_slack=False,
+                 max_running=None, max_bytes_per_second=None):
+        self._ops = ops
+        self.max_per_source_pool = max_per_source_pool
+        self.max_per_target_pool = max_per_target_pool
+        self.live_migrate = live_migrate
+        self.log_to_slack = log_to_slack
+        self.max_running = max_running
+        self.max_bytes_per_second = max_bytes_per_second
+        self.migrations = []
+        self._budgets = {}
+
+    def add(self, volume, source_pool, target_pool, source_host=None, vm_instancename=None):
+        migration = VolumeMigration(volume, source_pool, target_pool, source_host, vm_instancename)
+        self.migrations.append(migration)
+
+        return migration
+
+    def run(self):
+        """Run all added migrations, returns True when all of them succeeded."""
+
+        if self.max_per_source_pool < 1 or self.max_per_target_pool < 1 or (
+                self.max_running is not None and self.max_running < 1):
+            raise ValueError("The limits on the number of running migrations must be at least 1")
+
+        poll = AdaptivePoll()
+
+        try:
+            while True:
+                self._start_pending()
+
+                running = self._running()
+                if not running:
+                    pending = [m for m in self.migrations if m.state == PENDING]
+                    if not pending:
+                        break
+
+                    # Nothing is running, so the pending migrations are waiting for the byte rate budget
+                    time.sleep(max(0., min(self._budget_available_at(m) for m in pending) - time.monotonic()))
+                    continue
+
+                self._print_progress()
+                poll.sleep(tuple((m.job_id, m.volume_state) for m in running), sum(m.bytes_copied for m in running),
+                           sum(m.bytes_total for m in running))
+
+                for migration in running:
+                    self._update(migration)
+        except BaseException:
+            for migration in self._running():
+                migration.event.outcome = 'error'
+                migration._events.close()
+            raise
+        finally:
+            if self._ops.show_progress:
+                print()
+
+        return all(m.state == SUCCEEDED for m in self.migrations)
+
+    def _running(self, **pools):
+        return [m for m in self.migrations if m.state == RUNNING and all(
+            getattr(m, pool)['id'] == pool_id for (pool, pool_id) in pools.items())]
+
+    def _start_pending(self):
+        for migration in self.migrations:
+            if migration.state != PENDING:
+                continue
+
+            if self.max_running and len(self._running()) >= self.max_running:
+                break
+
+            if len(self._running(source_pool=migration.source_pool['id'])) >= self.max_per_source_pool:
+                continue
+
+            if len(self._running(target_pool=migration.target_pool['id'])) >= self.max_per_target_pool:
+                continue
+
+            if self._budget_available_at(migration) > time.monotonic():
+                continue
+
+            self._start(migration)
+
+    def _budget_available_at(self, migration):
+        return max(self._budgets.get(pool['id'], 0.) for pool in (migration.source_pool, migration.target_pool))
+
+    def _reserve_budget(self, migration):
+        if not self.max_bytes_per_second:
+            return
+
+        now = time.monotonic()
+        duration = migration.volume.get('size', 0) / self.max_bytes_per_second
+        for pool in (migration.source_pool, migration.target_pool):
+            self._budgets[pool['id']] = max(now, self._budgets.get(pool['id'], 0.)) + duration
+
+    def _start(self, migration):
+        volume = migration.volume
+        migration._events = ExitStack()
+        migration.event = migration._events.enter_context(
+            logging.event('volume.migrate', volume['id'], name=volume['name'], dry_run=volume.dry_run,
+                          source_pool=migration.source_pool['name'], target_pool=migration.target_pool['name'],
+                          source_host=migration.source_host['name'] if migration.source_host else None))
+
+        if volume.dry_run:
+            logging.info(
+                f"Would {'live ' if self.live_migrate else ''}migrate volume '{volume['name']}' to '{migration.target_pool['name']}'")
+            self._finish(migration, SUCCEEDED)
+            return
+
+        try:
+            migration.job_id = volume.start_migration(migration.target_pool, self.live_migrate)
+        except cs.CloudStackException as e:
+            logging.error(f"Failed to start migration of volume '{volume['name']}': {e}", self.log_to_slack)
+            self._finish(migration, FAILED)
+            return
+
+        migration.state = RUNNING
+        self._reserve_budget(migration)
+        logging.info(
+            f"Started migration of volume '{volume['name']}' from storage pool '{migration.source_pool['name']}' to storage pool '{migration.target_pool['name']}' (job '{migration.job_id}')",
+            self.log_to_slack)
+
+    def _update(self, migration):
+        volume = migration.volume
+
+        (job_status, volume_data, current, end) = self._ops.poll_volume_migration(
+            volume['id'], migration.job_id, migration.event, migration.source_host, migration.vm_instancename)
+        if job_status is None:
+            migration.retries += 1
+            if migration.retries >= JOB_RETRIES:
+                logging.error(f"Giving up on migration job '{migration.job_id}' of volume '{volume['name']}'",
+                              self.log_to_slack)
+                self._finish(migration, FAILED)
+            return
+
+        if job_status == 2:
+            logging.error(f"Migration job '{migration.job_id}' of volume '{volume['name']}' failed", self.log_to_slack)
+            self._finish(migration, FAILED)
+            return
+
+        migration.volume_state = volume_data['state']
+        migration.bytes_copied = max(migration.bytes_copied, current)
+        migration.bytes_total = max(migration.bytes_total, end)
+
+        if job_status == 1:
+            migration.volume._data = volume_data
+            logging.info(f"Successfully migrated volume '{volume['name']}' to '{migration.target_pool['name']}'",
+                         self.log_to_slack)
+            self._finish(migration, SUCCEEDED)
+
+    @staticmethod
+    def _finish(migration, state):
+        migration.state = state
+        if state == FAILED:
+            migration.event.outcome = 'failure'
+
+        migration._events.close()
+
+    def _print_progress(self):
+        if not self._ops.show_progress:
+            return
+
+        running = self._running()
+        finished = len([m for m in self.migrations if m.state in (SUCCEEDED, FAILED)])
+        bytes_total = sum(m.bytes_total for m in running)
+        percentage = sum(m.bytes_copied for m in running) / bytes_total * 100 if bytes_total else 0.
+
+        print("%4.f%% %d running, %d/%d finished %s" % (percentage, len(running), finished, len(self.migrations),
+                                                        next(self._ops.spinner)), flush=True, end='\r')
+
+
+class VolumeMigrationScheduler(object):
+    """Plans the migration of many volumes to a set of destination storage pools, and runs them with a tracker.
+
+    Volumes are migrated largest first, each to the destination pool with the most free space left after the
+    migrations planned before it. The destination pools fill up evenly and a large volume isn't left for last.
+    """
+
+    def __init__(self, ops, destination_pools, live_migrate=False, log_to_slack=False, **tracker_args):
+        self.destination_pools = destination_pools
+        self.tracker = VolumeMigrationTracker(ops, live_migrate=live_migrate, log_to_slack=log_to_slack,
+                                              **tracker_args)
+        self.log_to_slack = log_to_slack
+        self._volumes = []
+
+    def add(self, volume, source_pool):
+        self._volumes.append((volume, source_pool))
+
+    def plan(self):
+        """Assign a destination pool to every added volume, returns the planned migrations."""
+
+        free_space = [(-(pool['disksizetotal'] - pool['disksizeused']), index, pool) for (index, pool) in
+                      enumerate(self.destination_pools)]
+        heapq.heapify(free_space)
+
+        for (volume, source_pool) in sorted(self._volumes, key=lambda v: v[0].get('size', 0), reverse=True):
+            size = volume.get('size', 0)
+            (free, index, pool) = free_space[0]
+            if -free < size:
+                logging.warning(
+                    f"Volume '{volume['name']}' ({volume['id']}) doesn't fit on any destination storage pool, skipping...",
+                    self.log_to_slack)
+                continue
+
+            heapq.heapreplace(free_space, (free + size, index, pool))
+            estimate = history.estimate(size, operation='volume.migrate', source_pool=source_pool['name'],
+                                        target_pool=pool['name']) or \
+                history.estimate(size, operation='volume.migrate', target_pool=pool['name'])
+            logging.info(
+                f"Volume '{volume['name']}' will be migrated from storage pool '{source_pool['name']}' to '{pool['name']}'"
+                + (f", expected to take {estimate:.0f}s" if estimate else ''))
+            self.tracker.add(volume, source_pool, pool)
+
+        self._volumes = []
+
+        return self.tracker.migrations
+
+    def run(self):
+        """Plan and run the migrations, returns True when all of them succeeded."""
+
+        self.plan()
+
+        return self.tracker.run()
+
+
+@dataclass
+class WindowJob:
+    name: str
+    size: int
+    func: object
+    started: float = None
+    duration: float = None
+    result: object = None
+
+
+class MigrationWindowScheduler(object):
+    """Runs migrations side by side within a maintenance window.
+
+    The duration of a migration is predicted from its size and the median throughput of the migrations finished
+    before it, or of the migrations in the history until then. A migration only starts when it is predicted to finish before the window closes, the largest one that
+    fits is started first so the window is packed with as much work as possible. The history is limited to the
+    operation and endpoints, like the storage pools, that are passed.
+    """
+
+    def __init__(self, window_end=None, max_running=1, throughput=None, log_to_slack=False, operation=None,
+                 **endpoints):
+        self.window_end = window_end
+        self.max_running = max_running
+        self.throughput = throughput or history.throughput(operation=operation, **endpoints) or DEFAULT_THROUGHPUT
+        self.log_to_slack = log_to_slack
+        self.jobs = []
+        self.observed_throughputs = []
+
+    def add(self, name, size, func):
+        job = WindowJob(name, size, func)
+        self.jobs.append(job)
+
+        return job
+
+    def predict(self, size):
+        throughput = statistics.median(self.observed_throughputs) if self.observed_throughputs else self.throughput
+
+        return size / throughput
+
+    def observe(self, size, duration):
+        if size and duration > 0:
+            self.observed_throughputs.append(size / duration)
+
+    def fits(self, job):
+        return self.window_end is None or time.time() + self.predict(job.size) <= self.window_end
+
+    def run(self):
+        """Run the jobs which fit in the window, returns the jobs which were not started."""
+
+        pending = sorted(self.jobs, key=lambda j: j.size, reverse=True)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_running) as executor:
+            while pending or running:
+                while len(running) < self.max_running:
+                    job = next((j for j in pending if self.fits(j)), None)
+                    if job is None:
+                        break
+
+                    pending.remove(job)
+                    logging.info(f"Starting migration of '{job.name}', predicted to take {self.predict(job.size):.0f}s")
+                    job.started = time.time()
+                    # Every job gets its own copy of the logging context
+                    running[executor.submit(contextvars.copy_context().run, job.func)] = job
+
+                if not running:
+                    break
+
+                (done, _) = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    job.duration = time.time() - job.started
+                    try:
+                        job.result = future.result()
+                    except Exception as e:
+                        logging.error(f"Migration of '{job.name}' failed: {e}", self.log_to_slack)
+                        job.result = False
+
+                    if job.result is not False:
+                        self.observe(job.size, job.duration)
+
+        for job in pending:
+            logging.info(
+                f"Not starting migration of '{job.name}', it's predicted to take {self.predict(job.size):.0f}s and the window closes in {max(0., self.window_end - time.time()):.0f}s")
+
+        return pending
+
+
+@dataclass
+class Evacuation:
+    vm: object
+    destination_host: object
+    target_pool: object
+    size: int = 0
+    state: str = PENDING
+
+
+class HostEvacuationScheduler(object):
+    """Plans the migration of the VMs of a host to another cluster, and runs the migrations side by side.
+
+    Every VM gets a destination host from one capacity model of the target cluster, and a storage pool of the target
+    cluster with the most free space left after the VMs planned before it. The largest VMs are planned first. At most
+    max_running migrations run at once, and at most max_per_target_pool of them write to the same storage pool.
+    """
+
+    def __init__(self, target_cluster, max_running=4, max_per_target_pool=1, capacity=None, log_to_slack=False):
+        self.target_cluster = target_cluster
+        self.max_running = max_running
+        self.max_per_target_pool = max_per_target_pool
+        self.capacity = target_cluster.get_capacity_model() if capacity is None else capacity
+        self.log_to_slack = log_to_slack
+        self.evacuations = []
+        self.skipped = []
+        self._vms = []
+
+    def add(self, vm):
+        self._vms.append(vm)
+
+    def plan(self):
+        """Assign a destination host and storage pool to every added VM, returns the planned evacuations."""
+
+        pools = [pool for pool in self.target_cluster.get_storage_pools(scope='CLUSTER') if
+                 pool['state'] != 'Maintenance']
+        free_space = [(-(pool['disksizetotal'] - pool['disksizeused']), index, pool) for (index, pool) in
+                      enumerate(pools)]
+        heapq.heapify(free_space)
+
+        # Volumes on zone wide storage aren't moved, counting them anyway keeps some room on the pools
+        sizes = [(vm, sum(volume.get('size', 0) for volume in vm.get_volumes())) for vm in self._vms]
+
+        for (vm, size) in sorted(sizes, key=lambda s: s[1], reverse=True):
+            if not free_space or -free_space[0][0] < size:
+                logging.warning(f"VM '{vm['name']}' doesn't fit on any storage pool of cluster "
+                                f"'{self.target_cluster['name']}', skipping...", self.log_to_slack)
+                self.skipped.append(vm)
+                continue
+
+            destination_host = self.target_cluster.find_migration_host(vm, capacity=self.capacity)
+            if not destination_host:
+                logging.warning(f"VM '{vm['name']}' doesn't fit on any host of cluster "
+                                f"'{self.target_cluster['name']}', skipping...", self.log_to_slack)
+                self.skipped.append(vm)
+                continue
+
+            (free, index, pool) = free_space[0]
+            heapq.heapreplace(free_space, (free + size, index, pool))
+            logging.info(
+                f"VM '{vm['name']}' will be migrated to host '{destination_host['name']}' and storage pool '{pool['name']}'")
+            self.evacuations.append(Evacuation(vm, destination_host, pool, size))
+
+        self._vms = []
+
+        return self.evacuations
+
+    def run(self, func):
+        """Plan the evacuations and run func(vm, destination_host, target_pool) for each of them.
+
+        Returns True when every VM could be planned and func returned True for all of them.
+        """
+
+        pending = self.plan()[:]
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_running) as executor:
+            while pending or running:
+                for evacuation in pending[:]:
+                    if len(running) >= self.max_running:
+                        break
+
+                    if len([e for e in running.values() if e.target_pool['id'] == evacuation.target_pool['id']]) \
+                            >= self.max_per_target_pool:
+                        continue
+
+                    pending.remove(evacuation)
+                    evacuation.state = RUNNING
+                    # Every migration gets its own copy of the logging context
+                    future = executor.submit(contextvars.copy_context().run, func, evacuation.vm,
+                                             evacuation.destination_host, evacuation.target_pool)
+                    running[future] = evacuation
+
+                (done, _) = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    evacuation = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.error(f"Migration of VM '{evacuation.vm['name']}' failed: {e}", self.log_to_slack)
+                        result = False
+
+                    evacuation.state = SUCCEEDED if result else FAILED
+
+                logging.info(f"Finished {len([e for e in self.evacuations if e.state in (SUCCEEDED, FAILED)])}/"
+                             f"{len(self.evacuations)} migrations")
+
+        return not self.skipped and all(e.state == SUCCEEDED for e in self.evacuations)
+
+
+class MigrationClients(threading.local):
+    """The API and database connections a migration uses in the current thread.
+
+    Connections can't be shared by migrations running at the same time. With concurrent, every thread opens its own
+    for profile on first use, which don't print progress as the jobs of several threads would share one line. The
+    database connections of the threads share the id cache of cs, so names resolved up front aren't queried again.
+    Otherwise the connections passed in are used.
+    """
+
+    def __init__(self, co, cs, profile, concurrent):
+        # Called again in every thread which uses the clients
+        self.shared = (co, cs)
+        self.profile = profile
+        self.concurrent = concurrent
+        self.clients = None
+
+    def get(self):
+        if not self.concurrent:
+            return self.shared
+
+        if self.clients is None:
+            (co, cs) = self.shared
+            thread_co = CosmicOps(profile=self.profile, dry_run=co.dry_run, log_to_slack=co.log_to_slack,
+                                  show_progress=False)
+            # The calls of the workers are part of the API profile of the script
+            if isinstance(co.cs, CosmicApiProfiler):
+                thread_co.cs = co.cs.wrap_client(thread_co.cs)
+            thread_cs = None
+            if cs:
+                thread_cs = CosmicSQL(server=self.profile, dry_run=cs.dry_run)
+                thread_cs._id_cache = cs._id_cache
+            self.clients = (thread_co, thread_cs)
+
+        return self.clients
@@ -0,0 +1,209 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .api_profiler import percentile
+from .config import get_config
+from .log import logging
+
+ENDPOINT_FIELDS = ['source_host', 'target_host', 'source_pool', 'target_pool']
+GROUPS = {
+    'host': ('source_host', 'target_host'),
+    'pool': ('source_pool', 'target_pool')
+}
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS migrations (
+        timestamp REAL NOT NULL,
+        operation TEXT NOT NULL,
+        object_id TEXT,
+        task TEXT,
+        bytes INTEGER NOT NULL,
+        duration REAL NOT NULL,
+        source_host TEXT,
+        target_host TEXT,
+        source_pool TEXT,
+        target_pool TEXT,
+        dirty_rate INTEGER,
+        outcome TEXT NOT NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS migrations_hosts ON migrations (source_host, target_host)',
+    'CREATE INDEX IF NOT EXISTS migrations_pools ON migrations (source_pool, target_pool)'
+]
+
+
+def get_default_history_path():
+    return str(Path.home() / '.cosmicops' / 'history.db')
+
+
+class CosmicHistory(object):
+    """Append-only store of finished migrations, used to predict how long the next one will take.
+
+    Once enabled, every event that moved bytes to another host or storage pool is recorded. History is enabled by
+    calling enable(), or by setting 'path' in the 'history' section of the configuration file. The configuration file
+    is only read on first use, so importing cosmicops doesn't open the database.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.conn = None
+        # Events are observed from worker threads, access is serialized with a lock
+        self._lock = threading.Lock()
+        self._configured = False
+
+    @property
+    def enabled(self):
+        return self.conn is not None
+
+    def enable(self, path=None):
+        self._configured = True
+        if self.enabled:
+            return
+
+        self.path = path or get_default_history_path()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        logging.debug(f"Using migration history '{self.path}'")
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+        if self.observe_event not in logging.event_listeners:
+            logging.event_listeners.append(self.observe_event)
+
+    def enable_from_config(self):
+        if self._configured:
+            return
+
+        self._configured = True
+        path = get_config().get('history', 'path', fallback=None)
+        if path:
+            self.enable(path)
+
+    def disable(self):
+        self._configured = True
+        if self.observe_event in logging.event_listeners:
+            logging.event_listeners.remove(self.observe_event)
+
+        if self.enabled:
+            self.conn.close()
+            self.conn = None
+
+    def observe_event(self, event):
+        if event.fields.get('dry_run') or not event.duration:
+            return
+
+        bytes_transferred = event.fields.get('bytes_transferred')
+        endpoints = {field: event.fields[field] for field in ENDPOINT_FIELDS if event.fields.get(field)}
+        if not bytes_transferred or not endpoints:
+            return
+
+        self.record(event.operation, bytes_transferred, event.duration, outcome=event.outcome,
+                    object_id=event.object_id, dirty_rate=event.fields.get('dirty_rate'), **endpoints)
+
+    def record(self, operation, bytes_transferred, duration, outcome='success', object_id=None, dirty_rate=None,
+               **endpoints):
+        if not self.enabled:
+            return
+
+        self._check_fields(endpoints)
+
+        with self._lock, self.conn:
+            self.conn.execute('INSERT INTO migrations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (time.time(), operation, object_id, logging.task, bytes_transferred, duration,
+                               *(endpoints.get(field) for field in ENDPOINT_FIELDS), dirty_rate, outcome))
+
+    def get_throughputs(self, operation=None, **endpoints):
+        """Return the throughput in bytes per second of every successful migration matching the filters."""
+
+        self.enable_from_config()
+        if not self.enabled:
+            return []
+
+        self._check_fields(endpoints)
+
+        (where, params) = self._where(operation, endpoints)
+        with self._lock:
+            rows = self.conn.execute(f'SELECT bytes, duration FROM migrations WHERE {where}', params).fetchall()
+
+        return [size / duration for (size, duration) in rows if duration > 0]
+
+    def throughput(self, p=50, operation=None, **endpoints):
+        throughputs = self.get_throughputs(operation, **endpoints)
+
+        return percentile(throughputs, p) if throughputs else None
+
+    def estimate(self, size, p=50, operation=None, **endpoints):
+        """Return the predicted duration in seconds of moving size bytes, or None without matching history."""
+
+        throughput = self.throughput(p, operation, **endpoints)
+
+        return size / throughput if throughput else None
+
+    def get_stats(self, by='host', operation=None):
+        """Return the number of migrations and the p50 and p95 throughput per host or storage pool pair."""
+
+        if by not in GROUPS:
+            raise ValueError(f"Unknown history grouping '{by}', expected one of: {', '.join(GROUPS)}")
+
+        self.enable_from_config()
+        if not self.enabled:
+            return {}
+
+        (source, target) = GROUPS[by]
+        (where, params) = self._where(operation, {})
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT {source}, {target}, bytes, duration FROM migrations '
+                f'WHERE {where} AND {source} IS NOT NULL AND {target} IS NOT NULL AND duration > 0', params).fetchall()
+
+        throughputs = {}
+        for (source_name, target_name, size, duration) in rows:
+            throughputs.setdefault((source_name, target_name), []).append(size / duration)
+
+        return {pair: {'count': len(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95)} for
+                (pair, values) in sorted(throughputs.items())}
+
+    def close(self):
+        self.disable()
+
+    @staticmethod
+    def _check_fields(endpoints):
+        unknown_fields = set(endpoints) - set(ENDPOINT_FIELDS)
+        if unknown_fields:
+            raise ValueError(f"Unknown history fields: {', '.join(sorted(unknown_fields))}")
+
+    @staticmethod
+    def _where(operation, endpoints):
+        (clauses, params) = (["outcome = 'success'"], [])
+        if operation:
+            clauses.append('operation = ?')
+            params.append(operation)
+
+        for (field, value) in endpoints.items():
+            clauses.append(f'{field} = ?')
+            params.append(value)
+
+        return ' AND '.join(clauses), params
+
+
+history = CosmicHistory()
@@ -11,8 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from operator import itemgetter
-
+from cosmicops.capacity import ClusterCapacityModel
 from cosmicops.log import logging
 from .host import CosmicHost
 from .object import CosmicObject
@@ -32,58 +31,47 @@ class CosmicCluster(CosmicObject):
 
         return [CosmicStoragePool(self._ops, storage_pool) for storage_pool in storage_pools]
 
-    def find_migration_host(self, vm):
-        hosts = self.get_all_hosts()
+    def get_capacity_model(self, cpu_overcommit=None):
+        return ClusterCapacityModel(self.get_all_hosts(), cpu_overcommit)
+
+    def find_migration_host(self, vm, capacity=None, best_fit=False):
+        """Find a host in this cluster with enough memory for the VM, preferring the least allocated host.
+
+        With best_fit the host with the least free memory that still fits the VM is preferred instead. Pass a capacity
+        model to find hosts for many VMs without listing the hosts for each of them, the memory of the VM is then
+        reserved on the host found.
+        """
+
+        reserve = capacity is not None
+        if capacity is None:
+            capacity = self.get_capacity_model()
 
-        vm_on_dedicated_hv = False
         dedicated_affinity_id = None
         for affinity_group in vm.get_affinity_groups():
             if affinity_group['type'] == 'ExplicitDedication':
-                vm_on_dedicated_hv = True
                 dedicated_affinity_id = affinity_group['id']
 
-        hosts.sort(key=itemgetter('memoryallocated'))
-
-        migration_host = None
-
-        for host in hosts:
-            try:
-                if host['name'] == vm['hostname']:
-                    continue
-            except Exception as e:
-                # Not available when vm is stopped
-                pass
-
-            if host['resourcestate'] != 'Enabled':
-                continue
-
-            if host['state'] != 'Up':
-                continue
-
-            if vm_on_dedicated_hv and not host['dedicated']:
-                continue
-
-            if not vm_on_dedicated_hv and host['dedicated']:
-                continue
-
-            if vm_on_dedicated_hv and host['affinitygroupid'] != dedicated_affinity_id:
-                continue
+        if 'instancename' not in vm:
+            service_offering = self._ops.get_service_offering(id=vm['serviceofferingid'], system=True)
+            if service_offering:
+                vm['memory'] = service_offering['memory']
+            else:
+                vm['memory'] = 1024
 
-            available_memory = host['memorytotal'] - host['memoryallocated']
-            available_memory /= 1048576
+        memory = vm['memory'] * 1048576
+        cpu = vm.get('cpunumber', 0)
 
-            if 'instancename' not in vm:
-                service_offering = self._ops.get_service_offering(id=vm['serviceofferingid'], system=True)
-                if service_offering:
-                    vm['memory'] = service_offering['memory']
-                else:
-                    vm['memory'] = 1024
+        # The host name is not available when the VM is stopped
+        exclude = (vm['hostname'],) if 'hostname' in vm else ()
 
-            if available_memory < vm['memory']:
-                logging.warning(f"Skipping '{host['name']}' as it does not have enough memory available")
-                continue
+        # Migrations running side by side share the capacity model, a host is found and reserved in one go
+        with capacity.lock:
+            migration_host = capacity.find_host(memory, group=dedicated_affinity_id, cpu=cpu, exclude=exclude,
+                                                best_fit=best_fit)
+            if migration_host is not None and reserve:
+                capacity.reserve(migration_host['name'], memory, cpu)
 
-            migration_host = host
-            break
+        if migration_host is None:
+            logging.warning(f"No host in cluster '{self.get('name')}' has enough memory available for '{vm.get('name', vm['id'])}'")
 
         return migration_host
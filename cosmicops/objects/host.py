@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import socket
+import threading
 import time
 from datetime import datetime
 from dataclasses import dataclass
@@ -21,19 +22,27 @@ from operator import itemgetter
 from xml.etree import ElementTree
 
 import click_spinner
-import hpilo
-import libvirt
-import paramiko
-from cs import CloudStackApiException
-from fabric import Connection
-from invoke import UnexpectedExit, CommandTimedOut
 
 from cosmicops import get_config, logging
+from cosmicops.lazy import lazy_import
+from cosmicops.log import timed_event
+from cosmicops.traffic import traffic
 from .object import CosmicObject
 from .router import CosmicRouter
 from .vm import CosmicVM
 
+cs = lazy_import('cs')
+fabric = lazy_import('fabric')
+hpilo = lazy_import('hpilo')
+invoke = lazy_import('invoke')
+libvirt = lazy_import('libvirt')
+paramiko = lazy_import('paramiko')
+
 FABRIC_PATCHED = False
+CONNECTION_LOCKS = {}
+
+# Same value as libvirt.VIR_DOMAIN_JOB_NONE, which would load libvirt when the module is imported
+VIR_DOMAIN_JOB_NONE = 0
 
 
 class RebootAction(Enum):
@@ -47,7 +56,7 @@ class RebootAction(Enum):
 
 @dataclass(frozen=True, order=True)
 class DomJobInfo:
-    jobType: int = libvirt.VIR_DOMAIN_JOB_NONE
+    jobType: int = VIR_DOMAIN_JOB_NONE
     operation: int = 0
     timeElapsed: int = 0
     timeRemaining: int = 0
@@ -60,6 +69,7 @@ class DomJobInfo:
     fileTotal: int = 0
     fileProcessed: int = 0
     fileRemaing: int = 0
+    memDirtyRate: int = 0
 
     @classmethod
     def from_list(cls, l: list):
@@ -77,38 +87,51 @@ class BlkJobInfo:
 # Patch Fabric connection to use different host policy (see https://github.com/fabric/fabric/issues/2071)
 def unsafe_open(self):  # pragma: no cover
     self.client.set_missing_host_key_policy(paramiko.MissingHostKeyPolicy())
-    Connection.open_orig(self)
+    fabric.Connection.open_orig(self)
 
 
 class CosmicHost(CosmicObject):
     def __init__(self, ops, data):
         super().__init__(ops, data)
+
+        # The SSH and ILO connections are set up on first use, most hosts are only listed
+        self._ssh_connection = None
+        self._ilo_connection = None
+
+        self.vms_with_shutdown_policy = []
+
+    @property
+    def _connection(self):
         global FABRIC_PATCHED
 
-        if not FABRIC_PATCHED:
-            Connection.open_orig = Connection.open
-            Connection.open = unsafe_open
-            FABRIC_PATCHED = True
+        if self._ssh_connection is None:
+            if not FABRIC_PATCHED:
+                fabric.Connection.open_orig = fabric.Connection.open
+                fabric.Connection.open = unsafe_open
+                FABRIC_PATCHED = True
 
-        # Load configuration
-        config = get_config()
-        ssh_user = config.get('ssh', 'user', fallback=None)
-        ssh_key_file = config.get('ssh', 'ssh_key_file', fallback=None)
-        connect_kwargs = {'key_filename': ssh_key_file} if ssh_key_file else None
+            config = get_config()
+            ssh_user = config.get('ssh', 'user', fallback=None)
+            ssh_key_file = config.get('ssh', 'ssh_key_file', fallback=None)
+            connect_kwargs = {'key_filename': ssh_key_file} if ssh_key_file else None
 
-        ilo_user = config.get('ilo', 'user', fallback=None)
-        ilo_password = config.get('ilo', 'password', fallback=None)
+            self._ssh_connection = fabric.Connection(self['name'], user=ssh_user, connect_kwargs=connect_kwargs)
 
-        # Setup SSH connection
-        self._connection = Connection(self['name'], user=ssh_user, connect_kwargs=connect_kwargs)
+        return self._ssh_connection
 
-        # Setup ILO connection
-        ilo_address = self['name'].split('.')
-        ilo_address.insert(1, 'ilom')
-        ilo_address = '.'.join(ilo_address)
-        self._ilo = hpilo.Ilo(ilo_address, login=ilo_user, password=ilo_password)
+    @property
+    def _ilo(self):
+        if self._ilo_connection is None:
+            config = get_config()
+            ilo_user = config.get('ilo', 'user', fallback=None)
+            ilo_password = config.get('ilo', 'password', fallback=None)
 
-        self.vms_with_shutdown_policy = []
+            ilo_address = self['name'].split('.')
+            ilo_address.insert(1, 'ilom')
+            ilo_address = '.'.join(ilo_address)
+            self._ilo_connection = hpilo.Ilo(ilo_address, login=ilo_user, password=ilo_password)
+
+        return self._ilo_connection
 
     def refresh(self):
         self._data = self._ops.get_host(id=self['id'], json=True)
@@ -144,6 +167,7 @@ class CosmicHost(CosmicObject):
             logging.info(f"Nothing to update on host '{self['name']}'")
         return True
 
+    @timed_event('host.disable')
     def disable(self):
         if self.dry_run:
             logging.info(f"Would disable host '{self['name']}'")
@@ -164,6 +188,7 @@ class CosmicHost(CosmicObject):
 
         return True
 
+    @timed_event('host.enable')
     def enable(self):
         if self.dry_run:
             logging.info(f"Would enable host '{self['name']}'")
@@ -234,7 +259,7 @@ class CosmicHost(CosmicObject):
             else:
                 try:
                     available_hosts = self._ops.cs.findHostsForMigration(virtualmachineid=vm['id']).get('host', [])
-                except CloudStackApiException as e:
+                except cs.CloudStackApiException as e:
                     logging.error(f"Encountered API exception while finding suitable host for migration: {e}")
                     failed += 1
                     continue
@@ -341,20 +366,42 @@ class CosmicHost(CosmicObject):
         if mode:
             self._connection.sudo(f'chmod {mode:o} {destination}')
 
-    def execute(self, command, sudo=False, hide_stdout=True, pty=False, always=False):
+    def execute(self, command, sudo=False, hide_stdout=True, pty=False, always=False, out_stream=None):
         if self.dry_run and not always:
             logging.info(f"Would execute '{command}' on '{self['name']}")
             return
 
         logging.info(f"Executing '{command}' on '{self['name']}")
 
+        if traffic.mode:
+            key = f"{self['name']} {'sudo ' if sudo else ''}{command}"
+            result = traffic.call('ssh', key, lambda: self._run(command, sudo, hide_stdout, pty, out_stream))
+
+            # Replayed output still has to reach the stream
+            if traffic.mode == 'replay' and out_stream and result:
+                out_stream.write(result.stdout)
+
+            return result
+
+        return self._run(command, sudo, hide_stdout, pty, out_stream)
+
+    def _run(self, command, sudo, hide_stdout, pty, out_stream):
+        # The connection may be shared by concurrent commands, make sure it's only opened once
+        with CONNECTION_LOCKS.setdefault(self['name'], threading.Lock()):
+            if not self._connection.is_connected:
+                self._connection.open()
+
         if sudo:
             runner = self._connection.sudo
         else:
             runner = self._connection.run
 
-        return runner(command, hide=hide_stdout, pty=pty)
+        # Output is only written to out_stream when it's not hidden
+        kwargs = {'out_stream': out_stream} if out_stream else {}
+
+        return runner(command, hide=hide_stdout, pty=pty, **kwargs)
 
+    @timed_event('host.reboot')
     def reboot(self, action=RebootAction.REBOOT):
         reboot_or_halt = 'halt' if action == RebootAction.HALT else 'reboot'
 
@@ -400,6 +447,7 @@ class CosmicHost(CosmicObject):
         else:
             self.execute(f'hpasmcli -s "set uid {new_state}"', sudo=True)
 
+    @timed_event('host.wait_until_offline')
     def wait_until_offline(self):
         if self.dry_run:
             logging.info(f"Would wait for '{self['name']}' to complete it's reboot")
@@ -415,6 +463,7 @@ class CosmicHost(CosmicObject):
                         break
                     time.sleep(5)
 
+    @timed_event('host.wait_until_online')
     def wait_until_online(self):
         if self.dry_run:
             logging.info(f"Would wait for '{self['name']}' to come back online")
@@ -449,7 +498,7 @@ class CosmicHost(CosmicObject):
                     try:
                         if self.execute('virsh list').return_code == 0:
                             break
-                    except (ConnectionResetError, UnexpectedExit, CommandTimedOut):
+                    except (ConnectionResetError, invoke.UnexpectedExit, invoke.CommandTimedOut):
                         pass
 
                     time.sleep(5)
@@ -463,6 +512,7 @@ class CosmicHost(CosmicObject):
         for vm in self.vms_with_shutdown_policy:
             vm.start()
 
+    @timed_event('host.wait_for_agent')
     def wait_for_agent(self):
         if self.dry_run:
             logging.info(f"Would wait for agent to became up on host '{self['name']}'")
@@ -549,7 +599,8 @@ class CosmicHost(CosmicObject):
                     memRemaining=domjobstats.get('memory_remaining', 0),
                     fileTotal=domjobstats.get('disk_total', 0),
                     fileProcessed=domjobstats.get('disk_processed', 0),
-                    fileRemaing=domjobstats.get('disk_remaining', 0)
+                    fileRemaing=domjobstats.get('disk_remaining', 0),
+                    memDirtyRate=domjobstats.get('memory_dirty_rate', 0)
                 )
         except libvirt.libvirtError as _:
             pass  # Ignore exception
@@ -587,6 +638,37 @@ class CosmicHost(CosmicObject):
         else:
             return True
 
+    def get_migration_max_speed(self, vm_instancename):
+        result = self.execute(f"/usr/bin/virsh migrate-getspeed '{vm_instancename}'", sudo=True)
+        if not result.return_code == 0 or not result.stdout.strip().isdigit():
+            logging.error(f"Failed to get migration bandwidth for '{vm_instancename}'")
+            return None
+        else:
+            return int(result.stdout.strip())
+
+    def set_migration_max_speed(self, vm_instancename, bandwidth):
+        if not self.execute(f"/usr/bin/virsh migrate-setspeed '{vm_instancename}' {bandwidth}",
+                            sudo=True).return_code == 0:
+            logging.error(f"Failed to set migration bandwidth for '{vm_instancename}'")
+            return False
+        else:
+            return True
+
+    def set_migration_max_downtime(self, vm_instancename, downtime):
+        if not self.execute(f"/usr/bin/virsh migrate-setmaxdowntime '{vm_instancename}' {downtime}",
+                            sudo=True).return_code == 0:
+            logging.error(f"Failed to set maximum migration downtime for '{vm_instancename}'")
+            return False
+        else:
+            return True
+
+    def abort_job(self, vm_instancename):
+        if not self.execute(f"/usr/bin/virsh domjobabort '{vm_instancename}'", sudo=True).return_code == 0:
+            logging.error(f"Failed to abort the running job of '{vm_instancename}'")
+            return False
+        else:
+            return True
+
     def merge_backing_files(self, vm_instancename):
         command = f"""
         for i in $(/usr/bin/virsh domblklist --details '{vm_instancename}' | grep disk | grep file | /usr/bin/awk '{{print $3}}'); do
@@ -611,7 +693,7 @@ class CosmicHost(CosmicObject):
         try:
             result = self.execute(f"/bin/ls -la \"{path}\"", always=True).stdout
             return result.split()
-        except UnexpectedExit:
+        except invoke.UnexpectedExit:
             return []
 
     def rename_file(self, source, destination):
@@ -620,7 +702,7 @@ class CosmicHost(CosmicObject):
                 return False
 
             return True
-        except UnexpectedExit:
+        except invoke.UnexpectedExit:
             return False
 
     def rename_existing_destination_file(self, path):
@@ -633,5 +715,5 @@ class CosmicHost(CosmicObject):
         return True
 
     def __del__(self):
-        if self._connection:
-            self._connection.close()
+        if self._ssh_connection:
+            self._ssh_connection.close()
@@ -12,9 +12,65 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import shlex
+from dataclasses import dataclass
+
+from cosmicops.log import logging
 from .object import CosmicObject
 from .volume import CosmicVolume
 
+FIND_FILE_FORMAT = "'%s\\t%b\\t%T@\\t%p\\n'"
+FIND_DIRECTORY_FORMAT = "'%T@\\t%p\\n'"
+FIND_DIRECTORY_BATCH_SIZE = 100
+
+
+@dataclass(frozen=True)
+class FileInfo:
+    apparent_size: int = 0
+    allocated_size: int = 0
+    mtime: float = 0.
+    path: str = ''
+
+    @property
+    def volume_path(self):
+        return self.path.split('/')[-1].split('.')[:1][0]
+
+
+# File-like sink for the output of find, complete lines are parsed as they arrive
+class FileListParser(object):
+    def __init__(self):
+        self.files = []
+        self._remainder = ''
+
+    def write(self, data):
+        lines = (self._remainder + data).split('\n')
+        self._remainder = lines.pop()
+
+        for line in lines:
+            self._parse_line(line)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._remainder:
+            self._parse_line(self._remainder)
+            self._remainder = ''
+
+        return self.files
+
+    def _parse_line(self, line):
+        try:
+            (apparent_size, blocks, mtime, file_path) = line.rstrip('\r').split('\t', 3)
+            file_info = FileInfo(apparent_size=int(apparent_size), allocated_size=int(blocks) * 512,
+                                 mtime=float(mtime), path=file_path)
+        except ValueError:
+            if line.strip():
+                logging.debug(f"Ignoring unexpected line in file list: '{line}'")
+            return
+
+        self.files.append(file_info)
+
 
 class CosmicStoragePool(CosmicObject):
     def get_volumes(self, only_project=False):
@@ -30,21 +86,66 @@ class CosmicStoragePool(CosmicObject):
 
         return [volume for volume in volumes if not volume.get('vmname')]
 
-    def get_file_list(self, host):
-        file_list = {}
+    def _get_mount_point(self, host):
         device_path = f"{self['ipaddress']}:{self['path'].rstrip('/')}"
 
         mount_info = host.execute(
             f"cat /proc/mounts | grep \"{device_path}\"").stdout.rstrip().split()
 
-        if mount_info:
-            mount_point = mount_info[1].rstrip('/')
-            output = host.execute(
-                f"find -H {mount_point} -type f -exec du -sm {{}} \\;").stdout.rstrip().split('\n')
+        return mount_info[1].rstrip('/') if mount_info else None
+
+    @staticmethod
+    def _find_files(host, paths, max_depth=None):
+        depth = f" -maxdepth {max_depth}" if max_depth else ''
+
+        # A single find process reports apparent size, allocated 512-byte blocks and mtime of every file
+        parser = FileListParser()
+        host.execute(f"find -H {paths}{depth} -type f -printf {FIND_FILE_FORMAT}", hide_stdout='err',
+                     out_stream=parser)
+
+        return parser.close()
+
+    def get_file_list(self, host):
+        mount_point = self._get_mount_point(host)
+        if not mount_point:
+            return {}
+
+        return {file_info.volume_path: file_info for file_info in self._find_files(host, mount_point)}
+
+    def get_directory_list(self, host, mount_point):
+        directories = {}
+
+        output = host.execute(f"find -H {mount_point} -type d -printf {FIND_DIRECTORY_FORMAT}").stdout
+        for line in output.splitlines():
+            try:
+                (mtime, directory) = line.split('\t', 1)
+                directories[directory] = float(mtime)
+            except ValueError:
+                logging.debug(f"Ignoring unexpected line in directory list: '{line}'")
+
+        return directories
+
+    def get_incremental_file_list(self, host, manifest):
+        mount_point = self._get_mount_point(host)
+        if not mount_point:
+            return {}
+
+        known_directories = manifest.get_directories(self['id'])
+        directories = self.get_directory_list(host, mount_point)
+        changed_directories = [directory for (directory, mtime) in directories.items()
+                               if known_directories.get(directory) != mtime]
+        logging.debug(f"Rescanning {len(changed_directories)} of {len(directories)} directories on storage pool '{self['name']}'")
+
+        # Files in directories with an unchanged mtime are taken from the manifest
+        unchanged_directories = set(directories) - set(changed_directories)
+        files = [file_info for file_info in manifest.get_files(self['id'])
+                 if file_info.path.rsplit('/', 1)[0] in unchanged_directories]
+
+        for i in range(0, len(changed_directories), FIND_DIRECTORY_BATCH_SIZE):
+            paths = ' '.join([shlex.quote(directory) for directory in
+                              changed_directories[i:i + FIND_DIRECTORY_BATCH_SIZE]])
+            files += self._find_files(host, paths, max_depth=1)
 
-            for line in output:
-                (file_size, file_path) = line.split()
-                file_path = file_path.split('/')[-1].split('.')[:1][0]
-                file_list[file_path] = file_size
+        manifest.update(self['id'], directories, files)
 
-        return file_list
+        return {file_info.volume_path: file_info for file_info in files}
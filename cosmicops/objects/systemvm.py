@@ -13,30 +13,37 @@
 # limitations under the License.
 import time
 
+from cosmicops.lazy import lazy_import
 from cosmicops.log import logging
 from .vm import CosmicVM
 from cosmicops import get_config
 
-import paramiko
-from fabric import Connection
+fabric = lazy_import('fabric')
+paramiko = lazy_import('paramiko')
 
 
 class CosmicSystemVM(CosmicVM):
     def __init__(self, ops, data):
         super(CosmicSystemVM, self).__init__(ops, data)
 
-        # Load configuration
-        config = get_config()
-        ssh_user = config.get('ssh', 'user', fallback=None)
-        ssh_key_file = config.get('ssh', 'ssh_key_file', fallback=None)
-        connect_kwargs = {'banner_timeout': 60}
-        if ssh_key_file:
-            connect_kwargs['key_filename'] = ssh_key_file
-
-        # Setup SSH connection
-        self._connection = Connection(self['hostname'], user=ssh_user,
-                                      connect_kwargs=connect_kwargs,
-                                      forward_agent=True, connect_timeout=60)
+        # The SSH connection is set up on first use
+        self._ssh_connection = None
+
+    @property
+    def _connection(self):
+        if self._ssh_connection is None:
+            config = get_config()
+            ssh_user = config.get('ssh', 'user', fallback=None)
+            ssh_key_file = config.get('ssh', 'ssh_key_file', fallback=None)
+            connect_kwargs = {'banner_timeout': 60}
+            if ssh_key_file:
+                connect_kwargs['key_filename'] = ssh_key_file
+
+            self._ssh_connection = fabric.Connection(self['hostname'], user=ssh_user,
+                                                     connect_kwargs=connect_kwargs,
+                                                     forward_agent=True, connect_timeout=60)
+
+        return self._ssh_connection
 
     def stop(self):
         if self.dry_run:
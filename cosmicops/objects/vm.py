@@ -13,12 +13,13 @@
 # limitations under the License.
 from operator import itemgetter
 
-from cs import CloudStackException, CloudStackApiException
-
-from cosmicops.log import logging
+from cosmicops.lazy import lazy_import
+from cosmicops.log import logging, timed_event
 from .object import CosmicObject
 from .volume import CosmicVolume
 
+cs = lazy_import('cs')
+
 
 class CosmicVM(CosmicObject):
     def refresh(self):
@@ -70,7 +71,7 @@ class CosmicVM(CosmicObject):
         affinity_groups = {}
         try:
             affinity_groups = self._ops.cs.listAffinityGroups(fetch_list=False, virtualmachineid=self['id'])
-        except CloudStackException:
+        except cs.CloudStackException:
             pass
 
         if not affinity_groups:
@@ -87,7 +88,7 @@ class CosmicVM(CosmicObject):
             else:
                 vm_snapshots = self._ops.cs.listVMSnapshot(fetch_list=True, virtualmachineid=self['id'], listall='true')
 
-        except CloudStackException as e:
+        except cs.CloudStackException as e:
             logging.error(f'Exception {str(e)}')
 
         return vm_snapshots
@@ -117,7 +118,7 @@ class CosmicVM(CosmicObject):
 
         try:
             available_hosts = self._ops.cs.findHostsForMigration(virtualmachineid=vm['id']).get('host', [])
-        except CloudStackApiException as e:
+        except cs.CloudStackApiException as e:
             logging.error(f"Encountered API exception while finding suitable host for migration: {e}")
             return False
         available_hosts.sort(key=itemgetter('memoryallocated'))
@@ -144,7 +145,8 @@ class CosmicVM(CosmicObject):
 
         return self.migrate(target_host=migration_host, **kwargs)
 
-    def migrate(self, target_host, with_volume=False, **kwargs):
+    @timed_event('vm.migrate')
+    def migrate(self, target_host, with_volume=False, volume_pools=None, **kwargs):
         if 'maintenancepolicy' in self and self['maintenancepolicy'] == 'ShutdownAndStart':
             logging.error(f"Cannot migrate, VM has maintenance policy: '{self['maintenancepolicy']}'")
             return False
@@ -164,19 +166,25 @@ class CosmicVM(CosmicObject):
             if self.is_user_vm():
                 self.detach_iso()
 
-                vm_result = migrate_func(virtualmachineid=self['id'], hostid=target_host['id'])
+                if with_volume and volume_pools:
+                    # Without a mapping Cosmic picks a storage pool for every volume itself
+                    vm_result = migrate_func(virtualmachineid=self['id'], hostid=target_host['id'],
+                                             migrateto=[{'volume': volume['id'], 'pool': pool['id']} for
+                                                        (volume, pool) in volume_pools])
+                else:
+                    vm_result = migrate_func(virtualmachineid=self['id'], hostid=target_host['id'])
                 if not vm_result:
                     raise RuntimeError
             else:
                 vm_result = self._ops.cs.migrateSystemVm(virtualmachineid=self['id'], hostid=target_host['id'])
                 if not vm_result:
                     raise RuntimeError
-        except (CloudStackException, RuntimeError):
+        except (cs.CloudStackException, RuntimeError):
             logging.error(f"Failed to migrate VM '{self['name']}'")
             return False
 
         job_id = vm_result['jobid']
-        if not self._ops.wait_for_vm_migration_job(job_id, **kwargs):
+        if not self._ops.wait_for_vm_migration_job(job_id, target_host=target_host, **kwargs):
             logging.error(f"Migration job '{vm_result['jobid']}' failed")
             return False
 
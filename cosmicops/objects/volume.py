@@ -12,35 +12,53 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from cs import CloudStackException
-
+from cosmicops.lazy import lazy_import
 from cosmicops.log import logging
 from .object import CosmicObject
 
+cs = lazy_import('cs')
+
 
 class CosmicVolume(CosmicObject):
     def refresh(self):
         self._data = self._ops.get_volume(id=self['id'], json=True)
 
     def migrate(self, storage_pool, live_migrate=False, **kwargs):
+        # Recorded like the migrations of VolumeMigrationTracker, so the history has one operation for both
+        with logging.event('volume.migrate', self.get('id'), name=self.get('name'), dry_run=self.dry_run,
+                           source_pool=self.get('storage'), target_pool=storage_pool['name']) as event:
+            result = self._migrate(storage_pool, live_migrate, event, **kwargs)
+            if not result:
+                event.outcome = 'failure'
+
+        return result
+
+    def _migrate(self, storage_pool, live_migrate, event, **kwargs):
         if self.dry_run:
             logging.info(
                 f"Would {'live ' if live_migrate else ''}migrate volume '{self['name']}' to '{storage_pool['name']}'")
             return True
 
-        migrate_result = self._ops.cs.migrateVolume(volumeid=self['id'], storageid=storage_pool['id'],
-                                                    livemigrate=live_migrate)
+        job_id = self.start_migration(storage_pool, live_migrate)
 
-        if not self._ops.wait_for_volume_migration_job(volume_id=self['id'], job_id=migrate_result['jobid'], **kwargs):
-            logging.error(f"Migration job '{migrate_result['jobid']}' failed")
+        if not self._ops.wait_for_volume_migration_job(volume_id=self['id'], job_id=job_id, event=event, **kwargs):
+            logging.error(f"Migration job '{job_id}' failed")
             return False
 
-        logging.debug(f"Migration job '{migrate_result['jobid']}' completed")
+        logging.debug(f"Migration job '{job_id}' completed")
         self.refresh()
 
         logging.info(f"Successfully migrated volume '{self['name']}' to '{storage_pool['name']}'")
         return True
 
+    def start_migration(self, storage_pool, live_migrate=False):
+        """Start the migration of the volume to the storage pool, returns the id of the migration job."""
+
+        migrate_result = self._ops.cs.migrateVolume(volumeid=self['id'], storageid=storage_pool['id'],
+                                                    livemigrate=live_migrate)
+
+        return migrate_result['jobid']
+
     def get_snapshots(self):
         volume_snapshots = []
         try:
@@ -50,7 +68,7 @@ class CosmicVolume(CosmicObject):
             else:
                 volume_snapshots = self._ops.cs.listSnapshots(fetch_list=True, volumeid=self['id'], listall='true')
 
-        except CloudStackException as e:
+        except cs.CloudStackException as e:
             logging.error(f'Exception {str(e)}')
 
         return volume_snapshots
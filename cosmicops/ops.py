@@ -11,19 +11,27 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import atexit
 import itertools
 import time
 from configparser import ConfigParser
 from pathlib import Path
 
 import click_spinner
-from cs import CloudStack, CloudStackException
-from requests.exceptions import ConnectionError
 
 from cosmicops.objects import CosmicCluster, CosmicDomain, CosmicHost, CosmicNetwork, CosmicPod, CosmicProject, \
     CosmicRouter, CosmicServiceOffering, CosmicStoragePool, CosmicSystemVM, CosmicVM, CosmicVolume, CosmicVPC, \
     CosmicZone, CosmicAccount, CosmicTemplate
+from .api_profiler import CosmicApiProfiler
+from .converge import ConvergenceController
+from .cache import api_cache
+from .lazy import lazy_import
 from .log import logging
+from .poll import AdaptivePoll
+from .traffic import traffic
+
+cs = lazy_import('cs')
+requests = lazy_import('requests')
 
 
 def _load_cloud_monkey_profile(profile):
@@ -42,7 +50,7 @@ class CosmicOps(object):
     spinner = itertools.cycle(['-', '\\', '|', '/'])
 
     def __init__(self, endpoint=None, key=None, secret=None, profile=None, timeout=60, dry_run=True,
-                 log_to_slack=False):
+                 log_to_slack=False, show_progress=True):
         if profile:
             (endpoint, key, secret) = _load_cloud_monkey_profile(profile)
 
@@ -52,7 +60,36 @@ class CosmicOps(object):
         self.timeout = timeout
         self.dry_run = dry_run
         self.log_to_slack = log_to_slack
-        self.cs = CloudStack(self.endpoint, self.key, self.secret, self.timeout)
+        # Progress is printed on a single line, which only works when one job is waited for at a time
+        self.show_progress = show_progress
+        self.cs = cs.CloudStack(self.endpoint, self.key, self.secret, self.timeout)
+
+        if traffic.mode:
+            traffic.add_secret(self.key)
+            traffic.add_secret(self.secret)
+            self.cs = traffic.wrap_client(self.cs)
+
+        if api_cache.enabled:
+            self.cs = api_cache.wrap_client(self.cs)
+
+    def enable_api_profiling(self, json_file=None, measure_size=False):
+        if isinstance(self.cs, CosmicApiProfiler):
+            return self.cs
+
+        self.cs = CosmicApiProfiler(self.cs, measure_size)
+        atexit.register(self.report_api_profile, json_file)
+
+        return self.cs
+
+    def report_api_profile(self, json_file=None):
+        if not isinstance(self.cs, CosmicApiProfiler):
+            return
+
+        logging.info(f"API call profile:\n{self.cs.summary()}")
+
+        if json_file:
+            self.cs.dump(json_file)
+            logging.info(f"Wrote API call profile to '{json_file}'")
 
     def _cs_get_single_result(self, list_function, kwargs, cosmic_object, cs_type, pretty_name=None, json=False):
         func = getattr(self.cs, list_function, None)
@@ -210,64 +247,103 @@ class CosmicOps(object):
         return self._cs_get_all_results('listAccounts', kwargs, CosmicAccount, 'account')
 
     def wait_for_job(self, job_id, retries=10):
-        job_status = 0
+        with logging.event('job.wait', job_id) as event:
+            status = self._wait_for_job(job_id, retries, event)
+            if not status:
+                event.outcome = 'failure'
 
-        with click_spinner.spinner():
+        return status
+
+    def _wait_for_job(self, job_id, retries, event):
+        with click_spinner.spinner(disable=not self.show_progress):
             while True:
                 if retries <= 0:
                     break
 
-                try:
-                    job_status = self.cs.queryAsyncJobResult(jobid=job_id).get('jobstatus', 0)
-                except CloudStackException as e:
-                    if 'multiple JSON fields named jobstatus' not in str(e):
-                        raise e
-                    logging.debug(e)
-                    retries -= 1
-                except ConnectionError as e:
-                    if 'Connection aborted' not in str(e):
-                        raise e
-                    logging.debug(e)
+                job_status = self.get_job_status(job_id, event)
+                if job_status is None:
                     retries -= 1
-
-                if int(job_status) == 1:
+                elif job_status == 1:
                     return True
-                elif int(job_status) == 2:
+                elif job_status == 2:
                     break
 
                 time.sleep(1)
 
         return False
 
-    def wait_for_vm_migration_job(self, job_id, retries=10, domjobinfo=True, source_host=None, instancename=None):
+    def get_job_status(self, job_id, event=None):
+        """Returns the status of an async job, or None when querying it failed with a known transient error"""
+
+        try:
+            return int(self.cs.queryAsyncJobResult(jobid=job_id).get('jobstatus', 0))
+        except cs.CloudStackException as e:
+            if 'multiple JSON fields named jobstatus' not in str(e):
+                raise e
+            logging.debug(e)
+        except requests.exceptions.ConnectionError as e:
+            if 'Connection aborted' not in str(e):
+                raise e
+            logging.debug(e)
+
+        if event:
+            event.retries += 1
+        return None
+
+    def wait_for_vm_migration_job(self, job_id, retries=10, domjobinfo=True, source_host=None, instancename=None,
+                                  target_host=None, convergence=None):
+        with logging.event('job.wait_for_vm_migration', job_id, instance_name=instancename,
+                           source_host=source_host['name'] if source_host else None,
+                           target_host=target_host['name'] if target_host else None) as event:
+            status = self._wait_for_vm_migration_job(job_id, retries, domjobinfo, source_host, instancename, event,
+                                                     convergence)
+            if not status:
+                event.outcome = 'failure'
+
+        return status
+
+    def _wait_for_vm_migration_job(self, job_id, retries, domjobinfo, source_host, instancename, event,
+                                   convergence=None):
         status = False
         job_status = 0
         prev_percentage = 0.
+        controller = None
+        if convergence and domjobinfo and source_host and instancename:
+            controller = ConvergenceController(source_host, instancename, convergence)
 
         while True:
             if domjobinfo and source_host and instancename:
                 djstats = source_host.get_domjobstats(instancename)
+                # The job info is empty once the job has finished, keep the highest value seen
+                event.fields['bytes_transferred'] = max(event.fields.get('bytes_transferred', 0), djstats.dataProcessed)
+                event.fields['dirty_rate'] = max(event.fields.get('dirty_rate', 0), djstats.memDirtyRate)
+                if controller:
+                    controller.update(djstats)
                 cur_percentage = float(djstats.dataProcessed / (djstats.dataTotal or 1) * 100)
                 if cur_percentage > prev_percentage:
                     prev_percentage = cur_percentage
-                print("%4.f%% " % prev_percentage, flush=True, end='')
-            print("%s" % next(self.spinner), flush=True, end='\r')
+                if self.show_progress:
+                    print("%4.f%% " % prev_percentage, flush=True, end='')
+            if self.show_progress:
+                print("%s" % next(self.spinner), flush=True, end='\r')
 
             if retries <= 0:
                 break
 
             try:
                 job_status = self.cs.queryAsyncJobResult(jobid=job_id).get('jobstatus', 0)
-            except CloudStackException as e:
+            except cs.CloudStackException as e:
                 if 'multiple JSON fields named jobstatus' not in str(e):
                     raise e
                 logging.debug(e)
                 retries -= 1
-            except ConnectionError as e:
+                event.retries += 1
+            except requests.exceptions.ConnectionError as e:
                 if 'Connection aborted' not in str(e):
                     raise e
                 logging.debug(e)
                 retries -= 1
+                event.retries += 1
 
             if int(job_status) == 1:
                 status = True
@@ -277,43 +353,102 @@ class CosmicOps(object):
 
             time.sleep(1)
 
-        if domjobinfo and source_host and instancename and int(job_status) == 0:
-            print("100%         ")
-        else:
-            print()
+        if self.show_progress:
+            if domjobinfo and source_host and instancename and int(job_status) == 0:
+                print("100%         ")
+            else:
+                print()
         return status
 
-    def wait_for_volume_migration_job(self, volume_id, job_id, blkjobinfo=True, source_host=None, vm_instancename=None):
+    def wait_for_volume_migration_job(self, volume_id, job_id, blkjobinfo=True, source_host=None, vm_instancename=None,
+                                      source_pool=None, target_pool=None, event=None):
+        # A caller which times the whole migration gets the transferred bytes on its own event
+        if event is not None:
+            return self._wait_for_volume_migration_job(volume_id, job_id, blkjobinfo, source_host, vm_instancename,
+                                                       event)
+
+        with logging.event('job.wait_for_volume_migration', job_id, volume_id=volume_id, source_pool=source_pool,
+                           target_pool=target_pool) as event:
+            status = self._wait_for_volume_migration_job(volume_id, job_id, blkjobinfo, source_host, vm_instancename,
+                                                         event)
+            if not status:
+                event.outcome = 'failure'
+
+        return status
+
+    def _wait_for_volume_migration_job(self, volume_id, job_id, blkjobinfo, source_host, vm_instancename, event):
+        status = False
+        retries = 10
         prev_percentage = 0.
+        poll = AdaptivePoll()
+        show_percentage = blkjobinfo and source_host and vm_instancename
 
-        # Hack to wait for job to start
-        time.sleep(60)
         while True:
-            volume = self.get_volume(id=volume_id, json=True)
-            if volume is None:
-                logging.error(f"Error: Could not find volume '{volume_id}'")
-                return False
-
-            if blkjobinfo and source_host and vm_instancename:
-                blkjobinfo = source_host.get_blkjobinfo(vm_instancename, volume['path'])
-                cur_percentage = float(blkjobinfo.current / (blkjobinfo.end or 1) * 100)
+            (job_status, volume, current, end) = self.poll_volume_migration(
+                volume_id, job_id, event, source_host if blkjobinfo else None, vm_instancename)
+            if job_status is None:
+                retries -= 1
+                if retries <= 0:
+                    break
+
+            if show_percentage:
+                cur_percentage = float(current / (end or 1) * 100)
                 if cur_percentage > prev_percentage:
                     prev_percentage = cur_percentage
-                print("%4.f%% " % prev_percentage, flush=True, end='')
-            print("%s" % next(self.spinner), flush=True, end='\r')
+                if self.show_progress:
+                    print("%4.f%% " % prev_percentage, flush=True, end='')
+            if self.show_progress:
+                print("%s" % next(self.spinner), flush=True, end='\r')
 
-            if volume['state'] == "Ready":
+            if job_status == 1:
+                status = True
                 break
-            time.sleep(1)
-            logging.debug(f"Volume '{volume_id}' is in {volume['state']} state and not Ready. Sleeping.")
-        # Return result of job
-        status = self.wait_for_job(job_id=job_id, retries=1)
-        if blkjobinfo and source_host and vm_instancename and status:
-            print("100%       ")
-        else:
-            print()
+            elif job_status == 2:
+                break
+
+            logging.debug(
+                f"Volume '{volume_id}' is in {volume['state']} state and job '{job_id}' is not finished. Sleeping.")
+            poll.sleep((job_status, volume['state']), current, end)
+
+        if self.show_progress:
+            if show_percentage and status:
+                print("100%       ")
+            else:
+                print()
         return status
 
+    def poll_volume_migration(self, volume_id, job_id, event, source_host=None, vm_instancename=None):
+        """Check the job and the volume of a volume migration once, without waiting.
+
+        Returns the job status, the volume and the bytes copied and total of the block job on the source host. The
+        status is only 1 once the volume is back in Ready state, and 2 when the volume is gone. The bytes transferred
+        are recorded in the event.
+        """
+
+        job_status = self.get_job_status(job_id, event)
+
+        volume = self.get_volume(id=volume_id, json=True)
+        if volume is None:
+            logging.error(f"Error: Could not find volume '{volume_id}'")
+            return 2, None, 0, 0
+
+        (current, end) = (0, 0)
+        if source_host and vm_instancename and job_status in (0, None):
+            blkjob = source_host.get_blkjobinfo(vm_instancename, volume['path'])
+            (current, end) = (blkjob.current, blkjob.end)
+            event.fields['bytes_transferred'] = max(event.fields.get('bytes_transferred', 0), current)
+
+        if job_status == 1:
+            # The job is only finished once the volume is back in Ready state, wait for both instead of guessing
+            if volume['state'] != 'Ready':
+                return 0, volume, current, end
+
+            # Without block job info the whole volume is accounted for, so the migration still counts as history
+            if not event.fields.get('bytes_transferred'):
+                event.fields['bytes_transferred'] = volume.get('size', 0)
+
+        return job_status, volume, current, end
+
     def clean_old_disk_file(self, host, dry_run, volume, target_pool_name):
         target_storage_pool = self.get_storage_pool(name=target_pool_name)
         if not target_storage_pool:
@@ -0,0 +1,60 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+
+# Seconds between polls of a running job
+POLL_INTERVAL_MIN = 1.
+POLL_INTERVAL_MAX = 15.
+POLL_INTERVAL_FACTOR = 1.5
+
+
+class AdaptivePoll(object):
+    """Sleeps between the polls of a running job.
+
+    The interval starts short, so jobs which finish quickly are noticed within seconds, and backs off while the polled
+    state doesn't change. When the job reports its progress, the interval is kept below the estimated time remaining.
+    """
+
+    def __init__(self, minimum=POLL_INTERVAL_MIN, maximum=POLL_INTERVAL_MAX, factor=POLL_INTERVAL_FACTOR):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.interval = minimum
+        self._state = None
+        self._progress = None
+
+    def next_interval(self, state=None, current=0, end=0):
+        if state != self._state:
+            self._state = state
+            self.interval = self.minimum
+
+        interval = self.interval
+        self.interval = min(self.interval * self.factor, self.maximum)
+
+        if end:
+            now = time.monotonic()
+            if current >= end:
+                # All data is copied, the job finishes as soon as the last writes are in sync
+                interval = self.minimum
+            elif self._progress and current > self._progress[1] and now > self._progress[0]:
+                rate = (current - self._progress[1]) / (now - self._progress[0])
+                interval = min(interval, (end - current) / rate)
+            self._progress = (now, current)
+
+        return max(self.minimum, interval)
+
+    def sleep(self, state=None, current=0, end=0):
+        time.sleep(self.next_interval(state, current, end))
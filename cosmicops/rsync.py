@@ -0,0 +1,155 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from .lazy import lazy_import
+from .log import logging
+
+invoke = lazy_import('invoke')
+
+RSYNC_OPTIONS = ['-avP', '--sparse', '--block-size=4096']
+
+# Directory next to the staging copy where rsync keeps interrupted transfers
+PARTIAL_DIR = '.rsync-partial'
+
+PENDING = 'pending'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+@dataclass
+class RsyncTransfer:
+    volume: object
+    source_host: object
+    source_pool: object
+    target_host: object
+    target_pool: object
+    state: str = PENDING
+    attempts: int = 0
+
+    @property
+    def source_path(self):
+        return f"/mnt/{self.source_pool['id']}/{self.volume['path']}"
+
+    @property
+    def staging_path(self):
+        return f"/mnt/{self.target_pool['id']}/staging/{self.volume['path']}"
+
+
+class RsyncEngine(object):
+    """Copies volumes to the staging directory of their target storage pool, with several rsync streams at once.
+
+    Without resume every attempt copies the whole volume again. With resume an interrupted transfer is kept, and the
+    next attempt uses the delta transfer algorithm to only send what's missing. Checksum makes rsync compare existing files by checksum instead of by size
+    and modification time, verify compares the checksum of the staging copy to the source after the transfer.
+    """
+
+    def __init__(self, streams=4, checksum=False, verify=False, resume=False, retries=2, log_to_slack=False):
+        self.streams = streams
+        self.checksum = checksum
+        self.verify = verify
+        self.resume = resume
+        self.retries = retries
+        self.log_to_slack = log_to_slack
+        self.transfers = []
+
+    def add(self, volume, source_host, source_pool, target_host, target_pool):
+        transfer = RsyncTransfer(volume, source_host, source_pool, target_host, target_pool)
+        self.transfers.append(transfer)
+
+        return transfer
+
+    def command(self, transfer):
+        options = [*RSYNC_OPTIONS, f'--partial-dir={PARTIAL_DIR}' if self.resume else '--whole-file']
+        if self.checksum:
+            options.append('--checksum')
+
+        return f"rsync {' '.join(options)} {transfer.source_path} rsync://{transfer.target_host['ipaddress']}/{transfer.target_pool['id']}"
+
+    def run(self):
+        """Run all transfers, returns True when all of them succeeded."""
+
+        with ThreadPoolExecutor(max_workers=self.streams) as executor:
+            # Every transfer gets its own copy of the logging context
+            futures = [executor.submit(contextvars.copy_context().run, self._transfer, transfer) for transfer in
+                       self.transfers]
+
+        return all(future.result() for future in futures)
+
+    def _transfer(self, transfer):
+        volume = transfer.volume
+        with logging.event('volume.rsync', volume['id'], name=volume['name'], dry_run=transfer.source_host.dry_run,
+                           bytes_transferred=volume['size'], source_host=transfer.source_host['name'],
+                           target_host=transfer.target_host['name'], source_pool=transfer.source_pool['name'],
+                           target_pool=transfer.target_pool['name']) as event:
+            if not self._copy(transfer, event) or (self.verify and not self._verify(transfer)):
+                transfer.state = FAILED
+                event.outcome = 'failure'
+                return False
+
+        transfer.state = SUCCEEDED
+
+        return True
+
+    def _copy(self, transfer, event):
+        volume = transfer.volume
+        logging.info(
+            f"Rsyncing volume {volume['name']} ({round(volume['size'] / 1024 / 1024 / 1024, 1)}GB) to storage pool {transfer.target_pool['name']}",
+            self.log_to_slack)
+
+        while True:
+            transfer.attempts += 1
+            try:
+                # Progress of concurrent transfers would end up interleaved on the terminal
+                transfer.source_host.execute(self.command(transfer), sudo=True, hide_stdout=self.streams > 1, pty=True)
+                return True
+            except invoke.UnexpectedExit as e:
+                if transfer.attempts > self.retries:
+                    logging.error(f"Failed to rsync volume '{volume['name']}': {e.result.stderr or e.result.stdout}",
+                                  self.log_to_slack)
+                    return False
+
+                event.retries += 1
+                logging.warning(
+                    f"Rsync of volume '{volume['name']}' failed, {'resuming' if self.resume else 'retrying'} (attempt {transfer.attempts + 1})")
+
+    def _verify(self, transfer):
+        volume = transfer.volume
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            source = executor.submit(transfer.source_host.execute, f"md5sum {transfer.source_path}", sudo=True)
+            target = executor.submit(transfer.target_host.execute, f"md5sum {transfer.staging_path}", sudo=True)
+
+        try:
+            (source, target) = (source.result(), target.result())
+        except invoke.UnexpectedExit as e:
+            logging.error(f"Failed to verify volume '{volume['name']}': {e.result.stderr or e.result.stdout}",
+                          self.log_to_slack)
+            return False
+
+        # Nothing is executed in dry run
+        if source is None or target is None:
+            return True
+
+        if source.stdout.split()[0] != target.stdout.split()[0]:
+            logging.error(f"Checksum of the copy of volume '{volume['name']}' on '{transfer.target_host['name']}' "
+                          f"doesn't match the source", self.log_to_slack)
+            return False
+
+        logging.info(f"Verified checksum of volume '{volume['name']}'")
+
+        return True
@@ -0,0 +1,607 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+import heapq
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from cs.client import cs_encode
+
+from .log import logging
+
+GiB = 1024 ** 3
+MiB = 1024 ** 2
+
+HOST_MEMORY = 512 * GiB
+VM_MEMORY_SIZES = [1024, 2048, 4096, 8192, 16384]
+VM_CPU_NUMBERS = [1, 2, 4, 8]
+ROUTER_MEMORY = 1024
+ROUTER_VERSION = '6.4.0'
+
+# Rough durations of the async jobs on a real management server, in seconds
+VM_MIGRATION_BASE_DURATION = 5
+VM_MIGRATION_SPEED = 1024 * MiB
+VOLUME_MIGRATION_SPEED = 200 * MiB
+JOB_DURATIONS = {
+    'stopVirtualMachine': 10,
+    'startVirtualMachine': 20,
+    'stopSystemVm': 10,
+    'startSystemVm': 30,
+    'rebootRouter': 20,
+    'restartVPC': 60,
+    'detachIso': 1
+}
+
+# Parameters added by the client that never filter a listing
+IGNORED_PARAMETERS = {'command', 'response', 'apikey', 'signature', 'signatureversion', 'expires', 'page', 'pagesize',
+                      'listall', 'templatefilter', 'fetch_list'}
+
+LIST_COMMANDS = {
+    'listZones': ('zones', 'zone'),
+    'listPods': ('pods', 'pod'),
+    'listClusters': ('clusters', 'cluster'),
+    'listHosts': ('hosts', 'host'),
+    'listStoragePools': ('storagepools', 'storagepool'),
+    'listVirtualMachines': ('virtualmachines', 'virtualmachine'),
+    'listRouters': ('routers', 'router'),
+    'listSystemVms': ('systemvms', 'systemvm'),
+    'listVolumes': ('volumes', 'volume'),
+    'listServiceOfferings': ('serviceofferings', 'serviceoffering'),
+    'listDomains': ('domains', 'domain'),
+    'listAccounts': ('accounts', 'account'),
+    'listProjects': ('projects', 'project'),
+    'listNetworks': ('networks', 'network'),
+    'listVPCs': ('vpcs', 'vpc'),
+    'listTemplates': ('templates', 'template'),
+    'listAffinityGroups': ('affinitygroups', 'affinitygroup'),
+    'listVMSnapshot': ('vmsnapshots', 'vmSnapshot'),
+    'listSnapshots': ('snapshots', 'snapshot')
+}
+
+# Listing filters served from an index instead of a scan of the collection
+INDEXED_PARAMETERS = ['virtualmachineid', 'hostid', 'storageid', 'clusterid']
+
+# Collections that hold project owned resources next to account owned ones
+PROJECT_COLLECTIONS = {'virtualmachines', 'routers', 'volumes', 'networks', 'vpcs'}
+
+
+class SimulatorError(Exception):
+    def __init__(self, message, code=431):
+        super().__init__(message)
+        self.code = code
+
+
+def generate_inventory(zones=1, pods=1, clusters=2, hosts=4, vms=10, routers=1, domains=10, project_ratio=0.1,
+                       seed=0):
+    """Generate a synthetic inventory, counts are per parent (clusters per pod, VMs per host, etc.)."""
+
+    rng = random.Random(seed)
+
+    def new_id():
+        return str(uuid.UUID(int=rng.getrandbits(128)))
+
+    created = (datetime(2020, 1, 1) + timedelta(days=rng.randint(0, 365))).strftime('%Y-%m-%dT%H:%M:%S+0100')
+
+    inventory = {collection: [] for (collection, _) in LIST_COMMANDS.values()}
+
+    inventory['serviceofferings'] = [
+        {'id': new_id(), 'name': f"{memory // 1024}GB-{cpu}CPU", 'memory': memory, 'cpunumber': cpu,
+         'issystem': False} for memory in VM_MEMORY_SIZES for cpu in VM_CPU_NUMBERS]
+    router_offering = {'id': new_id(), 'name': 'System Offering For Software Router', 'memory': ROUTER_MEMORY,
+                       'cpunumber': 1, 'issystem': True}
+    inventory['serviceofferings'].append(router_offering)
+
+    template = {'id': new_id(), 'name': 'Ubuntu 20.04', 'displaytext': 'Ubuntu 20.04 (simulated)'}
+    inventory['templates'].append(template)
+
+    root_domain = {'id': new_id(), 'name': 'ROOT', 'path': 'ROOT'}
+    cust_domain = {'id': new_id(), 'name': 'Cust', 'path': 'ROOT/Cust', 'parentdomainid': root_domain['id']}
+    inventory['domains'] += [root_domain, cust_domain]
+
+    owners = []
+    for d in range(domains):
+        domain = {'id': new_id(), 'name': f"customer{d}", 'path': f"ROOT/Cust/customer{d}",
+                  'parentdomainid': cust_domain['id']}
+        account = {'id': new_id(), 'name': f"admin-customer{d}", 'domain': domain['name'], 'domainid': domain['id'],
+                   'state': 'enabled'}
+        project = {'id': new_id(), 'name': f"project-customer{d}", 'domain': domain['name'],
+                   'domainid': domain['id'], 'state': 'Active'}
+        inventory['domains'].append(domain)
+        inventory['accounts'].append(account)
+        inventory['projects'].append(project)
+        owners.append((domain, account, project))
+
+    def owner_fields():
+        (domain, account, project) = rng.choice(owners)
+        fields = {'domain': domain['name'], 'domainid': domain['id'], 'account': account['name']}
+        if rng.random() < project_ratio:
+            fields.update({'project': project['name'], 'projectid': project['id']})
+
+        return fields
+
+    vm_counter = 0
+    for z in range(zones):
+        zone = {'id': new_id(), 'name': f"zone{z}", 'allocationstate': 'Enabled'}
+        inventory['zones'].append(zone)
+        zone_fields = {'zoneid': zone['id'], 'zonename': zone['name']}
+
+        for p in range(pods):
+            pod = {'id': new_id(), 'name': f"pod{z}-{p}", **zone_fields}
+            inventory['pods'].append(pod)
+
+            for c in range(clusters):
+                cluster = {'id': new_id(), 'name': f"cluster{z}-{p}-{c}", 'podid': pod['id'], 'podname': pod['name'],
+                           'allocationstate': 'Enabled', 'clustertype': 'CloudManaged', 'hypervisortype': 'KVM',
+                           **zone_fields}
+                inventory['clusters'].append(cluster)
+                cluster_fields = {'clusterid': cluster['id'], 'clustername': cluster['name'], 'podid': pod['id'],
+                                  **zone_fields}
+
+                storage_pools = []
+                for s in range(2):
+                    storage_pool = {'id': new_id(), 'name': f"{cluster['name']}-pool{s}", 'scope': 'CLUSTER',
+                                    'state': 'Up', 'type': 'NetworkFilesystem', 'disksizetotal': 100 * 1024 * GiB,
+                                    'disksizeused': 0, **cluster_fields}
+                    storage_pools.append(storage_pool)
+                inventory['storagepools'] += storage_pools
+
+                for h in range(hosts):
+                    host = {'id': new_id(), 'name': f"hv-{z}-{p}-{c}-{h:03d}.simulated", 'type': 'Routing',
+                            'state': 'Up', 'resourcestate': 'Enabled', 'hypervisor': 'KVM',
+                            'hypervisorversion': 'CentOS 7.9.2009', 'version': ROUTER_VERSION,
+                            'memorytotal': HOST_MEMORY, 'memoryallocated': 0, 'memoryused': 0, 'cpunumber': 64,
+                            'dedicated': False, 'created': created, **cluster_fields}
+                    inventory['hosts'].append(host)
+                    host_fields = {'hostid': host['id'], 'hostname': host['name']}
+
+                    for _ in range(vms):
+                        vm_counter += 1
+                        offering = rng.choice(inventory['serviceofferings'][:-1])
+                        vm = {'id': new_id(), 'name': f"vm{vm_counter}", 'instancename': f"i-{vm_counter}-VM",
+                              'displayname': f"vm{vm_counter}", 'state': 'Running', 'memory': offering['memory'],
+                              'cpunumber': offering['cpunumber'], 'serviceofferingid': offering['id'],
+                              'serviceofferingname': offering['name'], 'templateid': template['id'],
+                              'templatedisplaytext': template['displaytext'], 'maintenancepolicy': 'LiveMigrate',
+                              'created': created, 'laststartversion': ROUTER_VERSION, 'hypervisor': 'KVM',
+                              **owner_fields(), **host_fields, **zone_fields}
+                        inventory['virtualmachines'].append(vm)
+                        host['memoryallocated'] += vm['memory'] * MiB
+
+                        storage_pool = rng.choice(storage_pools)
+                        data_disks = [('DATADISK', rng.choice([50, 100, 250]) * GiB) for _ in range(rng.randint(0, 2))]
+                        for (disk_type, size) in [('ROOT', 20 * GiB)] + data_disks:
+                            volume = {'id': new_id(), 'name': f"{disk_type}-{vm_counter}", 'type': disk_type,
+                                      'size': size, 'state': 'Ready', 'path': new_id(),
+                                      'virtualmachineid': vm['id'], 'vmname': vm['name'], 'vmstate': vm['state'],
+                                      'storageid': storage_pool['id'], 'storage': storage_pool['name'],
+                                      'clusterid': cluster['id'], 'domain': vm['domain'], 'domainid': vm['domainid'],
+                                      'account': vm['account'], **zone_fields}
+                            if 'projectid' in vm:
+                                volume.update({'project': vm['project'], 'projectid': vm['projectid']})
+                            inventory['volumes'].append(volume)
+                            storage_pool['disksizeused'] += size
+
+                    for _ in range(routers):
+                        vm_counter += 1
+                        owner = owner_fields()
+                        network = {'id': new_id(), 'name': f"network{vm_counter}", 'state': 'Implemented', **owner,
+                                   **zone_fields}
+                        inventory['networks'].append(network)
+
+                        router = {'id': new_id(), 'name': f"r-{vm_counter}-VM", 'state': 'Running',
+                                  'version': ROUTER_VERSION, 'requiresupgrade': False, 'isredundantrouter': False,
+                                  'redundantstate': 'UNKNOWN', 'guestnetworkid': network['id'], 'vpcid': None,
+                                  'serviceofferingid': router_offering['id'], 'created': created,
+                                  'laststartversion': ROUTER_VERSION, 'role': 'VIRTUAL_ROUTER',
+                                  'nic': [{'id': new_id(), 'networkid': network['id']} for _ in range(3)], **owner,
+                                  **host_fields, **zone_fields}
+                        inventory['routers'].append(router)
+                        host['memoryallocated'] += ROUTER_MEMORY * MiB
+
+                    host['memoryused'] = host['memoryallocated']
+
+        # The secondary storage and console proxy VMs run on the first host of the zone
+        zone_host = next(host for host in inventory['hosts'] if host['zoneid'] == zone['id'])
+        for system_vm_type in ['secondarystoragevm', 'consoleproxy']:
+            vm_counter += 1
+            prefix = 's' if system_vm_type == 'secondarystoragevm' else 'v'
+            inventory['systemvms'].append({'id': new_id(), 'name': f"{prefix}-{vm_counter}-VM",
+                                           'systemvmtype': system_vm_type, 'state': 'Running',
+                                           'hostid': zone_host['id'], 'hostname': zone_host['name'], **zone_fields})
+            zone_host['memoryallocated'] += ROUTER_MEMORY * MiB
+            zone_host['memoryused'] = zone_host['memoryallocated']
+
+    return inventory
+
+
+class CosmicSimulator(object):
+    """Stand-in for the Cosmic management server API.
+
+    Implements the commands used by cosmicops on top of an in-memory inventory. Async jobs take a duration based on
+    the amount of data to move, scaled by time_scale, and fail with a probability of failure_rate.
+    """
+
+    def __init__(self, inventory, key='simulator', secret='simulator', time_scale=1., failure_rate=0., seed=0):
+        self.inventory = inventory
+        self.key = key
+        self.secret = secret
+        self.time_scale = time_scale
+        self.failure_rate = failure_rate
+        self.jobs = {}
+        # Jobs which are still running, ordered by the time they finish
+        self._pending_jobs = []
+        self.request_count = 0
+        self.command_counts = Counter()
+        self.clock = time.monotonic
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._index = {collection: {item['id']: item for item in items} for (collection, items) in inventory.items()}
+        self._field_indexes = {}
+
+    def verify_signature(self, params):
+        if params.get('apiKey') != self.key:
+            return False
+
+        signed = "&".join(
+            "=".join((key, cs_encode(value))) for (key, value) in sorted(params.items()) if key != 'signature')
+        digest = hmac.new(self.secret.encode('utf-8'), msg=signed.lower().encode('utf-8'),
+                          digestmod=hashlib.sha1).digest()
+
+        return hmac.compare_digest(base64.b64encode(digest).decode('utf-8'), params.get('signature', ''))
+
+    def handle(self, params):
+        """Handle an API request, returns the HTTP status code and the JSON response."""
+
+        command = params.get('command', '')
+        response_key = f"{command.lower()}response"
+
+        if not self.verify_signature(params):
+            return 401, {response_key: {'errorcode': 401,
+                                        'errortext': 'unable to verify user credentials and/or request signature'}}
+
+        with self._lock:
+            self.request_count += 1
+            self.command_counts[command] += 1
+            self._complete_jobs()
+
+            try:
+                if command in LIST_COMMANDS:
+                    result = self._list(command, params)
+                else:
+                    # Any other command may change the inventory
+                    self._field_indexes = {}
+                    handler = getattr(self, f"_cmd_{command}", None)
+                    if not handler:
+                        raise SimulatorError(f"The given command '{command}' either does not exist or is not "
+                                             f"available for the simulator", 432)
+                    result = handler(params)
+            except SimulatorError as e:
+                return e.code, {response_key: {'errorcode': e.code, 'errortext': str(e)}}
+
+        return 200, {response_key: result}
+
+    def _get(self, collection, item_id):
+        item = self._index[collection].get(item_id)
+        if not item:
+            raise SimulatorError(f"Unable to find {collection[:-1]} with id '{item_id}'")
+
+        return item
+
+    @staticmethod
+    def _matches(collection, item, params):
+        for (key, value) in params.items():
+            key = key.lower()
+            if key in IGNORED_PARAMETERS:
+                continue
+
+            if key == 'keyword':
+                if value.lower() not in ' '.join(str(item.get(field, '')) for field in
+                                                 ('name', 'instancename', 'displayname')).lower():
+                    return False
+            elif key == 'projectid' and value == '-1':
+                if 'projectid' not in item:
+                    return False
+            elif str(item.get(key)).lower() != value.lower():
+                return False
+
+        # Without a project id only resources owned by accounts are listed
+        if collection in PROJECT_COLLECTIONS and 'projectid' not in {key.lower() for key in params}:
+            return 'projectid' not in item
+
+        return True
+
+    def _field_index(self, collection, field):
+        if (collection, field) not in self._field_indexes:
+            index = {}
+            for item in self.inventory[collection]:
+                index.setdefault(str(item.get(field)).lower(), []).append(item)
+            self._field_indexes[(collection, field)] = index
+
+        return self._field_indexes[(collection, field)]
+
+    def _list(self, command, params):
+        (collection, item_key) = LIST_COMMANDS[command]
+
+        # Lookups by id or by one of the indexed parameters are common enough to skip the scan
+        candidates = self.inventory[collection]
+        indexed_parameter = next((key for key in INDEXED_PARAMETERS if params.get(key)), None)
+        if params.get('id'):
+            candidates = [self._index[collection][params['id']]] if params['id'] in self._index[collection] else []
+        elif indexed_parameter:
+            candidates = self._field_index(collection, indexed_parameter).get(params[indexed_parameter].lower(), [])
+
+        items = [item for item in candidates if self._matches(collection, item, params)]
+
+        if not items:
+            return {}
+
+        if 'page' in params:
+            page_size = int(params.get('pagesize', 500))
+            start = (int(params['page']) - 1) * page_size
+            page = items[start:start + page_size]
+        else:
+            page = items
+
+        result = {'count': len(items)}
+        if page:
+            result[item_key] = page
+
+        return result
+
+    def _new_job(self, command, duration, on_success, result_key=None, result=None, on_failure=None):
+        job_id = str(uuid.UUID(int=self._rng.getrandbits(128)))
+        self.jobs[job_id] = {
+            'jobid': job_id,
+            'cmd': command,
+            'done_at': self.clock() + duration * self.time_scale,
+            'fail': self._rng.random() < self.failure_rate,
+            'on_success': on_success,
+            'on_failure': on_failure,
+            'result_key': result_key,
+            'result': result,
+            'jobstatus': 0
+        }
+        heapq.heappush(self._pending_jobs, (self.jobs[job_id]['done_at'], len(self.jobs), job_id))
+
+        return {'jobid': job_id}
+
+    def _complete_jobs(self):
+        now = self.clock()
+        while self._pending_jobs and self._pending_jobs[0][0] <= now:
+            job = self.jobs[heapq.heappop(self._pending_jobs)[2]]
+            self._field_indexes = {}
+            if job['fail']:
+                job['jobstatus'] = 2
+                if job['on_failure']:
+                    job['on_failure']()
+            else:
+                job['jobstatus'] = 1
+                if job['on_success']:
+                    job['on_success']()
+
+    def _cmd_queryAsyncJobResult(self, params):
+        job = self.jobs.get(params.get('jobid'))
+        if not job:
+            raise SimulatorError(f"Unable to find job with id '{params.get('jobid')}'", 530)
+
+        result = {'jobid': job['jobid'], 'cmd': job['cmd'], 'jobstatus': job['jobstatus'], 'jobprocstatus': 0,
+                  'jobresultcode': 0}
+        if job['jobstatus'] == 1 and job['result_key']:
+            result['jobresult'] = {job['result_key']: job['result']}
+        elif job['jobstatus'] == 2:
+            result['jobresultcode'] = 530
+            result['jobresult'] = {'errorcode': 530, 'errortext': f"Simulated failure of '{job['cmd']}'"}
+
+        return result
+
+    def _move_to_host(self, vm, host, memory):
+        if vm.get('hostid'):
+            source_host = self._get('hosts', vm['hostid'])
+            source_host['memoryallocated'] -= memory * MiB
+            source_host['memoryused'] = source_host['memoryallocated']
+
+        if host:
+            vm.update({'hostid': host['id'], 'hostname': host['name']})
+            host['memoryallocated'] += memory * MiB
+            host['memoryused'] = host['memoryallocated']
+        else:
+            vm.pop('hostid', None)
+            vm.pop('hostname', None)
+
+    def _migrate(self, command, collection, params, memory=None):
+        vm = self._get(collection, params.get('virtualmachineid'))
+        host = self._get('hosts', params.get('hostid'))
+        memory = memory or vm['memory']
+
+        if vm['state'] != 'Running':
+            raise SimulatorError(f"VM '{vm['name']}' is not running, unable to migrate")
+        if host['id'] == vm.get('hostid'):
+            raise SimulatorError(f"VM '{vm['name']}' is already running on host '{host['name']}'")
+        if host['resourcestate'] != 'Enabled' or host['state'] != 'Up':
+            raise SimulatorError(f"Host '{host['name']}' is not available for migration")
+
+        vm['state'] = 'Migrating'
+
+        def on_success():
+            vm['state'] = 'Running'
+            self._move_to_host(vm, host, memory)
+
+        def on_failure():
+            vm['state'] = 'Running'
+
+        duration = VM_MIGRATION_BASE_DURATION + memory * MiB / VM_MIGRATION_SPEED
+        return self._new_job(command, duration, on_success, collection[:-1], vm, on_failure)
+
+    def _cmd_migrateVirtualMachine(self, params):
+        return self._migrate('migrateVirtualMachine', 'virtualmachines', params)
+
+    def _cmd_migrateVirtualMachineWithVolume(self, params):
+        return self._migrate('migrateVirtualMachineWithVolume', 'virtualmachines', params)
+
+    def _cmd_migrateSystemVm(self, params):
+        collection = 'routers' if params.get('virtualmachineid') in self._index['routers'] else 'systemvms'
+        return self._migrate('migrateSystemVm', collection, params, ROUTER_MEMORY)
+
+    def _cmd_migrateVolume(self, params):
+        volume = self._get('volumes', params.get('volumeid'))
+        storage_pool = self._get('storagepools', params.get('storageid'))
+
+        if volume['storageid'] == storage_pool['id']:
+            raise SimulatorError(f"Volume '{volume['name']}' is already on storage pool '{storage_pool['name']}'")
+
+        volume['state'] = 'Migrating'
+
+        def on_success():
+            source_pool = self._get('storagepools', volume['storageid'])
+            source_pool['disksizeused'] -= volume['size']
+            storage_pool['disksizeused'] += volume['size']
+            volume.update({'state': 'Ready', 'storageid': storage_pool['id'], 'storage': storage_pool['name'],
+                           'clusterid': storage_pool.get('clusterid'), 'path': str(uuid.UUID(
+                               int=self._rng.getrandbits(128)))})
+
+        def on_failure():
+            volume['state'] = 'Ready'
+
+        return self._new_job('migrateVolume', volume['size'] / VOLUME_MIGRATION_SPEED, on_success, 'volume', volume,
+                             on_failure)
+
+    def _cmd_findHostsForMigration(self, params):
+        vm_id = params.get('virtualmachineid')
+        collection = next((c for c in ('virtualmachines', 'routers', 'systemvms') if vm_id in self._index[c]),
+                          'virtualmachines')
+        vm = self._get(collection, vm_id)
+        memory = vm.get('memory', ROUTER_MEMORY)
+        current_host = self._index['hosts'].get(vm.get('hostid'), {})
+
+        hosts = []
+        for host in self.inventory['hosts']:
+            if host['id'] == current_host.get('id') or host.get('podid') != current_host.get('podid'):
+                continue
+
+            available = host['memorytotal'] - host['memoryallocated']
+            suitable = host['resourcestate'] == 'Enabled' and host['state'] == 'Up' and available >= memory * MiB
+            hosts.append({**host,
+                          'suitableformigration': suitable,
+                          'requiresStorageMotion': host['clusterid'] != current_host.get('clusterid')})
+
+        return {'count': len(hosts), 'host': hosts} if hosts else {}
+
+    def _cmd_updateHost(self, params):
+        host = self._get('hosts', params.get('id'))
+
+        allocation_state = params.get('allocationstate')
+        if allocation_state:
+            host['resourcestate'] = 'Enabled' if allocation_state.lower() == 'enable' else 'Disabled'
+
+        if 'hosttags' in params:
+            host['hosttags'] = params['hosttags'].strip()
+
+        return {'host': host}
+
+    def _stop(self, command, collection, params):
+        vm = self._get(collection, params.get('id'))
+
+        def on_success():
+            vm['state'] = 'Stopped'
+            self._move_to_host(vm, None, vm.get('memory', ROUTER_MEMORY))
+
+        return self._new_job(command, JOB_DURATIONS[command], on_success, collection[:-1], vm)
+
+    def _start(self, command, collection, params):
+        vm = self._get(collection, params.get('id'))
+        memory = vm.get('memory', ROUTER_MEMORY)
+
+        if params.get('hostid'):
+            host = self._get('hosts', params['hostid'])
+        else:
+            candidates = [host for host in self.inventory['hosts'] if
+                          host['resourcestate'] == 'Enabled' and host['state'] == 'Up' and
+                          host['zoneid'] == vm['zoneid'] and host['memorytotal'] - host['memoryallocated'] >= memory * MiB]
+            if not candidates:
+                raise SimulatorError(f"Unable to find a host with capacity to start VM '{vm['name']}'")
+            host = min(candidates, key=lambda h: h['memoryallocated'])
+
+        def on_success():
+            vm['state'] = 'Running'
+            self._move_to_host(vm, host, memory)
+
+        return self._new_job(command, JOB_DURATIONS[command], on_success, collection[:-1], vm)
+
+    def _cmd_stopVirtualMachine(self, params):
+        return self._stop('stopVirtualMachine', 'virtualmachines', params)
+
+    def _cmd_startVirtualMachine(self, params):
+        return self._start('startVirtualMachine', 'virtualmachines', params)
+
+    def _cmd_stopSystemVm(self, params):
+        return self._stop('stopSystemVm', 'systemvms', params)
+
+    def _cmd_startSystemVm(self, params):
+        return self._start('startSystemVm', 'systemvms', params)
+
+    def _cmd_rebootRouter(self, params):
+        router = self._get('routers', params.get('id'))
+        return self._new_job('rebootRouter', JOB_DURATIONS['rebootRouter'], None, 'router', router)
+
+    def _cmd_restartVPC(self, params):
+        vpc = self._get('vpcs', params.get('id'))
+        return self._new_job('restartVPC', JOB_DURATIONS['restartVPC'], None, 'vpc', vpc)
+
+    def _cmd_detachIso(self, params):
+        vm = self._get('virtualmachines', params.get('virtualmachineid'))
+
+        def on_success():
+            vm.pop('isoid', None)
+
+        return self._new_job('detachIso', JOB_DURATIONS['detachIso'], on_success, 'virtualmachine', vm)
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    simulator = None
+
+    def _respond(self, params):
+        (status, response) = self.simulator.handle(params)
+        body = json.dumps(response).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond(dict(parse_qsl(urlparse(self.path).query, keep_blank_values=True)))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._respond(dict(parse_qsl(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)))
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def create_server(simulator, host='127.0.0.1', port=8096):
+    handler = type('BoundSimulatorRequestHandler', (SimulatorRequestHandler,), {'simulator': simulator})
+
+    return ThreadingHTTPServer((host, port), handler)
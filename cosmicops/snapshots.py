@@ -0,0 +1,81 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .lazy import lazy_import
+from .log import logging
+
+cs = lazy_import('cs')
+
+
+class SnapshotIndex(object):
+    """VM and volume snapshots of many VMs, listed at once instead of for every VM and every volume.
+
+    The snapshots of regular and project resources are listed, optionally limited to a domain. Volume snapshots can
+    also be limited to a zone, the VM snapshot listing can't be. Until the index is loaded, or when loading failed, the
+    snapshots of every VM and volume are listed separately.
+
+    The index is loaded once per batch. A VM without snapshots in the index is checked again on its own when it's
+    looked up right before its migration, so a VM snapshot made while a long batch runs isn't missed.
+    """
+
+    def __init__(self, ops, domainid=None, zoneid=None):
+        self._ops = ops
+        self.domainid = domainid
+        self.zoneid = zoneid
+        self.loaded = False
+        self.vm_snapshots = {}
+        self.volume_snapshots = {}
+
+    def load(self):
+        self.loaded = False
+        try:
+            vm_snapshots = self._list('listVMSnapshot', domainid=self.domainid)
+            volume_snapshots = self._list('listSnapshots', domainid=self.domainid, zoneid=self.zoneid)
+        except cs.CloudStackException as e:
+            logging.warning(f"Failed to list snapshots, checking every VM separately: {e}")
+            return False
+
+        self.vm_snapshots = self._index(vm_snapshots, 'virtualmachineid')
+        self.volume_snapshots = self._index(volume_snapshots, 'volumeid')
+        self.loaded = True
+        logging.debug(f"Found {len(vm_snapshots)} VM snapshots and {len(volume_snapshots)} volume snapshots")
+
+        return True
+
+    def get_vm_snapshots(self, vm):
+        if not self.loaded:
+            return vm.get_snapshots()
+
+        return self.vm_snapshots.get(vm['id']) or vm.get_snapshots()
+
+    def get_volume_snapshots(self, volume):
+        if not self.loaded:
+            return volume.get_snapshots()
+
+        return self.volume_snapshots.get(volume['id'], [])
+
+    def _list(self, list_function, **kwargs):
+        kwargs = {k: v for (k, v) in kwargs.items() if v is not None}
+        func = getattr(self._ops.cs, list_function)
+
+        return func(fetch_list=True, listall='true', **kwargs) + \
+            func(fetch_list=True, listall='true', projectid=-1, **kwargs)
+
+    @staticmethod
+    def _index(snapshots, key):
+        index = {}
+        for snapshot in snapshots:
+            index.setdefault(snapshot[key], []).append(snapshot)
+
+        return index
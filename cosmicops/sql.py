@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import logging
+import json
 from configparser import NoOptionError
 
-import pymysql
-
 from cosmicops import get_config
+from .cache import sql_pool
+from .lazy import lazy_import
 from .log import logging
+from .traffic import traffic
+
+pymysql = lazy_import('pymysql')
 
 
 class CosmicSQL(object):
@@ -30,6 +33,7 @@ class CosmicSQL(object):
         self.password = password
         self.dry_run = dry_run
         self.conn = None
+        self._id_cache = {}
 
         self._connect()
 
@@ -40,6 +44,10 @@ class CosmicSQL(object):
         return [section for section in config if 'host' in config[section]]
 
     def _connect(self):
+        if traffic.mode == 'replay':
+            logging.debug(f"Replaying SQL traffic instead of connecting to '{self.server}'")
+            return
+
         if not self.password:
             config = get_config()
             logging.debug(f"Loading SQL server details for '{self.server}''")
@@ -59,15 +67,22 @@ class CosmicSQL(object):
                 raise
 
         try:
-            self.conn = pymysql.connect(host=self.server, port=self.port, user=self.user, password=self.password,
-                                        database=self.database)
+            self.conn = sql_pool.connect(host=self.server, port=self.port, user=self.user, password=self.password,
+                                         database=self.database)
         except pymysql.Error as e:
             logging.error(f"Error connecting to server '{self.server}': {e}")
             raise
 
         self.conn.autocommit = False
+        traffic.add_secret(self.password)
 
     def _execute_select_query(self, query):
+        if traffic.mode:
+            return traffic.call('sql', ' '.join(query.split()), lambda: self._run_select_query(query))
+
+        return self._run_select_query(query)
+
+    def _run_select_query(self, query):
         cursor = self.conn.cursor()
 
         try:
@@ -83,6 +98,13 @@ class CosmicSQL(object):
             cursor.close()
 
     def _execute_update_query(self, query, args=()):
+        if traffic.mode:
+            key = f"{' '.join(query.split())} {json.dumps(args, default=str)}"
+            return traffic.call('sql', key, lambda: self._run_update_query(query, args))
+
+        return self._run_update_query(query, args)
+
+    def _run_update_query(self, query, args=()):
         cursor = self.conn.cursor()
 
         try:
@@ -99,6 +121,99 @@ class CosmicSQL(object):
 
         return True
 
+    def _execute_update_queries(self, query, args_list):
+        if traffic.mode:
+            key = f"{' '.join(query.split())} {json.dumps(args_list, default=str)}"
+            return traffic.call('sql', key, lambda: self._run_update_queries(query, args_list))
+
+        return self._run_update_queries(query, args_list)
+
+    def _run_update_queries(self, query, args_list):
+        # All rows are updated in a single transaction, a failure leaves none of them changed
+        cursor = self.conn.cursor()
+
+        try:
+            cursor.executemany(query, args_list)
+            if self.dry_run:
+                for args in args_list:
+                    logging.info(f'Would have executed: {query % args}')
+            else:
+                self.conn.commit()
+        except pymysql.Error as e:
+            self.conn.rollback()
+            logging.error(f'Error while executing query "{query}" for {len(args_list)} rows: {e}')
+            return False
+        finally:
+            cursor.close()
+
+        return True
+
+    def _get_cached_id(self, kind, name, query):
+        cache = self._id_cache.setdefault(kind, {})
+
+        if name not in cache:
+            cache[name] = self._execute_select_query(query)[0][0]
+        else:
+            logging.debug(f"Using cached {kind} id for '{name}'")
+
+        return cache[name]
+
+    def _fill_id_cache(self, kind, query):
+        cache = self._id_cache.setdefault(kind, {})
+
+        for (name, id_) in self._execute_select_query(query):
+            # Keep the first match, like the single lookups do
+            cache.setdefault(name, id_)
+
+        return len(cache)
+
+    def invalidate_id_cache(self, kind=None):
+        if kind:
+            self._id_cache.pop(kind, None)
+        else:
+            self._id_cache = {}
+
+    def prefetch_offering_ids(self):
+        service_offering_query = """
+        SELECT name, id
+        FROM service_offering_view
+        WHERE removed IS NULL
+          AND domain_path LIKE '/Cust/%'
+        """
+
+        disk_offering_query = """
+        SELECT name, id
+        FROM disk_offering_view
+        WHERE removed IS NULL
+          AND domain_name='Cust'
+        """
+
+        self._fill_id_cache('service_offering', service_offering_query)
+        self._fill_id_cache('disk_offering', disk_offering_query)
+
+    def prefetch_storage_pool_ids(self):
+        query = """
+        SELECT name, id
+        FROM storage_pool
+        WHERE removed IS NULL
+        """
+
+        self._fill_id_cache('storage_pool', query)
+
+    def prefetch_instance_ids(self, instance_names):
+        if not instance_names:
+            return
+
+        names = ', '.join([f"'{instance_name}'" for instance_name in instance_names])
+        query = f"""
+        SELECT instance_name, id
+        FROM vm_instance
+        WHERE instance_name IN ({names})
+          AND removed IS NULL
+        """
+
+        self._fill_id_cache('instance', query)
+
     def kill_jobs_of_instance(self, instance_id):
         queries = [
             'DELETE FROM `async_job` WHERE `instance_id` = %s',
@@ -238,7 +353,7 @@ class CosmicSQL(object):
         LIMIT 1
         """
 
-        return self._execute_select_query(query)[0][0]
+        return self._get_cached_id('instance', instance_name, query)
 
     def get_disk_offering_id_from_name(self, disk_offering_name):
         query = f"""
@@ -249,7 +364,7 @@ class CosmicSQL(object):
           AND name = '{disk_offering_name}'
         """
 
-        return self._execute_select_query(query)[0][0]
+        return self._get_cached_id('disk_offering', disk_offering_name, query)
 
     def get_service_offering_id_from_name(self, service_offering_name):
         query = f"""
@@ -260,7 +375,7 @@ class CosmicSQL(object):
           AND domain_path LIKE '/Cust/%'
         """
 
-        return self._execute_select_query(query)[0][0]
+        return self._get_cached_id('service_offering', service_offering_name, query)
 
     def get_affinity_group_id_from_name(self, affinity_group_name):
         query = f"""
@@ -269,7 +384,7 @@ class CosmicSQL(object):
         WHERE name = '{affinity_group_name}'
         """
 
-        return int(self._execute_select_query(query)[0][0])
+        return int(self._get_cached_id('affinity_group', affinity_group_name, query))
 
     def update_zwps_to_cwps(self, disk_offering_name, instance_name=None, volume_id=None):
         disk_offering_id = self.get_disk_offering_id_from_name(disk_offering_name)
@@ -343,7 +458,7 @@ class CosmicSQL(object):
           AND name = '{storage_pool_name}'
         """
 
-        return self._execute_select_query(query)[0][0]
+        return self._get_cached_id('storage_pool', storage_pool_name, query)
 
     def update_storage_pool_id(self, volume_db_id, current_pool_db_id, new_pool_db_id):
 
@@ -351,8 +466,158 @@ class CosmicSQL(object):
 
         return self._execute_update_query(query, (new_pool_db_id, current_pool_db_id, volume_db_id))
 
+    def update_storage_pool_ids(self, updates):
+
+        query = "UPDATE volumes SET pool_id=%s, last_pool_id=%s WHERE id=%s"
+
+        return self._execute_update_queries(query, [(new_pool_db_id, current_pool_db_id, volume_db_id) for
+                                                    (volume_db_id, current_pool_db_id, new_pool_db_id) in updates])
+
     def set_vm_state(self, instance_name, status_name):
 
         query = "UPDATE vm_instance SET state=%s WHERE instance_name=%s"
 
         return self._execute_update_query(query, (status_name, instance_name))
+
+    @staticmethod
+    def _get_inventory_location_filter(cluster_name=None, pod_name=None, zone_name=None):
+        location_filter = ''
+
+        if cluster_name:
+            location_filter += f" AND cluster.name = '{cluster_name}'"
+        if pod_name:
+            location_filter += f" AND host_pod_ref.name = '{pod_name}'"
+        if zone_name:
+            location_filter += f" AND data_center.name = '{zone_name}'"
+
+        return location_filter
+
+    @staticmethod
+    def _get_inventory_owner_filter(domain_name=None, project_name=None, only_project=False):
+        if project_name:
+            return f" AND projects.name = '{project_name}'"
+        elif only_project:
+            return ' AND projects.id IS NOT NULL'
+        elif domain_name:
+            return f" AND domain.name = '{domain_name}' AND projects.id IS NULL"
+
+        return ' AND projects.id IS NULL'
+
+    def get_inventory_hosts(self, cluster_name=None, pod_name=None, zone_name=None):
+        location_filter = self._get_inventory_location_filter(cluster_name, pod_name, zone_name)
+
+        query = f"""
+        SELECT cluster.name AS cluster,
+               host.name,
+               host.ram
+        FROM host
+        JOIN cluster ON cluster.id = host.cluster_id
+        JOIN host_pod_ref ON host_pod_ref.id = cluster.pod_id
+        JOIN data_center ON data_center.id = cluster.data_center_id
+        WHERE host.removed IS NULL
+          AND host.type = 'Routing'{location_filter}
+        ORDER BY cluster.name, host.name
+        """
+
+        return self._execute_select_query(query)
+
+    def get_inventory_vms(self, cluster_name=None, pod_name=None, zone_name=None, domain_name=None,
+                          project_name=None, only_project=False, keyword_filter=None):
+        location_filter = self._get_inventory_location_filter(cluster_name, pod_name, zone_name)
+        owner_filter = self._get_inventory_owner_filter(domain_name, project_name, only_project)
+
+        if keyword_filter:
+            keyword_query = f"""
+          AND (vm.name LIKE '%{keyword_filter}%'
+               OR vm.display_name LIKE '%{keyword_filter}%'
+               OR vm.instance_name LIKE '%{keyword_filter}%')"""
+        else:
+            keyword_query = ''
+
+        query = f"""
+        SELECT cluster.name AS cluster,
+               vm.name,
+               COALESCE(volume_sizes.size, 0) AS storage,
+               vm_template.display_text,
+               COALESCE(service_offering.ram_size, memory_detail.value) AS memory,
+               COALESCE(service_offering.cpu, cpu_detail.value) AS cpunumber,
+               vm.instance_name,
+               host.name AS hostname,
+               domain.name AS domain,
+               account.account_name,
+               projects.name AS project,
+               vm.created,
+               vm.last_start_version
+        FROM vm_instance vm
+        JOIN host ON host.id = vm.host_id
+        JOIN cluster ON cluster.id = host.cluster_id
+        JOIN host_pod_ref ON host_pod_ref.id = cluster.pod_id
+        JOIN data_center ON data_center.id = cluster.data_center_id
+        JOIN domain ON domain.id = vm.domain_id
+        JOIN account ON account.id = vm.account_id
+        LEFT JOIN projects ON projects.project_account_id = vm.account_id AND projects.removed IS NULL
+        LEFT JOIN vm_template ON vm_template.id = vm.vm_template_id
+        LEFT JOIN service_offering ON service_offering.id = vm.service_offering_id
+        LEFT JOIN user_vm_details memory_detail ON memory_detail.vm_id = vm.id AND memory_detail.name = 'memory'
+        LEFT JOIN user_vm_details cpu_detail ON cpu_detail.vm_id = vm.id AND cpu_detail.name = 'cpuNumber'
+        LEFT JOIN (SELECT instance_id,
+                          SUM(size) AS size
+                   FROM volumes
+                   WHERE removed IS NULL
+                   GROUP BY instance_id) volume_sizes ON volume_sizes.instance_id = vm.id
+        WHERE vm.removed IS NULL
+          AND vm.type = 'User'{location_filter}{owner_filter}{keyword_query}
+        ORDER BY cluster.name, host.name, vm.name
+        """
+
+        return self._execute_select_query(query)
+
+    def get_inventory_routers(self, cluster_name=None, pod_name=None, zone_name=None, domain_name=None,
+                              project_name=None, only_project=False):
+        location_filter = self._get_inventory_location_filter(cluster_name, pod_name, zone_name)
+        owner_filter = self._get_inventory_owner_filter(domain_name, project_name, only_project)
+
+        query = f"""
+        SELECT cluster.name AS cluster,
+               vm.name,
+               domain_router.template_version,
+               COALESCE(nic_counts.nic_count, 0) AS nic_count,
+               service_offering.ram_size AS memory,
+               service_offering.cpu AS cpunumber,
+               host.name AS hostname,
+               domain.name AS domain,
+               account.account_name,
+               projects.name AS project,
+               vm.created,
+               vm.last_start_version,
+               domain_router.is_redundant_router,
+               domain_router.redundant_state,
+               domain_router.vpc_id,
+               COALESCE(vpc.name, router_networks.name) AS network_name
+        FROM vm_instance vm
+        JOIN domain_router ON domain_router.id = vm.id
+        JOIN host ON host.id = vm.host_id
+        JOIN cluster ON cluster.id = host.cluster_id
+        JOIN host_pod_ref ON host_pod_ref.id = cluster.pod_id
+        JOIN data_center ON data_center.id = cluster.data_center_id
+        JOIN domain ON domain.id = vm.domain_id
+        JOIN account ON account.id = vm.account_id
+        LEFT JOIN projects ON projects.project_account_id = vm.account_id AND projects.removed IS NULL
+        LEFT JOIN service_offering ON service_offering.id = vm.service_offering_id
+        LEFT JOIN vpc ON vpc.id = domain_router.vpc_id
+        LEFT JOIN (SELECT router_network_ref.router_id,
+                          MIN(networks.name) AS name
+                   FROM router_network_ref
+                   JOIN networks ON networks.id = router_network_ref.network_id
+                   GROUP BY router_network_ref.router_id) router_networks ON router_networks.router_id = vm.id
+        LEFT JOIN (SELECT instance_id,
+                          COUNT(*) AS nic_count
+                   FROM nics
+                   WHERE removed IS NULL
+                   GROUP BY instance_id) nic_counts ON nic_counts.instance_id = vm.id
+        WHERE vm.removed IS NULL
+          AND vm.type = 'DomainRouter'{location_filter}{owner_filter}
+        ORDER BY cluster.name, host.name, vm.name
+        """
+
+        return self._execute_select_query(query)
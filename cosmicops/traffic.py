@@ -0,0 +1,228 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+
+from .lazy import lazy_import
+from .log import logging
+
+cs = lazy_import('cs')
+invoke = lazy_import('invoke')
+pymysql = lazy_import('pymysql')
+
+ARCHIVE_VERSION = 1
+CHANNELS = ['api', 'sql', 'ssh']
+SCRUBBED = '********'
+SECRET_KEYS = {'apikey', 'secretkey', 'signature', 'password', 'userapikey', 'usersecretkey', 'privatekey',
+               'sessionkey', 'token'}
+
+
+class TrafficClient(object):
+    """Proxy for the CloudStack client which sends every API command through the traffic recorder or replayer."""
+
+    def __init__(self, client, traffic):
+        self._client = client
+        self._traffic = traffic
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def traffic_command(*args, **kwargs):
+            key = f"{name} {json.dumps(self._traffic.scrub(kwargs), sort_keys=True, default=str)}"
+
+            return self._traffic.call('api', key, lambda: attr(*args, **kwargs))
+
+        return traffic_command
+
+
+class ReplayResult(object):
+    def __init__(self, stdout='', stderr='', return_code=0):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.return_code = return_code
+
+    @property
+    def ok(self):
+        return self.return_code == 0
+
+    @property
+    def failed(self):
+        return not self.ok
+
+
+class CosmicTraffic(object):
+    """Records API, SQL and SSH traffic of a real run to an archive, or serves it back from one.
+
+    Secrets are scrubbed before they end up in the archive. Responses to a request are replayed in the recorded order,
+    the last response is repeated when a request is made more often than it was recorded.
+
+    Any script can be recorded or replayed by setting COSMICOPS_RECORD_TRAFFIC or COSMICOPS_REPLAY_TRAFFIC to the
+    archive path. COSMICOPS_REPLAY_LATENCY adds a fixed delay in seconds to every replayed response.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.path = None
+        self.latency = 0.
+        self.time_scale = 0.
+        self.secrets = set()
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._positions = {}
+
+    def record(self, path):
+        self.mode = 'record'
+        self.path = path
+        self._responses = {channel: {} for channel in CHANNELS}
+        self._positions = {}
+        atexit.register(self.save)
+
+        logging.info(f"Recording API, SQL and SSH traffic to '{path}'")
+
+    def replay(self, path, latency=0., time_scale=0.):
+        with gzip.open(path, 'rt') as f:
+            archive = json.load(f)
+
+        if archive.get('version') != ARCHIVE_VERSION:
+            raise RuntimeError(f"Unsupported traffic archive version '{archive.get('version')}' in '{path}'")
+
+        self.mode = 'replay'
+        self.path = path
+        self.latency = latency
+        self.time_scale = time_scale
+        self._responses = {channel: archive.get(channel, {}) for channel in CHANNELS}
+        self._positions = {}
+
+        logging.info(f"Replaying API, SQL and SSH traffic from '{path}'")
+
+    def wrap_client(self, client):
+        return TrafficClient(client, self)
+
+    def disable(self):
+        self.mode = None
+
+    def add_secret(self, secret):
+        if secret:
+            self.secrets.add(str(secret))
+
+    def scrub(self, value):
+        if isinstance(value, dict):
+            return {k: SCRUBBED if k.lower() in SECRET_KEYS else self.scrub(v) for (k, v) in value.items()}
+        elif isinstance(value, (list, tuple)):
+            return [self.scrub(v) for v in value]
+        elif isinstance(value, str):
+            for secret in self.secrets:
+                value = value.replace(secret, SCRUBBED)
+
+        return value
+
+    def call(self, channel, key, func):
+        key = self.scrub(key)
+
+        if self.mode == 'replay':
+            return self._replay(channel, key)
+
+        start = time.monotonic()
+        try:
+            result = func()
+        except (cs.CloudStackException, pymysql.Error, invoke.UnexpectedExit) as e:
+            self._store(channel, key, {'error': self._dump_error(channel, e), 'duration': time.monotonic() - start})
+            raise
+
+        self._store(channel, key, {'result': self._dump_result(channel, result), 'duration': time.monotonic() - start})
+
+        return result
+
+    def save(self):
+        if self.mode != 'record':
+            return
+
+        with self._lock, gzip.open(self.path, 'wt') as f:
+            json.dump({'version': ARCHIVE_VERSION, **self._responses}, f, default=str)
+
+    def _store(self, channel, key, response):
+        with self._lock:
+            self._responses[channel].setdefault(key, []).append(self.scrub(response))
+
+    def _replay(self, channel, key):
+        responses = self._responses[channel].get(key)
+        if not responses:
+            raise RuntimeError(f"No recorded {channel} response for '{key}'")
+
+        with self._lock:
+            position = self._positions.get((channel, key), 0)
+            self._positions[(channel, key)] = min(position + 1, len(responses) - 1)
+
+        response = responses[position]
+
+        latency = self.latency.get(channel, 0.) if isinstance(self.latency, dict) else self.latency
+        delay = latency + self.time_scale * response.get('duration', 0.)
+        if delay > 0:
+            time.sleep(delay)
+
+        if 'error' in response:
+            raise self._load_error(channel, key, response['error'])
+
+        return self._load_result(channel, response['result'])
+
+    @staticmethod
+    def _dump_result(channel, result):
+        if channel == 'ssh':
+            if result is None:
+                return None
+            return {'stdout': result.stdout, 'stderr': result.stderr, 'return_code': result.return_code}
+
+        return result
+
+    @staticmethod
+    def _load_result(channel, result):
+        if channel == 'ssh':
+            return ReplayResult(**result) if result is not None else None
+        elif channel == 'sql' and isinstance(result, list):
+            return tuple(tuple(row) for row in result)
+
+        return result
+
+    @staticmethod
+    def _dump_error(channel, error):
+        if channel == 'ssh':
+            return {'stdout': error.result.stdout, 'stderr': error.result.stderr, 'exited': error.result.exited}
+
+        return {'message': str(error)}
+
+    @staticmethod
+    def _load_error(channel, key, error):
+        if channel == 'api':
+            return cs.CloudStackApiException(error['message'], error={'errortext': error['message']}, response=None)
+        elif channel == 'sql':
+            return pymysql.Error(error['message'])
+
+        return invoke.UnexpectedExit(invoke.Result(stdout=error['stdout'], stderr=error['stderr'], command=key,
+                                                   exited=error['exited']))
+
+
+traffic = CosmicTraffic()
+
+if os.environ.get('COSMICOPS_RECORD_TRAFFIC'):
+    traffic.record(os.environ['COSMICOPS_RECORD_TRAFFIC'])
+elif os.environ.get('COSMICOPS_REPLAY_TRAFFIC'):
+    traffic.replay(os.environ['COSMICOPS_REPLAY_TRAFFIC'],
+                   latency=float(os.environ.get('COSMICOPS_REPLAY_LATENCY', 0.)))
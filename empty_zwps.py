@@ -21,7 +21,8 @@ import random
 import click
 import click_log
 
-from cosmicops import logging, CosmicOps, CosmicSQL
+from cosmicops import logging, metrics, CosmicOps, CosmicSQL, MigrationClients, MigrationWindowScheduler, \
+    SnapshotIndex
 
 from live_migrate_virtual_machine import live_migrate
 from live_migrate_virtual_machine_volumes import live_migrate_volumes
@@ -29,14 +30,25 @@ from live_migrate_virtual_machine_volumes import live_migrate_volumes
 
 @click.command()
 @click.option('--dry-run/--exec', is_flag=True, default=True, show_default=True, help='Enable/disable dry-run')
+@click.option('--profile-api', is_flag=True, help='Print a summary of the API calls made at exit')
+@click.option('--profile-api-file', metavar='<file>', help='Also write the API call summary as JSON to this file')
+@click.option('--metrics-file', metavar='<file>',
+              help='Write progress metrics to this file in the node_exporter textfile format')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 @click.option('--virtual-machines', '-m', required=True, multiple=True,
               help='name of a virtualmachine, regex supported (e.g.: tla[td].*) (multiple are allowed)')
 @click.option('--force-end-hour', '-t',
-              help='End hour after which we do not start new migrations. Example: 23 for 23:00 or 14 for 14:00')
+              help='End hour after which we do not start new migrations, migrations predicted to end later are not '
+                   'started either. Example: 23 for 23:00 or 14 for 14:00')
+@click.option('--max-running', metavar='<#>', default=1, show_default=True,
+              help='Maximum number of VMs migrated at the same time')
+@click.option('--throughput', metavar='<MB/s>', type=int,
+              help='Migration throughput assumed for predictions until the first migration has finished '
+                   '[default: median of the migration history, or 100]')
 @click.argument('zwps_cluster')
 @click.argument('destination_cluster')
-def main(dry_run, zwps_cluster, destination_cluster, virtual_machines, force_end_hour):
+def main(dry_run, zwps_cluster, destination_cluster, virtual_machines, force_end_hour, max_running, throughput,
+         profile_api, profile_api_file, metrics_file):
     """Empty ZWPS by migrating VMs and/or it's volumes to the destination cluster."""
 
     click_log.basic_config()
@@ -62,6 +74,10 @@ def main(dry_run, zwps_cluster, destination_cluster, virtual_machines, force_end
         logging.warning('Running in dry-run mode, will only show changes')
 
     co = CosmicOps(profile=profile, dry_run=dry_run, log_to_slack=log_to_slack)
+    if profile_api:
+        co.enable_api_profiling(profile_api_file)
+    if metrics_file:
+        metrics.enable(metrics_file)
 
     if not dry_run:
         cs = CosmicSQL(server=profile, dry_run=dry_run)
@@ -122,32 +138,57 @@ def main(dry_run, zwps_cluster, destination_cluster, virtual_machines, force_end
     for vm in vms:
         logging.info(f" - '{vm['name']}'")
 
+    # The snapshots of all VMs are listed once, instead of for every VM and volume when it's migrated
+    snapshots = SnapshotIndex(co, zoneid=target_cluster['zoneid'])
+    snapshots.load()
+
     logging.info(
         f"Starting live migration of volumes and/or virtualmachines from the ZWPS storage pools to storage pool '{target_cluster['name']}'")
 
-    for vm in vms:
-        """ Can we start a new migration? """
-        if force_end_hour:
-            now = datetime.datetime.now(pytz.timezone('CET'))
-            if now.hour >= force_end_hour:
-                logging.info(
-                    f"Stopping migration batch. We are not starting new migrations after '{force_end_hour}':00",
-                    log_to_slack=log_to_slack)
-                sys.exit(0)
-
-        source_host = co.get_host(id=vm['hostid'])
-        source_cluster = co.get_cluster(zone='nl2', id=source_host['clusterid'])
+    window_end = None
+    if force_end_hour:
+        now = datetime.datetime.now(pytz.timezone('CET'))
+        if now.hour >= force_end_hour:
+            logging.info(f"Stopping migration batch. We are not starting new migrations after '{force_end_hour}':00",
+                         log_to_slack=log_to_slack)
+            sys.exit(0)
+        window_end = now.replace(hour=force_end_hour, minute=0, second=0, microsecond=0).timestamp()
+
+    # The hosts of the target cluster are listed once, every VM reserves its memory on the host it's sent to
+    capacity = target_cluster.get_capacity_model()
+
+    # The VMs are migrated together with their volumes, so only those migrations are used to predict the throughput
+    scheduler = MigrationWindowScheduler(window_end, max_running, throughput * 1024 * 1024 if throughput else None,
+                                         log_to_slack, operation='job.wait_for_vm_migration')
+    clients = MigrationClients(co, cs, profile, concurrent=max_running > 1)
+
+    def migrate_vm(vm):
+        (vm_co, vm_cs) = clients.get()
+
+        source_host = vm_co.get_host(id=vm['hostid'])
+        source_cluster = vm_co.get_cluster(zone='nl2', id=source_host['clusterid'])
         if source_cluster['name'] == target_cluster['name']:
             """ VM is already on the destination cluster, so we only need to migrate the volumes to this storage pool """
             logging.info(
                 f"Starting live migration of volumes of VM '{vm['name']}' to storage pool '{target_storage_pool['name']}' ({target_storage_pool['id']})",
                 log_to_slack=log_to_slack)
-            live_migrate_volumes(target_storage_pool['name'], co, cs, dry_run, False, log_to_slack, 0, vm['name'], True)
+            return live_migrate_volumes(target_storage_pool['name'], vm_co, vm_cs, dry_run, False, False, log_to_slack,
+                                        0, vm['name'], True)
         else:
             """ VM needs to be migrated live to the destination cluster, including volumes """
-            live_migrate(co=co, cs=cs, cluster=target_cluster['name'], vm_name=vm['name'], destination_dc=None,
-                         add_affinity_group=None, is_project_vm=None, zwps_to_cwps=True, log_to_slack=log_to_slack,
-                         dry_run=dry_run)
+            return live_migrate(co=vm_co, cs=vm_cs, cluster=target_cluster['name'], vm_name=vm['name'],
+                                destination_dc=None, add_affinity_group=None, is_project_vm=None, zwps_to_cwps=True,
+                                log_to_slack=log_to_slack, dry_run=dry_run, capacity=capacity, snapshots=snapshots)
+
+    for vm in vms:
+        size = sum(v['size'] for v in vm.get_volumes()) + vm['memory'] * 1024 * 1024
+        scheduler.add(vm['name'], size, lambda vm=vm: migrate_vm(vm))
+
+    not_started = scheduler.run()
+    if not_started:
+        logging.info(
+            f"Stopping migration batch. {len(not_started)} VMs are not predicted to finish before '{force_end_hour}':00",
+            log_to_slack=log_to_slack)
 
 
 if __name__ == '__main__':
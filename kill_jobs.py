@@ -17,6 +17,7 @@ import click
 import click_log
 
 from cosmicops import logging
+from cosmicops.daemon import forward_or_run
 from cosmicops.kill_jobs import kill_jobs
 
 
@@ -37,4 +38,4 @@ def main(profile, dry_run, instance_id):
 
 
 if __name__ == '__main__':
-    main()
+    forward_or_run(main)
@@ -17,6 +17,7 @@ import click
 import click_log
 
 from cosmicops import logging
+from cosmicops.daemon import forward_or_run
 from cosmicops.list_ha_workers import list_ha_workers
 
 
@@ -36,4 +37,4 @@ def main(profile, hostname, name_filter, non_running, plain_display):
 
 
 if __name__ == '__main__':
-    main()
+    forward_or_run(main)
@@ -24,14 +24,23 @@ from cosmicops.list_orphaned_disks import list_orphaned_disks
 @click.option('--profile', '-p', metavar='<name>', required=True,
               help='Name of the CloudMonkey profile containing the credentials')
 @click.option('--cluster', '-t', metavar='<cluster>', help='Show only results for this cluster')
+@click.option('--max-workers', metavar='<#>', default=8, show_default=True,
+              help='Number of storage pool and API listings to run concurrently')
+@click.option('--max-ssh-sessions', metavar='<#>', default=2, show_default=True,
+              help='Number of concurrent SSH file listings per host')
+@click.option('--incremental', is_flag=True,
+              help='Only rescan changed directories and report changes since the previous incremental run')
+@click.option('--manifest-file', metavar='<file>',
+              help='File to keep the storage pool manifests in (default: ~/.cosmicops/manifest.db)')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 @click.argument('zone_name')
-def main(profile, cluster, zone_name):
+def main(profile, cluster, max_workers, max_ssh_sessions, incremental, manifest_file, zone_name):
     """Search primary storage pools in ZONE for orphaned disks."""
 
     click_log.basic_config()
 
-    logging.info(list_orphaned_disks(profile, cluster, zone_name))
+    logging.info(list_orphaned_disks(profile, cluster, zone_name, max_workers, max_ssh_sessions, incremental,
+                                     manifest_file))
 
 
 if __name__ == '__main__':
@@ -22,7 +22,8 @@ import humanfriendly
 import logging as log_module
 from tabulate import tabulate
 
-from cosmicops import CosmicOps, logging
+from cosmicops import CosmicOps, CosmicSQL, logging
+from cosmicops.daemon import forward_or_run
 
 orphan_table_headers = [
     'Domain',
@@ -43,6 +44,22 @@ storage_pool_table_headers = [
     'Real space used (GB)'
 ]
 
+cluster_table_headers = [
+    'VM',
+    'Storage',
+    'Template',
+    'Router nic count',
+    'Router version',
+    'Memory',
+    'Cores',
+    'Instance',
+    'Host',
+    'Domain',
+    'Account',
+    'Created',
+    'LastRebootVersion'
+]
+
 
 @click.command()
 @click.option('--profile', '-p', metavar='<name>', required=True,
@@ -68,12 +85,17 @@ storage_pool_table_headers = [
 @click.option('--only-summary', is_flag=True, help='Only show summary of results')
 @click.option('--no-summary', is_flag=True, help='Hide the summary')
 @click.option('--log-file', metavar='<logfile>', help='Write output to file (and to screen)')
+@click.option('--source', type=click.Choice(['api', 'db']), default='api', show_default=True,
+              help='Build the report from API calls or from a few queries on the database')
+@click.option('--profile-api', is_flag=True, help='Print a summary of the API calls made at exit')
+@click.option('--profile-api-file', metavar='<file>', help='Also write the API call summary as JSON to this file')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 def main(profile, domain_name, cluster_name, pod_name, zone_name, keyword_filter, only_routers,
          only_routers_to_be_upgraded,
          no_routers,
          router_nic_count, nic_count_is_minimum, nic_count_is_maximum, router_max_version, router_min_version,
-         project_name, only_project, ignore_domains, calling_credentials, only_summary, no_summary, log_file):
+         project_name, only_project, ignore_domains, calling_credentials, only_summary, no_summary, log_file, source,
+         profile_api, profile_api_file):
     """List VMs"""
 
     click_log.basic_config()
@@ -85,12 +107,32 @@ def main(profile, domain_name, cluster_name, pod_name, zone_name, keyword_filter
         logging.error("The project and domain options can't be used together")
         sys.exit(1)
 
-    co = CosmicOps(profile=profile, dry_run=False)
-
     if ignore_domains:
         ignore_domains = ignore_domains.replace(' ', '').split(',')
         logging.info(f"Ignoring domains: {str(ignore_domains)}")
 
+    router_filters = {
+        'router_min_version': router_min_version,
+        'router_max_version': router_max_version,
+        'router_nic_count': router_nic_count,
+        'nic_count_is_minimum': nic_count_is_minimum,
+        'nic_count_is_maximum': nic_count_is_maximum
+    }
+
+    if source == 'db':
+        if calling_credentials or only_routers_to_be_upgraded:
+            logging.error("The --calling-credentials and --only-routers-to-be-upgraded options can't be used with '--source db'")
+            sys.exit(1)
+
+        cs = CosmicSQL(server=profile, dry_run=False)
+        list_vms_from_db(cs, domain_name, cluster_name, pod_name, zone_name, keyword_filter, only_routers, no_routers,
+                         router_filters, project_name, only_project, ignore_domains, only_summary, no_summary)
+        sys.exit(0)
+
+    co = CosmicOps(profile=profile, dry_run=False)
+    if profile_api:
+        co.enable_api_profiling(profile_api_file)
+
     if calling_credentials:
         table_headers = [
             'VM',
@@ -204,22 +246,6 @@ def main(profile, domain_name, cluster_name, pod_name, zone_name, keyword_filter
         cluster_vm_memory = 0
         cluster_storage = 0
         cluster_cores = 0
-
-        cluster_table_headers = [
-            'VM',
-            'Storage',
-            'Template',
-            'Router nic count',
-            'Router version',
-            'Memory',
-            'Cores',
-            'Instance',
-            'Host',
-            'Domain',
-            'Account',
-            'Created',
-            'LastRebootVersion'
-        ]
         cluster_table_data = []
 
         for host in hosts:
@@ -274,22 +300,9 @@ def main(profile, domain_name, cluster_name, pod_name, zone_name, keyword_filter
                 if router['domain'] in ignore_domains:
                     continue
 
-                if router_min_version and LooseVersion(router['version']) < LooseVersion(router_min_version):
+                if skip_router(router['version'], len(router['nic']), **router_filters):
                     continue
 
-                if router_max_version and LooseVersion(router['version']) > LooseVersion(router_max_version):
-                    continue
-
-                if router_nic_count and nic_count_is_minimum:
-                    if router_nic_count > len(router['nic']):
-                        continue
-                elif router_nic_count and nic_count_is_maximum:
-                    if router_nic_count < len(router['nic']):
-                        continue
-                elif router_nic_count:
-                    if router_nic_count != len(router['nic']):
-                        continue
-
                 if only_routers_to_be_upgraded and not router['requiresupgrade']:
                     continue
 
@@ -360,23 +373,157 @@ def main(profile, domain_name, cluster_name, pod_name, zone_name, keyword_filter
             logging.info(tabulate(cluster_table_data, headers=cluster_table_headers, tablefmt='pretty'))
 
         if not no_summary:  # pragma: no cover
-            logging.info(f"\nSummary for '{cluster['name']}':")
-            logging.info(f"Number of VMs: {cluster_vm_counter}")
-            logging.info(f"Number of hosts: {cluster_host_counter}")
-            logging.info(
-                f"Allocated memory: {humanfriendly.format_size(cluster_vm_memory * 1024 ** 2, binary=True)} / {humanfriendly.format_size(cluster_host_memory, binary=True)}")
-            logging.info(f"Allocated cores: {cluster_cores}")
-            logging.info(f"Allocated storage: {humanfriendly.format_size(cluster_storage, binary=True)}")
+            log_cluster_summary(cluster['name'], cluster_vm_counter, cluster_host_counter, cluster_vm_memory,
+                                cluster_host_memory, cluster_cores, cluster_storage)
+
+    if not no_summary:  # pragma: no cover
+        log_grand_totals(total_vm_counter, total_host_counter, total_vm_memory, total_host_memory, total_cores,
+                         total_storage)
+
+
+def skip_router(version, nic_count, router_min_version=None, router_max_version=None, router_nic_count=None,
+                nic_count_is_minimum=False, nic_count_is_maximum=False):
+    if router_min_version and LooseVersion(version) < LooseVersion(router_min_version):
+        return True
+
+    if router_max_version and LooseVersion(version) > LooseVersion(router_max_version):
+        return True
+
+    if router_nic_count and nic_count_is_minimum:
+        if router_nic_count > nic_count:
+            return True
+    elif router_nic_count and nic_count_is_maximum:
+        if router_nic_count < nic_count:
+            return True
+    elif router_nic_count:
+        if router_nic_count != nic_count:
+            return True
+
+    return False
+
+
+def log_cluster_summary(cluster_name, vm_counter, host_counter, vm_memory, host_memory, cores, storage):
+    logging.info(f"\nSummary for '{cluster_name}':")
+    logging.info(f"Number of VMs: {vm_counter}")
+    logging.info(f"Number of hosts: {host_counter}")
+    logging.info(
+        f"Allocated memory: {humanfriendly.format_size(vm_memory * 1024 ** 2, binary=True)} / {humanfriendly.format_size(host_memory, binary=True)}")
+    logging.info(f"Allocated cores: {cores}")
+    logging.info(f"Allocated storage: {humanfriendly.format_size(storage, binary=True)}")
+
+
+def log_grand_totals(vm_counter, host_counter, vm_memory, host_memory, cores, storage):
+    logging.info('\n==================  Grand Totals ===============')
+    logging.info(f"Total number of VMs: {vm_counter}")
+    logging.info(f"Total number of hosts: {host_counter}")
+    logging.info(
+        f"Total allocated memory: {humanfriendly.format_size(vm_memory * 1024 ** 2, binary=True)} / {humanfriendly.format_size(host_memory, binary=True)}")
+    logging.info(f"Total allocated cores: {cores}")
+    logging.info(f"Total allocated storage: {humanfriendly.format_size(storage, binary=True)}")
+
+
+def list_vms_from_db(cs, domain_name, cluster_name, pod_name, zone_name, keyword_filter, only_routers, no_routers,
+                     router_filters, project_name, only_project, ignore_domains, only_summary, no_summary):
+    clusters = {}
+
+    for (cluster, _, memory) in cs.get_inventory_hosts(cluster_name, pod_name, zone_name):
+        cluster_data = clusters.setdefault(cluster, {'hosts': 0, 'host_memory': 0, 'vms': 0, 'vm_memory': 0,
+                                                     'cores': 0, 'storage': 0, 'table_data': []})
+        cluster_data['hosts'] += 1
+        cluster_data['host_memory'] += int(memory or 0)
+
+    if not clusters:
+        logging.warning('No hosts found')
+
+    if not only_routers:
+        for (cluster, name, storage, template, memory, cores, instance_name, hostname, domain, account, project,
+             created, last_start_version) in cs.get_inventory_vms(cluster_name, pod_name, zone_name, domain_name,
+                                                                  project_name, only_project, keyword_filter):
+            if cluster not in clusters or domain in ignore_domains:
+                continue
+
+            memory = int(memory or 0)
+            cores = int(cores or 0)
+
+            cluster_data = clusters[cluster]
+            cluster_data['vms'] += 1
+            cluster_data['storage'] += int(storage)
+            cluster_data['vm_memory'] += memory
+            cluster_data['cores'] += cores
+
+            cluster_data['table_data'].append([
+                name,
+                humanfriendly.format_size(int(storage), binary=True),
+                template,
+                '-',
+                '-',
+                humanfriendly.format_size(memory * 1024 ** 2, binary=True),
+                cores,
+                instance_name,
+                hostname,
+                domain,
+                f"Proj: {project}" if project else account,
+                created,
+                last_start_version
+            ])
+
+    if not no_routers:
+        for (cluster, name, version, nic_count, memory, cores, hostname, domain, account, project, created,
+             last_start_version, is_redundant_router, redundant_state, vpc_id, network_name) \
+                in cs.get_inventory_routers(cluster_name, pod_name, zone_name, domain_name, project_name,
+                                            only_project):
+            if cluster not in clusters or domain in ignore_domains:
+                continue
+
+            if skip_router(version or '0', nic_count, **router_filters):
+                continue
+
+            cluster_data = clusters[cluster]
+            cluster_data['vms'] += 1
+
+            if memory is not None:
+                cluster_data['vm_memory'] += int(memory)
+                cluster_data['cores'] += int(cores)
+                memory = humanfriendly.format_size(int(memory) * 1024 ** 2, binary=True)
+            else:
+                memory = 'Unknown'
+                cores = 'Unknown'
+
+            if not is_redundant_router:
+                redundant_state = 'VPC' if vpc_id else 'SINGLE'
+
+            display_name = f"{network_name or name} ({str(redundant_state).lower()})"
+
+            cluster_data['table_data'].append([
+                display_name,
+                '-',
+                '-',
+                nic_count,
+                version,
+                memory,
+                cores,
+                name,
+                hostname,
+                domain,
+                f"Proj: {project}" if project else account,
+                created,
+                last_start_version
+            ])
+
+    for cluster, cluster_data in clusters.items():
+        if not only_summary:  # pragma: no cover
+            logging.info(tabulate(cluster_data['table_data'], headers=cluster_table_headers, tablefmt='pretty'))
+
+        if not no_summary:  # pragma: no cover
+            log_cluster_summary(cluster, cluster_data['vms'], cluster_data['hosts'], cluster_data['vm_memory'],
+                                cluster_data['host_memory'], cluster_data['cores'], cluster_data['storage'])
 
     if not no_summary:  # pragma: no cover
-        logging.info('\n==================  Grand Totals ===============')
-        logging.info(f"Total number of VMs: {total_vm_counter}")
-        logging.info(f"Total number of hosts: {total_host_counter}")
-        logging.info(
-            f"Total allocated memory: {humanfriendly.format_size(total_vm_memory * 1024 ** 2, binary=True)} / {humanfriendly.format_size(total_host_memory, binary=True)}")
-        logging.info(f"Total allocated cores: {total_cores}")
-        logging.info(f"Total allocated storage: {humanfriendly.format_size(total_storage, binary=True)}")
+        log_grand_totals(sum([c['vms'] for c in clusters.values()]), sum([c['hosts'] for c in clusters.values()]),
+                         sum([c['vm_memory'] for c in clusters.values()]),
+                         sum([c['host_memory'] for c in clusters.values()]),
+                         sum([c['cores'] for c in clusters.values()]), sum([c['storage'] for c in clusters.values()]))
 
 
 if __name__ == '__main__':
-    main()
+    forward_or_run(main)
@@ -18,18 +18,27 @@ import sys
 import click
 import click_log
 
-from cosmicops import CosmicOps, logging, CosmicSQL
+from cosmicops import CosmicOps, logging, CosmicSQL, HostEvacuationScheduler, MigrationClients, SnapshotIndex
 from live_migrate_virtual_machine import live_migrate
 
 
 @click.command()
 @click.option('--profile', '-p', default='config', help='Name of the CloudMonkey profile containing the credentials')
 @click.option('--destination-dc', '-d', metavar='<DC name>', help='Migrate to this datacenter')
+@click.option('--parallel', is_flag=True,
+              help='Plan the destination host and storage pool of all VMs up front, and migrate them concurrently')
+@click.option('--max-running', metavar='<#>', type=click.IntRange(1), default=4, show_default=True,
+              help='Maximum number of concurrent migrations with --parallel')
+@click.option('--max-per-pool', metavar='<#>', type=click.IntRange(1), default=1, show_default=True,
+              help='Maximum number of concurrent migrations to one storage pool with --parallel')
 @click.option('--dry-run/--exec', is_flag=True, default=True, show_default=True, help='Enable/disable dry-run')
+@click.option('--profile-api', is_flag=True, help='Print a summary of the API calls made at exit')
+@click.option('--profile-api-file', metavar='<file>', help='Also write the API call summary as JSON to this file')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 @click.argument('host')
 @click.argument('cluster')
-def main(profile, destination_dc, dry_run, host, cluster):
+def main(profile, destination_dc, parallel, max_running, max_per_pool, dry_run, host, cluster, profile_api,
+         profile_api_file):
     """Migrate all VMs on HOST to CLUSTER"""
 
     click_log.basic_config()
@@ -43,6 +52,8 @@ def main(profile, destination_dc, dry_run, host, cluster):
         logging.warning('Running in dry-run mode, will only show changes')
 
     co = CosmicOps(profile=profile, dry_run=dry_run, log_to_slack=log_to_slack)
+    if profile_api:
+        co.enable_api_profiling(profile_api_file)
 
     cs = CosmicSQL(server=profile, dry_run=dry_run)
 
@@ -50,10 +61,41 @@ def main(profile, destination_dc, dry_run, host, cluster):
     if not host:
         sys.exit(1)
 
+    source_cluster = co.get_cluster(id=host['clusterid'])
+    if not source_cluster:
+        sys.exit(1)
+
+    target_cluster = co.get_cluster(name=cluster)
+    if not target_cluster:
+        sys.exit(1)
+
+    # All VMs of the host share the same offerings, resolve them in one go for the migrations to another datacenter
+    if destination_dc:
+        cs.prefetch_offering_ids()
+
+    snapshots = SnapshotIndex(co, zoneid=host['zoneid'])
+    snapshots.load()
+
+    # The hosts of the target cluster are listed once, every VM reserves its memory on the host it's sent to
+    scheduler = HostEvacuationScheduler(target_cluster, max_running=max_running if parallel else 1,
+                                        max_per_target_pool=max_per_pool if parallel else 1, log_to_slack=log_to_slack)
+
     for vm in host.get_all_vms() + host.get_all_project_vms():
-        live_migrate(co=co, cs=cs, cluster=cluster, vm_name=vm['name'], destination_dc=destination_dc,
-                     add_affinity_group=None, is_project_vm=None, zwps_to_cwps=None, log_to_slack=log_to_slack,
-                     dry_run=dry_run)
+        scheduler.add(vm)
+
+    clients = MigrationClients(co, cs, profile, concurrent=scheduler.max_running > 1)
+
+    def migrate(vm, destination_host, target_pool):
+        (vm_co, vm_cs) = clients.get()
+        return live_migrate(co=vm_co, cs=vm_cs, cluster=cluster, vm_name=vm['name'], destination_dc=destination_dc,
+                            add_affinity_group=None, is_project_vm=None, zwps_to_cwps=None, log_to_slack=log_to_slack,
+                            dry_run=dry_run, target_cluster=target_cluster, source_host=host,
+                            source_cluster=source_cluster, destination_host=destination_host, target_pool=target_pool,
+                            snapshots=snapshots)
+
+    if not scheduler.run(migrate):
+        logging.error(f"Not all VMs of host '{host['name']}' were migrated to cluster '{cluster}'", log_to_slack)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
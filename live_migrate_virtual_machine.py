@@ -23,7 +23,7 @@ import click_log
 import click_spinner
 from datetime import datetime
 
-from cosmicops import CosmicOps, logging, CosmicSQL
+from cosmicops import ConvergencePolicy, CosmicOps, logging, CosmicSQL, RsyncEngine, SnapshotIndex
 
 DATACENTERS = ["SBP1", "EQXAMS2", "EVO"]
 
@@ -33,6 +33,12 @@ DATACENTERS = ["SBP1", "EQXAMS2", "EVO"]
 @click.option('--zwps-to-cwps', is_flag=True, help='Migrate from ZWPS to CWPS')
 @click.option('--migrate-offline-with-rsync', is_flag=True, help='Migrate offline using rsync. Use for large disks.')
 @click.option('--rsync-target-host', help='Name of the rsync target server')
+@click.option('--rsync-streams', metavar='<#>', default=4, show_default=True,
+              help='Number of volumes rsynced at the same time')
+@click.option('--rsync-checksum', is_flag=True, help='Let rsync compare files by checksum instead of size and mtime')
+@click.option('--rsync-verify', is_flag=True, help='Verify the checksum of every volume after it was rsynced')
+@click.option('--rsync-resume', is_flag=True,
+              help='Keep interrupted transfers, so a retry only sends the missing data using rsync delta transfer')
 @click.option('--add-affinity-group', metavar='<group name>', help='Add this affinity group after migration')
 @click.option('--destination-dc', '-d', metavar='<DC name>', help='Migrate to this datacenter')
 @click.option('--is-project-vm', is_flag=True, help='The specified VM is a project VM')
@@ -42,12 +48,22 @@ DATACENTERS = ["SBP1", "EQXAMS2", "EVO"]
               help='Enable/disable migration within cluster')
 @click.option('--only-within-cluster', is_flag=True, default=False, show_default=True,
               help='Only do migration within cluster')
+@click.option('--max-migration-bandwidth', metavar='<MiB/s>', type=int, default=0,
+              help='Raise the bandwidth of a live migration which does not converge up to this limit')
+@click.option('--max-migration-downtime', metavar='<ms>', type=int, default=0,
+              help='Raise the maximum downtime of a live migration which does not converge up to this limit')
+@click.option('--abort-stuck-migration', is_flag=True,
+              help='Abort a live migration which does not converge within the limits above')
 @click.option('--dry-run/--exec', is_flag=True, default=True, show_default=True, help='Enable/disable dry-run')
+@click.option('--profile-api', is_flag=True, help='Print a summary of the API calls made at exit')
+@click.option('--profile-api-file', metavar='<file>', help='Also write the API call summary as JSON to this file')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 @click.argument('vm-name')
 @click.argument('cluster', required=False)
-def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, add_affinity_group, destination_dc, is_project_vm,
-         avoid_storage_pool, skip_backingfile_merge, skip_within_cluster, only_within_cluster, dry_run, vm_name, cluster):
+def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, rsync_streams, rsync_checksum,
+         rsync_verify, rsync_resume, add_affinity_group, destination_dc, is_project_vm, avoid_storage_pool,
+         skip_backingfile_merge, skip_within_cluster, only_within_cluster, max_migration_bandwidth,
+         max_migration_downtime, abort_stuck_migration, dry_run, vm_name, cluster, profile_api, profile_api_file):
     """Live migrate VM"""
     """Unless --migrate-offline-with-rsync is passed, then we migrate offline"""
     # TODO break this down into funtions no more than 30 lines  # noqa
@@ -72,6 +88,8 @@ def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, a
         logging.warning('Running in dry-run mode, will only show changes')
 
     co = CosmicOps(profile=profile, dry_run=dry_run, log_to_slack=log_to_slack)
+    if profile_api:
+        co.enable_api_profiling(profile_api_file)
 
     cs = CosmicSQL(server=profile, dry_run=dry_run)
 
@@ -89,6 +107,11 @@ def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, a
         logging.error(f"We need a cluster name if you're not only migrating within the cluster!")
         sys.exit(1)
 
+    convergence = None
+    if max_migration_bandwidth or max_migration_downtime or abort_stuck_migration:
+        convergence = ConvergencePolicy(max_bandwidth=max_migration_bandwidth, max_downtime=max_migration_downtime,
+                                        abort=abort_stuck_migration)
+
     if not migrate_offline_with_rsync:
         if not vm['state'] == 'Running':
             logging.error(f"Cannot migrate, VM has has state: '{vm['state']}'")
@@ -97,14 +120,14 @@ def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, a
         source_host = co.get_host(id=vm['hostid'])
         source_cluster = co.get_cluster(id=source_host['clusterid'])
         if not skip_within_cluster:
-            if not vm.migrate_within_cluster(vm=vm, source_cluster=source_cluster,
-                                                      source_host=source_host):
+            if not vm.migrate_within_cluster(vm=vm, source_cluster=source_cluster, source_host=source_host,
+                                             instancename=vm['instancename'], convergence=convergence):
                 logging.info(f"VM Migration failed at {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}\n")
                 sys.exit(1)
 
         if not only_within_cluster:
             if not live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, is_project_vm, zwps_to_cwps,
-                                log_to_slack, dry_run):
+                                log_to_slack, dry_run, convergence):
                 logging.info(f"VM Migration failed at {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}\n")
                 sys.exit(1)
         logging.info(f"VM Migration completed at {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}\n")
@@ -181,11 +204,11 @@ def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, a
 
         volumes = vm.get_volumes()
         volume_id = 0
-        volume_counter = 0
         volume_destination_map = {}
+        rsync_engine = RsyncEngine(streams=rsync_streams, checksum=rsync_checksum, verify=rsync_verify,
+                                   resume=rsync_resume, log_to_slack=log_to_slack)
 
         for volume in volumes:
-            volume_counter += 1
 
             storage_pools = sorted(target_cluster.get_storage_pools(), key=lambda h: h['disksizeused'])
             for storage_pool in storage_pools:
@@ -238,49 +261,59 @@ def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, a
             logging.info(f"Making sure staging folder /mnt/{target_storage_pool['id']}/staging/ exists on '{target_storage_pool['name']}'..")
             target_host.execute(f"mkdir -p /mnt/{target_storage_pool['id']}/staging/", sudo=True, hide_stdout=False, pty=True)
 
-            logging.info(
-                f"Rsyncing volume {volume['name']} ({round(volume['size']/1024/1024/1024, 1)}GB) to storage pool {target_storage_pool['name']}"
-                f" ({ volume_counter }/{ len(volumes) })", log_to_slack=not dry_run)
-
             # rsync volume naar staging
-            source_host.execute(f"rsync -avP --sparse --whole-file --block-size=4096 /mnt/{source_storage_pool['id']}/{volume['path']} rsync://{target_host['ipaddress']}/{target_storage_pool['id']}",
-                                sudo=True, hide_stdout=False, pty=True)
+            rsync_engine.add(volume, source_host, source_storage_pool, target_host, target_storage_pool)
 
             volume_id += 1
 
+        # All volumes are rsync'ed at the same time, so the downtime depends on the largest volume
+        if not rsync_engine.run():
+            logging.error(f"Rsync of the volumes of VM '{vm_name}' failed, VM is left in Migrating state",
+                          log_to_slack=True)
+            sys.exit(1)
+
         # Here all the disks are rsync'ed
         # We could implement something that can do this again to copy changed blocks
 
         logging.info(
-            f"Finished migrating { volume_counter } volumes", log_to_slack=not dry_run)
+            f"Finished migrating { len(rsync_engine.transfers) } volumes", log_to_slack=not dry_run)
+
+        # Check if VM is still stopped
+        vm = co.get_vm(name=vm_name, is_project_vm=is_project_vm)
+        if not dry_run and vm['state'] != 'Migrating':
+            logging.error(f"Cannot migrate, VM has state: '{vm['state']}'")
+            sys.exit(1)
 
         # Finally, move volumes in place and update the db
+        pool_updates = []
         for volume in volumes:
-            # Check if VM is still stopped
-            vm = co.get_vm(name=vm_name, is_project_vm=is_project_vm)
-            if not dry_run and vm['state'] != 'Migrating':
-                logging.error(f"Cannot migrate, VM has state: '{vm['state']}'")
-                sys.exit(1)
-
             # skip if we did not rsync the volume
             if volume['id'] not in volume_destination_map:
                 continue
             target_storage_pool = volume_destination_map[volume['id']]['target_storage_pool']
-            source_storage_pool = volume_destination_map[volume['id']]['source_storage_pool']
-            source_host_id = volume_destination_map[volume['id']]['source_host_id']
-            source_host = co.get_host(id=source_host_id)
             target_host_id = volume_destination_map[volume['id']]['target_host_id']
             target_host = co.get_host(id=target_host_id)
 
             # move volume from staging to live
             target_host.execute(f"mv /mnt/{target_storage_pool['id']}/staging/{volume['path']} /mnt/{target_storage_pool['id']}/{volume['path']}",
                                 sudo=True, hide_stdout=False, pty=True)
-            # Update db
-            cs = CosmicSQL(server=profile, dry_run=dry_run)
             volume_db_id = cs.get_volume_db_id(path=volume['path'])
             current_pool_db_id = cs.get_storage_pool_id_from_name(storage_pool_name=volume['storage'])
             target_pool_db_id = cs.get_storage_pool_id_from_name(storage_pool_name=target_storage_pool['name'])
-            cs.update_storage_pool_id(volume_db_id=volume_db_id, current_pool_db_id=current_pool_db_id, new_pool_db_id=target_pool_db_id)
+            pool_updates.append((volume_db_id, current_pool_db_id, target_pool_db_id))
+
+        # Update db, all volumes at once so a failure doesn't leave the VM with volumes on both pools
+        if not cs.update_storage_pool_ids(pool_updates):
+            logging.error(f"Updating the storage pools of the volumes of VM '{vm_name}' failed, investigate!",
+                          log_to_slack=True)
+            sys.exit(1)
+
+        for volume in volumes:
+            if volume['id'] not in volume_destination_map:
+                continue
+            target_storage_pool = volume_destination_map[volume['id']]['target_storage_pool']
+            source_storage_pool = volume_destination_map[volume['id']]['source_storage_pool']
+            source_host = co.get_host(id=volume_destination_map[volume['id']]['source_host_id'])
 
             # Add safety check via API: is volume on the expected storage pool now?
             if not dry_run:
@@ -326,12 +359,16 @@ def main(profile, zwps_to_cwps, migrate_offline_with_rsync, rsync_target_host, a
 
 
 def live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, is_project_vm, zwps_to_cwps,
-                 log_to_slack, dry_run):
+                 log_to_slack, dry_run, convergence=None, capacity=None, target_cluster=None, source_host=None,
+                 source_cluster=None, destination_host=None, target_pool=None, snapshots=None):
+    # An evacuation of a host resolves the clusters and source host once and plans the destination of every VM, the
+    # source is looked up again when the VM has moved in the meantime
     if destination_dc and destination_dc not in DATACENTERS:
         logging.error(f"Unknown datacenter '{destination_dc}', should be one of {str(DATACENTERS)}")
         return False
 
-    target_cluster = co.get_cluster(name=cluster)
+    if target_cluster is None:
+        target_cluster = co.get_cluster(name=cluster)
     if not target_cluster:
         logging.error(f"Cannot migrate, cluster '{cluster}' not found!")
         return False
@@ -345,7 +382,11 @@ def live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, i
         logging.error(f"Cannot migrate, VM has state: '{vm['state']}'")
         return False
 
-    for vm_snapshot in vm.get_snapshots():
+    # Batches check the snapshots of all their VMs with a single SnapshotIndex
+    if snapshots is None:
+        snapshots = SnapshotIndex(co)
+
+    for vm_snapshot in snapshots.get_vm_snapshots(vm):
         logging.error(f"Cannot migrate, VM has VM snapshots: '{vm_snapshot['name']}'")
         return False
 
@@ -358,11 +399,13 @@ def live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, i
     logging.vm_name = vm['name']
     logging.zone_name = vm['zonename']
 
-    source_host = co.get_host(id=vm['hostid'])
+    if source_host is None or source_host['id'] != vm['hostid']:
+        source_host = co.get_host(id=vm['hostid'])
     if not source_host:
         return False
 
-    source_cluster = co.get_cluster(id=source_host['clusterid'])
+    if source_cluster is None or source_cluster['id'] != source_host['clusterid']:
+        source_cluster = co.get_cluster(id=source_host['clusterid'])
     if not source_cluster:
         return False
 
@@ -411,7 +454,7 @@ def live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, i
     data_disks_to_zwps = []
     zwps_disks_to_cwps = []
     for volume in vm.get_volumes():
-        for snapshot in volume.get_snapshots():
+        for snapshot in snapshots.get_volume_snapshots(volume):
             logging.error(f"Cannot migrate, volume '{volume['name']}' has snapshot: '{snapshot['name']}'")
             return False
 
@@ -465,7 +508,8 @@ def live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, i
 
     logging.info(f"ROOT disk is at storage pool: '{root_disk['storage']}'")
 
-    destination_host = target_cluster.find_migration_host(vm)
+    if destination_host is None:
+        destination_host = target_cluster.find_migration_host(vm, capacity=capacity)
     if not destination_host:
         logging.info(
             f"No hypervisor found to migrate to for VM '{vm['name']}'. Dedication?")
@@ -487,19 +531,24 @@ def live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, i
 
     migrate_with_volume = False if root_storage_pool['scope'] == 'ZONE' else True
 
+    volume_pools = None
     if migrate_with_volume:
+        target_pools = [target_pool] if target_pool else co.get_all_storage_pools(clusterid=target_cluster['id'])
         for volume in vm.get_volumes():
-            for target_pool in co.get_all_storage_pools(clusterid=target_cluster['id']):
+            for pool in target_pools:
                 if not co.clean_old_disk_file(host=destination_host, dry_run=dry_run, volume=volume,
-                                              target_pool_name=target_pool['name']):
+                                              target_pool_name=pool['name']):
                     logging.error(f"Cleaning volume '{root_disk['name']}' failed")
                     return False
 
-    if not vm.migrate(destination_host, with_volume=migrate_with_volume,
-                      source_host=source_host, instancename=vm['instancename']):
+        if target_pool:
+            volume_pools = [(volume, target_pool) for volume in [root_disk, *data_disks_to_zwps]]
+
+    if not vm.migrate(destination_host, with_volume=migrate_with_volume, volume_pools=volume_pools,
+                      source_host=source_host, instancename=vm['instancename'], convergence=convergence):
         return False
 
-    with click_spinner.spinner():
+    with click_spinner.spinner(disable=not co.show_progress):
         while True:
             vm.refresh()
 
@@ -527,23 +576,23 @@ def live_migrate(co, cs, cluster, vm_name, destination_dc, add_affinity_group, i
 
     if not migrate_with_volume:
         vm.refresh()
-        target_pool = choice(target_cluster.get_storage_pools(scope='CLUSTER'))
+        pool = target_pool or choice(target_cluster.get_storage_pools(scope='CLUSTER'))
         if not temp_migrate_volume(co=co, dry_run=dry_run, log_to_slack=log_to_slack, volume=root_disk,
-                                   vm=vm, target_pool_name=target_pool['name']):
+                                   vm=vm, target_pool_name=pool['name']):
             logging.error(f"Volume '{root_disk['name']}'failed to migrate")
             return False
         if cwps_found and zwps_found:
             for volume in data_disks_to_zwps:
-                target_pool = choice(target_cluster.get_storage_pools(scope='CLUSTER'))
+                pool = target_pool or choice(target_cluster.get_storage_pools(scope='CLUSTER'))
                 if not temp_migrate_volume(co=co, dry_run=dry_run, log_to_slack=log_to_slack, volume=volume,
-                                           vm=vm, target_pool_name=target_pool['name']):
+                                           vm=vm, target_pool_name=pool['name']):
                     logging.error(f"Volume '{volume['name']}'failed to migrate")
                     return False
         if zwps_to_cwps:
             for volume in zwps_disks_to_cwps:
-                target_pool = choice(target_cluster.get_storage_pools(scope='CLUSTER'))
+                pool = target_pool or choice(target_cluster.get_storage_pools(scope='CLUSTER'))
                 if not temp_migrate_volume(co=co, dry_run=dry_run, log_to_slack=log_to_slack, volume=volume,
-                                           vm=vm, target_pool_name=target_pool['name']):
+                                           vm=vm, target_pool_name=pool['name']):
                     logging.error(f"Volume '{volume['name']}'failed to migrate")
                     return False
 
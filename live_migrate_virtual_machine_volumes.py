@@ -14,13 +14,12 @@
 # limitations under the License.
 
 import sys
-import time
 
 import click
 import click_log
 import click_spinner
 
-from cosmicops import CosmicOps, logging, CosmicSQL
+from cosmicops import AdaptivePoll, CosmicOps, logging, CosmicSQL, VolumeMigrationTracker
 
 
 @click.command()
@@ -30,11 +29,19 @@ from cosmicops import CosmicOps, logging, CosmicSQL
 @click.option('--zwps-to-cwps', is_flag=True, help='Migrate from ZWPS to CWPS')
 @click.option('--is-router', is_flag=True, help='The specified VM is a router')
 @click.option('--is-project-vm', is_flag=True, help='The specified VM is a project VM')
+@click.option('--parallel', is_flag=True, help='Migrate the volumes concurrently instead of one by one')
+@click.option('--max-per-source-pool', metavar='<#>', type=click.IntRange(1), default=1, show_default=True,
+              help='Maximum number of concurrent migrations from one storage pool with --parallel')
+@click.option('--max-per-target-pool', metavar='<#>', type=click.IntRange(1), default=2, show_default=True,
+              help='Maximum number of concurrent migrations to one storage pool with --parallel')
 @click.option('--dry-run/--exec', is_flag=True, default=True, show_default=True, help='Enable/disable dry-run')
+@click.option('--profile-api', is_flag=True, help='Print a summary of the API calls made at exit')
+@click.option('--profile-api-file', metavar='<file>', help='Also write the API call summary as JSON to this file')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 @click.argument('vm-name')
 @click.argument('storage_pool')
-def main(profile, max_iops, zwps_to_cwps, is_router, is_project_vm, dry_run, vm_name, storage_pool):
+def main(profile, max_iops, zwps_to_cwps, is_router, is_project_vm, parallel, max_per_source_pool,
+         max_per_target_pool, dry_run, vm_name, storage_pool, profile_api, profile_api_file):
     """Live migrate VM volumes to STORAGE_POOL"""
 
     click_log.basic_config()
@@ -48,15 +55,18 @@ def main(profile, max_iops, zwps_to_cwps, is_router, is_project_vm, dry_run, vm_
         logging.warning('Running in dry-run mode, will only show changes')
 
     co = CosmicOps(profile=profile, dry_run=dry_run, log_to_slack=log_to_slack)
+    if profile_api:
+        co.enable_api_profiling(profile_api_file)
 
     cs = CosmicSQL(server=profile, dry_run=dry_run)
 
     if not live_migrate_volumes(storage_pool, co, cs, dry_run, is_router, is_project_vm, log_to_slack, max_iops, vm_name,
-                                zwps_to_cwps):
+                                zwps_to_cwps, parallel, max_per_source_pool, max_per_target_pool):
         sys.exit(1)
 
 
-def live_migrate_volumes(target_storage_pool_name, co, cs, dry_run, is_router, is_project_vm, log_to_slack, max_iops, vm_name, zwps_to_cwps):
+def live_migrate_volumes(target_storage_pool_name, co, cs, dry_run, is_router, is_project_vm, log_to_slack, max_iops, vm_name, zwps_to_cwps,
+                         parallel=False, max_per_source_pool=1, max_per_target_pool=2):
     target_storage_pool = co.get_storage_pool(name=target_storage_pool_name)
     if not target_storage_pool:
         return False
@@ -143,6 +153,10 @@ def live_migrate_volumes(target_storage_pool_name, co, cs, dry_run, is_router, i
         logging.info(
             f'Would have merged all backing files if any exist')
 
+    tracker = None
+    if parallel:
+        tracker = VolumeMigrationTracker(co, max_per_source_pool, max_per_target_pool, log_to_slack=log_to_slack)
+
     for volume in vm.get_volumes():
         if volume['storageid'] == target_storage_pool['id']:
             logging.warning(f"Skipping volume '{volume['name']}' as it's already on the specified storage pool",
@@ -167,6 +181,11 @@ def live_migrate_volumes(target_storage_pool_name, co, cs, dry_run, is_router, i
                 f"Would migrate volume '{volume['name']}' to storage pool '{target_storage_pool['name']}' ({target_storage_pool['id']})")
             continue
 
+        if tracker:
+            tracker.add(volume, source_storage_pool, target_storage_pool, source_host=host,
+                        vm_instancename=vm_instancename)
+            continue
+
         logging.info(
             f"Starting migration of volume '{volume['name']}' from storage pool '{source_storage_pool['name']}' to storage pool '{target_storage_pool['name']}' ({target_storage_pool['id']})",
             log_to_slack=log_to_slack)
@@ -177,7 +196,8 @@ def live_migrate_volumes(target_storage_pool_name, co, cs, dry_run, is_router, i
         if not volume.migrate(target_storage_pool, live_migrate=True, source_host=source_host):
             continue
 
-        with click_spinner.spinner():
+        poll = AdaptivePoll()
+        with click_spinner.spinner(disable=not co.show_progress):
             while True:
                 volume.refresh()
 
@@ -186,12 +206,15 @@ def live_migrate_volumes(target_storage_pool_name, co, cs, dry_run, is_router, i
 
                 logging.warning(
                     f"Volume '{volume['name']}' is in '{volume['state']}' state instead of 'Ready', sleeping...")
-                time.sleep(60)
+                poll.sleep(volume['state'])
 
         logging.info(
             f"Finished migration of volume '{volume['name']}' from storage pool '{source_storage_pool['name']}' to storage pool '{target_storage_pool['name']}' ({target_storage_pool['id']})",
             log_to_slack=log_to_slack)
 
+    if tracker and not tracker.run():
+        logging.warning(f"Not all volumes of VM '{vm['name']}' were migrated", log_to_slack=log_to_slack)
+
     logging.info(
         f"Finished live migration of volumes of VM '{vm['name']}' to storage pool '{target_storage_pool['name']}' ({target_storage_pool['id']})",
         log_to_slack=log_to_slack)
@@ -19,7 +19,7 @@ from random import choice
 import click
 import click_log
 
-from cosmicops import CosmicOps, logging, CosmicSQL
+from cosmicops import CosmicOps, logging, metrics, CosmicSQL, VolumeMigrationScheduler
 
 
 @click.command()
@@ -33,10 +33,24 @@ from cosmicops import CosmicOps, logging, CosmicSQL
 @click.option('--destination-cluster-name', help='Name of the destination cluster')
 @click.option('--destination-pool-name', help='Name of the destination pool')
 @click.option('--source-pool-name', help='Name of the source pool')
+@click.option('--parallel', is_flag=True,
+              help='Plan all migrations up front, largest volume first to the destination pool with the most free '
+                   'space, and run them concurrently')
+@click.option('--max-running', metavar='<#>', type=click.IntRange(1), default=4, show_default=True,
+              help='Maximum number of concurrent migrations with --parallel')
+@click.option('--max-per-pool', metavar='<#>', type=click.IntRange(1), default=1, show_default=True,
+              help='Maximum number of concurrent migrations from or to one storage pool with --parallel')
+@click.option('--max-pool-rate', metavar='<MB/s>', type=int,
+              help='Limit the average migration rate from or to one storage pool with --parallel')
+@click.option('--profile-api', is_flag=True, help='Print a summary of the API calls made at exit')
+@click.option('--profile-api-file', metavar='<file>', help='Also write the API call summary as JSON to this file')
+@click.option('--metrics-file', metavar='<file>',
+              help='Write progress metrics to this file in the node_exporter textfile format')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 @click.argument('source_cluster_name')
 def main(profile, dry_run, ignore_volumes, zwps_to_cwps, skip_disk_offerings, skip_domains, only_project,
-         source_cluster_name, destination_cluster_name, destination_pool_name, source_pool_name):
+         source_cluster_name, destination_cluster_name, destination_pool_name, source_pool_name, parallel, max_running,
+         max_per_pool, max_pool_rate, profile_api, profile_api_file, metrics_file):
     """Migrate offline volumes from SOURCE_CLUSTER to DESTINATION_CLUSTER"""
 
     click_log.basic_config()
@@ -57,6 +71,10 @@ def main(profile, dry_run, ignore_volumes, zwps_to_cwps, skip_disk_offerings, sk
         logging.warning('Running in dry-run mode, will only show changes')
 
     co = CosmicOps(profile=profile, dry_run=dry_run)
+    if profile_api:
+        co.enable_api_profiling(profile_api_file)
+    if metrics_file:
+        metrics.enable(metrics_file)
     cs = CosmicSQL(server=profile, dry_run=dry_run)
 
     source_cluster = co.get_cluster(name=source_cluster_name)
@@ -126,10 +144,20 @@ def main(profile, dry_run, ignore_volumes, zwps_to_cwps, skip_disk_offerings, sk
         skip_domains = skip_domains.replace(' ', '').split(',')
         logging.info(f"Skipping domains: {str(skip_domains)}")
 
+    scheduler = None
+    if parallel:
+        max_bytes_per_second = max_pool_rate * 1024 * 1024 if max_pool_rate else None
+        scheduler = VolumeMigrationScheduler(co, destination_storage_pools, max_running=max_running,
+                                             max_per_source_pool=max_per_pool, max_per_target_pool=max_per_pool,
+                                             max_bytes_per_second=max_bytes_per_second)
+
     for source_storage_pool in source_storage_pools:
         if source_pool_name and source_storage_pool['name'] != source_pool_name:
             continue
         destination_storage_pool = choice(destination_storage_pools)
+        # The scheduler picks the destination per volume
+        destination_names = [p['name'] for p in
+                             (destination_storage_pools if scheduler else [destination_storage_pool])]
 
         volumes = source_storage_pool.get_volumes(only_project)
 
@@ -149,9 +177,9 @@ def main(profile, dry_run, ignore_volumes, zwps_to_cwps, skip_disk_offerings, sk
                 logging.warning(f"No storage attribute found for volume '{volume['name']}' ({volume['id']}), skipping...")
                 continue
 
-            if volume['storage'] == destination_storage_pool['name']:
+            if volume['storage'] in destination_names:
                 logging.warning(
-                    f"Volume '{volume['name']}' ({volume['id']}) already on cluster '{destination_storage_pool['name']}', skipping...")
+                    f"Volume '{volume['name']}' ({volume['id']}) already on cluster '{volume['storage']}', skipping...")
                 continue
 
             if volume['state'] != 'Ready':
@@ -174,12 +202,20 @@ def main(profile, dry_run, ignore_volumes, zwps_to_cwps, skip_disk_offerings, sk
                     logging.info(
                         f"Would have changed the diskoffering for volume '{volume['name']}' to CWPS before starting the migration")
 
+            if scheduler:
+                scheduler.add(volume, source_storage_pool)
+                continue
+
             logging.info(
                 f"Volume '{volume['name']}' will be migrated from storage pool '{source_storage_pool['name']}' to '{destination_storage_pool['name']}'")
 
             if not volume.migrate(destination_storage_pool):
                 continue
 
+    if scheduler and not scheduler.run():
+        logging.error(f"Not all volumes of cluster '{source_cluster_name}' were migrated")
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
@@ -19,6 +19,7 @@ import click
 import click_log
 
 from cosmicops import CosmicOps, logging
+from cosmicops.daemon import forward_or_run
 
 
 @click.command()
@@ -90,4 +91,4 @@ def main(profile, is_project_router, only_when_required, cleanup, dry_run, route
 
 
 if __name__ == '__main__':
-    main()
+    forward_or_run(main)
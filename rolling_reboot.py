@@ -21,7 +21,7 @@ from pathlib import Path
 import click
 import click_log
 
-from cosmicops import CosmicOps, logging, RebootAction
+from cosmicops import CosmicOps, logging, metrics, RebootAction
 
 
 @click.command()
@@ -47,10 +47,14 @@ from cosmicops import CosmicOps, logging, RebootAction
 @click.option('--post-reboot-script', metavar='<script>', help='Script to run after host has rebooted')
 @click.option('--dry-run/--exec', is_flag=True, default=True, show_default=True, help='Enable/disable dry-run')
 @click.option('--proxy-host', help='Hypervisor the migrate VMS to, after which we migrate them back to origin', required=False)
+@click.option('--profile-api', is_flag=True, help='Print a summary of the API calls made at exit')
+@click.option('--profile-api-file', metavar='<file>', help='Also write the API call summary as JSON to this file')
+@click.option('--metrics-file', metavar='<file>',
+              help='Write progress metrics to this file in the node_exporter textfile format')
 @click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
 @click.argument('cluster')
 def main(profile, ignore_hosts, only_hosts, skip_os_version, reboot_action, pre_empty_script, post_empty_script,
-         post_reboot_script, dry_run, proxy_host, cluster):
+         post_reboot_script, dry_run, proxy_host, cluster, profile_api, profile_api_file, metrics_file):
     """Perform rolling reboot of hosts in CLUSTER"""
 
     click_log.basic_config()
@@ -67,6 +71,10 @@ def main(profile, ignore_hosts, only_hosts, skip_os_version, reboot_action, pre_
         logging.warning('Running in dry-run mode, will only show changes')
 
     co = CosmicOps(profile=profile, dry_run=dry_run, log_to_slack=log_to_slack)
+    if profile_api:
+        co.enable_api_profiling(profile_api_file)
+    if metrics_file:
+        metrics.enable(metrics_file)
 
     cluster = co.get_cluster(name=cluster)
     if not cluster:
@@ -107,6 +115,7 @@ def main(profile, ignore_hosts, only_hosts, skip_os_version, reboot_action, pre_
     target_host = None
 
     for host in hosts:
+        host_start_time = time.monotonic()
         logging.slack_value = host['name']
         logging.zone_name = host['zonename']
 
@@ -187,6 +196,10 @@ def main(profile, ignore_hosts, only_hosts, skip_os_version, reboot_action, pre_
 
         target_host = host
 
+        metrics.inc('hosts_processed_total', task=logging.task)
+        metrics.set('host_duration_seconds', time.monotonic() - host_start_time, host=host['name'])
+        metrics.write()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+from pathlib import Path
+
+import click
+import click_log
+from tabulate import tabulate
+
+from benchmarks import suite  # noqa: F401 registers the benchmarks
+from benchmarks.harness import BENCHMARKS, compare_results, results_document, run_benchmark
+from cosmicops import logging
+
+
+@click.command()
+@click.option('--only', 'only_benchmarks', metavar='<list>',
+              help=f"Comma separated list of benchmarks to run ({', '.join(BENCHMARKS)})")
+@click.option('--sizes', metavar='<list>', help='Comma separated list of sizes, overrides the defaults')
+@click.option('--repeat', default=3, show_default=True, help='Number of runs per benchmark and size')
+@click.option('--output', '-o', metavar='<file>', help='Write the results as JSON to this file')
+@click.option('--compare', 'baseline_file', metavar='<file>', help='Compare the results with an earlier JSON file')
+@click.option('--threshold', default=0.2, show_default=True,
+              help='Relative increase of the median wall time reported as a regression')
+@click_log.simple_verbosity_option(logging.getLogger(), default="WARNING", show_default=True)
+def main(only_benchmarks, sizes, repeat, output, baseline_file, threshold):
+    """Benchmark the cosmicops hot paths against a simulated management server"""
+
+    click_log.basic_config()
+
+    if only_benchmarks:
+        names = only_benchmarks.replace(' ', '').split(',')
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            logging.error(f"Unknown benchmarks: {', '.join(unknown)}")
+            sys.exit(1)
+    else:
+        names = list(BENCHMARKS)
+
+    if sizes:
+        sizes = [int(size) for size in sizes.replace(' ', '').split(',')]
+
+    results = []
+    for name in names:
+        for size in sizes or BENCHMARKS[name][1]:
+            result = run_benchmark(name, size, repeat)
+            click.echo(f"{name}[{size}]: {result.median:.3f}s, {sum(result.api_calls.values())} API calls, "
+                       f"{result.sql_queries} SQL queries")
+            results.append(result)
+
+    document = results_document(results)
+
+    if output:
+        Path(output).write_text(json.dumps(document, indent=2) + '\n')
+
+    if not baseline_file:
+        return
+
+    baseline = json.loads(Path(baseline_file).read_text())
+    comparison = compare_results(baseline, document, threshold)
+
+    table_headers = ['Benchmark', 'Size', 'Baseline (s)', 'Median (s)', 'Change', 'API calls', 'SQL queries', '']
+    click.echo(tabulate([[row['name'], row['size'], row['baseline_median'], row['median'], f"{row['change']:+.1%}",
+                          f"{row['baseline_api_calls']} -> {row['api_calls']}",
+                          f"{row['baseline_sql_queries']} -> {row['sql_queries']}",
+                          'REGRESSION' if row['regressed'] else ''] for row in comparison],
+                        headers=table_headers, tablefmt='pretty'))
+
+    if any(row['regressed'] for row in comparison):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
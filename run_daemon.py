@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import signal
+import sys
+
+import click
+import click_log
+
+from cosmicops import logging
+from cosmicops.daemon import CosmicDaemon, DAEMON_COMMANDS, get_socket_path
+
+
+@click.command()
+@click.option('--socket', 'socket_path', metavar='<path>', default=str(get_socket_path()), show_default=True,
+              help='Unix socket to listen on, clients use COSMICOPS_DAEMON_SOCKET to find it')
+@click.option('--cache-ttl', default=300, show_default=True,
+              help='Seconds to cache inventory listings like zones, clusters and service offerings')
+@click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
+def main(socket_path, cache_ttl):
+    """Run the cosmicops daemon, which keeps the short running tools warm
+
+    These tools forward their arguments to the daemon while it is running (set COSMICOPS_NO_DAEMON to run them
+    directly): kill_jobs, list_ha_workers, list_virtual_machines, reboot_router_vm, updateHostTags, who_has_this_ip
+    and who_has_this_mac.
+    """
+
+    click_log.basic_config()
+
+    daemon = CosmicDaemon(socket_path, DAEMON_COMMANDS, cache_ttl)
+    daemon.start()
+
+    # Clean up the socket when stopped by a service manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
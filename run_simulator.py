@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import click
+import click_log
+
+from cosmicops import logging
+from cosmicops.simulator import CosmicSimulator, create_server, generate_inventory
+
+
+@click.command()
+@click.option('--zones', default=1, show_default=True, help='Number of zones')
+@click.option('--pods', default=1, show_default=True, help='Number of pods per zone')
+@click.option('--clusters', default=2, show_default=True, help='Number of clusters per pod')
+@click.option('--hosts', default=4, show_default=True, help='Number of hosts per cluster')
+@click.option('--vms', default=10, show_default=True, help='Number of VMs per host')
+@click.option('--routers', default=1, show_default=True, help='Number of routers per host')
+@click.option('--seed', default=0, show_default=True, help='Seed for the inventory generator and failure injection')
+@click.option('--time-scale', default=1., show_default=True,
+              help='Factor applied to the async job durations (0.01 makes a 10 minute migration take 6 seconds)')
+@click.option('--failure-rate', default=0., show_default=True, help='Fraction of async jobs that fail')
+@click.option('--listen', default='127.0.0.1', show_default=True, help='Address to listen on')
+@click.option('--port', default=8096, show_default=True, help='Port to listen on')
+@click.option('--key', default='simulator', show_default=True, help='API key accepted by the simulator')
+@click.option('--secret', default='simulator', show_default=True, help='Secret key accepted by the simulator')
+@click_log.simple_verbosity_option(logging.getLogger(), default="INFO", show_default=True)
+def main(zones, pods, clusters, hosts, vms, routers, seed, time_scale, failure_rate, listen, port, key, secret):
+    """Run a simulated management server API with a synthetic inventory"""
+
+    click_log.basic_config()
+
+    inventory = generate_inventory(zones=zones, pods=pods, clusters=clusters, hosts=hosts, vms=vms, routers=routers,
+                                   seed=seed)
+    logging.info(f"Generated {len(inventory['hosts'])} hosts, {len(inventory['virtualmachines'])} VMs, "
+                 f"{len(inventory['routers'])} routers and {len(inventory['volumes'])} volumes")
+
+    simulator = CosmicSimulator(inventory, key=key, secret=secret, time_scale=time_scale, failure_rate=failure_rate,
+                                seed=seed)
+    server = create_server(simulator, listen, port)
+
+    logging.info(f"Add this profile to ~/.cloudmonkey/config to use the simulator:\n\n"
+                 f"[simulator]\n"
+                 f"url = http://{listen}:{port}/client/api\n"
+                 f"apikey = {key}\n"
+                 f"secretkey = {secret}\n")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(f"Served {simulator.request_count} requests")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from cs import CloudStackException
+from testfixtures import tempdir
+
+from cosmicops.api_profiler import CosmicApiProfiler, percentile
+from cosmicops.log import logging
+
+
+class TestCosmicApiProfiler(TestCase):
+    def setUp(self):
+        self.client = Mock()
+        self.client.listVirtualMachines.return_value = [{'id': 'v1', 'name': 'vm1'}]
+        self.client.listHosts.side_effect = CloudStackException('test error', response=Mock())
+        self.client.timeout = 60
+
+        self.profiler = CosmicApiProfiler(self.client)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(0., percentile([], 50))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(95, percentile(values, 95))
+        self.assertEqual(100, percentile(values, 100))
+        self.assertEqual(1, percentile([1], 99))
+
+    def test_profiled_command(self):
+        with patch('cosmicops.api_profiler.time.monotonic', side_effect=[10., 10.5, 20., 22.]):
+            with logging.context(task='Test phase'):
+                self.assertEqual([{'id': 'v1', 'name': 'vm1'}],
+                                 self.profiler.listVirtualMachines(fetch_list=True, listall=True))
+                with self.assertRaises(CloudStackException):
+                    self.profiler.listHosts(fetch_list=True)
+
+        self.client.listVirtualMachines.assert_called_with(fetch_list=True, listall=True)
+        self.assertEqual(60, self.profiler.timeout)
+
+        vm_stats = self.profiler.stats[('Test phase', 'listVirtualMachines')]
+        self.assertEqual(1, vm_stats.count)
+        self.assertEqual(0, vm_stats.errors)
+        self.assertEqual(0, vm_stats.bytes)
+        self.assertEqual([0.5], vm_stats.latencies)
+
+        host_stats = self.profiler.stats[('Test phase', 'listHosts')]
+        self.assertEqual(1, host_stats.errors)
+        self.assertEqual(0, host_stats.bytes)
+        self.assertEqual([2.], host_stats.latencies)
+
+    def test_measure_size(self):
+        self.profiler.measure_size = True
+        self.profiler.listVirtualMachines()
+
+        self.assertEqual(len(json.dumps([{'id': 'v1', 'name': 'vm1'}])),
+                         self.profiler.stats[(logging.task, 'listVirtualMachines')].bytes)
+        self.assertNotIn(' - ', self.profiler.summary())
+
+    def test_wrap_client(self):
+        client = Mock()
+        client.listVirtualMachines.return_value = []
+        profiler = self.profiler.wrap_client(client)
+
+        self.profiler.listVirtualMachines()
+        profiler.listVirtualMachines()
+
+        client.listVirtualMachines.assert_called_once()
+        self.assertIs(self.profiler.stats, profiler.stats)
+        self.assertEqual(2, self.profiler.stats[(logging.task, 'listVirtualMachines')].count)
+
+    def test_summary(self):
+        self.profiler.record('phase1', 'listHosts', 0.2, [])
+        self.profiler.record('phase1', 'listVirtualMachines', 1.5, [])
+        self.profiler.record('phase2', 'listHosts', 0.1, [])
+
+        summary = self.profiler.summary()
+        self.assertIn('listVirtualMachines', summary)
+        self.assertLess(summary.index('listVirtualMachines'), summary.index('listHosts'))
+
+        details = self.profiler.to_dict()
+        self.assertEqual({'phase1', 'phase2'}, set(details))
+        self.assertEqual(1, details['phase1']['listHosts']['count'])
+        self.assertEqual(1, details['phase1']['listVirtualMachines']['histogram']['2.5'])
+
+    @tempdir()
+    def test_dump(self, tmp):
+        self.profiler.record('phase1', 'listHosts', 0.2, [])
+
+        self.profiler.dump(f"{tmp.path}/profile.json")
+
+        with open(f"{tmp.path}/profile.json") as f:
+            self.assertEqual(0.2, json.load(f)['phase1']['listHosts']['p50'])
@@ -0,0 +1,122 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import pymysql
+
+from cosmicops import CosmicOps, CosmicSQL
+from cosmicops.cache import ApiCache, CachingClient, SQLConnectionPool, sql_pool
+
+
+class TestApiCache(TestCase):
+    def setUp(self):
+        self.cache = ApiCache()
+        self.cache.enable(ttl=60)
+        self.client = Mock(endpoint='https://localhost', key='key')
+        self.client.listZones.return_value = [{'id': 'z1'}]
+        self.caching_client = self.cache.wrap_client(self.client)
+
+    def test_cached_listing(self):
+        zones = self.caching_client.listZones(fetch_list=True)
+        zones[0]['name'] = 'changed'
+
+        self.assertEqual([{'id': 'z1'}], self.caching_client.listZones(fetch_list=True))
+        self.client.listZones.assert_called_once_with(fetch_list=True)
+
+        self.caching_client.listZones(fetch_list=True, id='z1')
+        self.assertEqual(2, self.client.listZones.call_count)
+
+    def test_uncached_listing(self):
+        self.caching_client.listVirtualMachines(hostid='h1')
+        self.caching_client.listVirtualMachines(hostid='h1')
+
+        self.assertEqual(2, self.client.listVirtualMachines.call_count)
+
+    def test_expiry(self):
+        with patch('cosmicops.cache.time.monotonic') as mock_monotonic:
+            mock_monotonic.return_value = 0
+            self.caching_client.listZones()
+            mock_monotonic.return_value = 30
+            self.caching_client.listZones()
+            mock_monotonic.return_value = 61
+            self.caching_client.listZones()
+
+        self.assertEqual(2, self.client.listZones.call_count)
+
+    def test_invalidation(self):
+        self.caching_client.listZones()
+        self.caching_client.listVirtualMachines()
+        self.caching_client.listZones()
+        self.assertEqual(1, self.client.listZones.call_count)
+
+        self.caching_client.updateZone(id='z1')
+        self.caching_client.listZones()
+        self.assertEqual(2, self.client.listZones.call_count)
+
+    @patch('cs.CloudStack')
+    def test_cosmicops(self, _):
+        with patch('cosmicops.ops.api_cache', self.cache):
+            self.assertIsInstance(CosmicOps(endpoint='https://localhost', key='key', secret='secret').cs,
+                                  CachingClient)
+
+        self.assertNotIsInstance(CosmicOps(endpoint='https://localhost', key='key', secret='secret').cs, CachingClient)
+
+
+class TestSQLConnectionPool(TestCase):
+    def setUp(self):
+        connect_patcher = patch('pymysql.connect')
+        self.mock_connect = connect_patcher.start()
+        self.addCleanup(connect_patcher.stop)
+        self.mock_connect.side_effect = lambda **kwargs: Mock()
+
+        self.pool = SQLConnectionPool()
+
+    def test_disabled(self):
+        self.assertIsNot(self.pool.connect(host='db'), self.pool.connect(host='db'))
+
+    def test_enabled(self):
+        self.pool.enabled = True
+
+        conn = self.pool.connect(host='db')
+        self.assertIs(conn, self.pool.connect(host='db'))
+        conn.ping.assert_called_once_with(reconnect=True)
+        self.assertIsNot(conn, self.pool.connect(host='other_db'))
+
+        conn.ping.side_effect = pymysql.Error
+        self.assertIsNot(conn, self.pool.connect(host='db'))
+
+    def test_reset(self):
+        self.pool.enabled = True
+        conn = self.pool.connect(host='db')
+        broken_conn = self.pool.connect(host='broken_db')
+        broken_conn.rollback.side_effect = pymysql.Error
+
+        self.pool.reset()
+
+        conn.rollback.assert_called_once()
+        self.assertIs(conn, self.pool.connect(host='db'))
+        self.assertIsNot(broken_conn, self.pool.connect(host='broken_db'))
+
+    def test_cosmicsql(self):
+        with patch.object(sql_pool, 'enabled', True):
+            first = CosmicSQL(server='localhost', password='password')
+            second = CosmicSQL(server='localhost', password='password')
+            sql_pool.reset()
+            sql_pool._connections = {}
+
+        self.assertIs(first.conn, second.conn)
+        self.mock_connect.assert_called_once_with(host='localhost', port=3306, user='cloud', password='password',
+                                                  database='cloud')
@@ -0,0 +1,107 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from unittest import TestCase
+from unittest.mock import Mock
+
+from cosmicops.capacity import ClusterCapacityModel
+from cosmicops.objects import CosmicHost
+
+GiB = 1024 * 1024 * 1024
+
+
+class TestClusterCapacityModel(TestCase):
+    def setUp(self):
+        self.hosts = [
+            self._host('host1', 32, 24),
+            self._host('host2', 32, 8),
+            self._host('host3', 32, 16),
+            self._host('host4', 32, 16),
+            self._host('disabled_host', 32, 0, resourcestate='Disabled'),
+            self._host('down_host', 32, 0, state='Down'),
+            self._host('dedicated_host1', 32, 20, dedicated=True, affinitygroupid='ag1'),
+            self._host('dedicated_host2', 32, 4, dedicated=True, affinitygroupid='ag1'),
+            self._host('dedicated_host3', 32, 0, dedicated=True, affinitygroupid='ag2')
+        ]
+        self.model = ClusterCapacityModel(self.hosts)
+
+    @staticmethod
+    def _host(name, memory_total, memory_allocated, resourcestate='Enabled', state='Up', **fields):
+        return CosmicHost(Mock(), {'name': name, 'memorytotal': memory_total * GiB,
+                                   'memoryallocated': memory_allocated * GiB, 'resourcestate': resourcestate,
+                                   'state': state, 'cpunumber': 16, 'cpuallocated': '50%', **fields})
+
+    def _find(self, memory, **kwargs):
+        host = self.model.find_host(memory * GiB, **kwargs)
+        return host['name'] if host else None
+
+    def test_find_host(self):
+        self.assertEqual(7, len(self.model))
+        self.assertEqual('host2', self._find(8))
+        self.assertEqual('host3', self._find(8, exclude=('host2',)))
+        self.assertIsNone(self._find(25))
+
+        self.assertEqual('dedicated_host2', self._find(8, group='ag1'))
+        self.assertEqual('dedicated_host3', self._find(8, group='ag2'))
+        self.assertIsNone(self._find(8, group='ag3'))
+        self.assertIsNone(self.model.get('disabled_host'))
+        self.assertIsNone(self.model.get('down_host'))
+
+    def test_best_fit(self):
+        self.assertEqual('host4', self._find(10, best_fit=True))
+        self.assertEqual('host3', self._find(10, best_fit=True, exclude=('host4',)))
+        self.assertEqual('host1', self._find(8, best_fit=True))
+        self.assertEqual('host2', self._find(17, best_fit=True))
+        self.assertIsNone(self._find(25, best_fit=True))
+
+    def test_mixed_host_sizes(self):
+        self.model = ClusterCapacityModel([
+            self._host('large_host', 128, 32),
+            self._host('small_host', 32, 16)
+        ])
+
+        # Like the host listing sorted by allocated memory, not the host with the most free memory
+        self.assertEqual('small_host', self._find(8))
+        self.assertEqual('large_host', self._find(17))
+        self.assertEqual('small_host', self._find(8, best_fit=True))
+
+        self.model.reserve('small_host', 16 * GiB)
+        self.assertEqual(32 * GiB, self.model.get('small_host').memory_allocated)
+        self.assertEqual('large_host', self._find(8))
+
+    def test_reserve(self):
+        self.model.reserve('host2', 12 * GiB, 2)
+        self.assertEqual(12 * GiB, self.model.get('host2').memory_free)
+        self.assertEqual(10., self.model.get('host2').cpu_allocated)
+        self.assertEqual('host3', self._find(8))
+        self.assertEqual('host2', self._find(12, best_fit=True))
+
+        self.model.release('host2', 12 * GiB, 2)
+        self.assertEqual('host2', self._find(8))
+        self.assertEqual(8., self.model.get('host2').cpu_allocated)
+
+        # Hosts which can't be migrated to are ignored
+        self.model.reserve('disabled_host', GiB)
+
+    def test_cpu_overcommit(self):
+        self.assertEqual('host2', self._find(1, cpu=12))
+
+        self.model.cpu_overcommit = 1.
+        self.assertEqual('host2', self._find(1, cpu=8))
+        self.assertIsNone(self._find(1, cpu=9))
+
+        self.model.cpu_overcommit = 2.
+        self.model.reserve('host2', 0, 20)
+        self.assertEqual('host3', self._find(1, cpu=8))
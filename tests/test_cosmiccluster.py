@@ -21,7 +21,7 @@ from cosmicops.objects import CosmicCluster, CosmicVM, CosmicSystemVM, CosmicSer
 
 class TestCosmicCluster(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
@@ -158,3 +158,34 @@ class TestCosmicCluster(TestCase):
         ]
 
         self.assertIsNone(self.cluster.find_migration_host(vm))
+
+    def test_find_migration_host_with_capacity(self):
+        self.cs_instance.listHosts.return_value = [
+            {
+                'id': f'h{i}',
+                'name': f'host{i}',
+                'resourcestate': 'Enabled',
+                'state': 'Up',
+                'memorytotal': 1073741824,
+                'memoryallocated': 0,
+                'dedicated': False
+            } for i in range(2)
+        ]
+
+        vm = CosmicVM(Mock(), {
+            'id': 'vm1',
+            'memory': 768,
+            'instancename': 'i-VM-1'
+        })
+        vm.get_affinity_groups = Mock(return_value=[])
+
+        capacity = self.cluster.get_capacity_model()
+        self.assertEqual('host0', self.cluster.find_migration_host(vm, capacity=capacity)['name'])
+        self.assertEqual('host1', self.cluster.find_migration_host(vm, capacity=capacity)['name'])
+        self.assertIsNone(self.cluster.find_migration_host(vm, capacity=capacity))
+        self.cs_instance.listHosts.assert_called_once()
+        self.assertFalse(capacity.lock.locked())
+
+        # Without a capacity model nothing is reserved
+        self.assertEqual('host0', self.cluster.find_migration_host(vm)['name'])
+        self.assertEqual('host0', self.cluster.find_migration_host(vm)['name'])
@@ -0,0 +1,101 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from cosmicops.converge import ConvergenceController, ConvergencePolicy
+from cosmicops.objects.host import DomJobInfo
+
+
+class TestConvergenceController(TestCase):
+    def setUp(self):
+        monotonic_patcher = patch('time.monotonic')
+        self.mock_monotonic = monotonic_patcher.start()
+        self.addCleanup(monotonic_patcher.stop)
+        self.now = 0.
+        self.mock_monotonic.side_effect = lambda: self.now
+
+        self.host = Mock()
+        self.host.get_migration_max_speed.return_value = 100
+        self.policy = ConvergencePolicy(window=30., min_progress=.1, max_bandwidth=1000, max_downtime=1000)
+        self.controller = ConvergenceController(self.host, 'i-1-VM', self.policy)
+
+    def _update(self, seconds, remaining):
+        for _ in range(seconds):
+            self.controller.update(DomJobInfo(dataRemaining=remaining, memDirtyRate=5000))
+            self.now += 1.
+
+    def test_converging(self):
+        for remaining in range(1000, 0, -10):
+            self._update(1, remaining)
+
+        self.host.set_migration_max_speed.assert_not_called()
+        self.host.set_migration_max_downtime.assert_not_called()
+        self.assertFalse(self.controller.exhausted)
+
+    def test_not_converging(self):
+        # Slow progress is not enough
+        self._update(20, 1000)
+        self._update(20, 950)
+        self.host.set_migration_max_speed.assert_called_once_with('i-1-VM', 1000)
+        self.host.set_migration_max_downtime.assert_not_called()
+
+        # Every step gets a full window
+        self._update(30, 950)
+        self.host.set_migration_max_downtime.assert_called_once_with('i-1-VM', 600)
+        self._update(31, 950)
+        self.host.set_migration_max_downtime.assert_called_with('i-1-VM', 1000)
+
+        self._update(31, 950)
+        self.assertTrue(self.controller.exhausted)
+        self.assertEqual(1, self.host.set_migration_max_speed.call_count)
+        self.assertEqual(2, self.host.set_migration_max_downtime.call_count)
+        self.host.abort_job.assert_not_called()
+
+    def test_bandwidth_already_higher(self):
+        self.host.get_migration_max_speed.return_value = 2000
+
+        self._update(31, 1000)
+        self.host.get_migration_max_speed.assert_called_once_with('i-1-VM')
+        self.host.set_migration_max_speed.assert_not_called()
+        self.host.set_migration_max_downtime.assert_called_once_with('i-1-VM', 600)
+        self.assertEqual(2000, self.controller.bandwidth)
+
+    def test_tuning_fails(self):
+        self.host.set_migration_max_speed.return_value = False
+        self.host.set_migration_max_downtime.return_value = False
+
+        # A setting which can't be changed is skipped, so the migration still ends up exhausted
+        self._update(31, 1000)
+        self.host.set_migration_max_speed.assert_called_once_with('i-1-VM', 1000)
+        self.host.set_migration_max_downtime.assert_called_once_with('i-1-VM', 600)
+        self.assertIsNone(self.controller.bandwidth)
+        self.assertEqual(300, self.controller.downtime)
+        self.assertTrue(self.controller.exhausted)
+
+    def test_abort(self):
+        controller = ConvergenceController(self.host, 'i-1-VM', ConvergencePolicy(window=10., abort=True))
+        for _ in range(11):
+            controller.update(DomJobInfo(dataRemaining=1000))
+            self.now += 1.
+
+        self.host.set_migration_max_speed.assert_not_called()
+        self.host.set_migration_max_downtime.assert_not_called()
+        self.host.abort_job.assert_called_once_with('i-1-VM')
+
+    def test_finished(self):
+        self._update(60, 0)
+        self.assertListEqual([], self.controller._samples)
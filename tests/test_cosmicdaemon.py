@@ -0,0 +1,110 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import os
+import threading
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from testfixtures import tempdir
+
+from cosmicops.cache import sql_pool
+from cosmicops.daemon import CosmicDaemon, forward
+
+
+class TestCosmicDaemon(TestCase):
+    def setUp(self):
+        slack_patcher = patch('slack_webhook.Slack')
+        slack_patcher.start()
+        self.addCleanup(slack_patcher.stop)
+
+        lookup_patcher = patch('who_has_this_ip.who_has_this_ip', return_value='ip_address_data')
+        self.mock_lookup = lookup_patcher.start()
+        self.addCleanup(lookup_patcher.stop)
+
+    def _start_daemon(self, path):
+        self.socket_path = Path(path) / 'daemon.sock'
+        self.daemon = CosmicDaemon(self.socket_path, commands=['who_has_this_ip'])
+        self.daemon.start()
+        self.addCleanup(self.daemon.stop)
+
+        thread = threading.Thread(target=self.daemon.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(lambda: self.daemon.server and self.daemon.server.shutdown())
+
+    def _forward(self, command, args):
+        (stdout, stderr) = (io.StringIO(), io.StringIO())
+        exit_code = forward(command, args, self.socket_path, stdout, stderr)
+
+        return exit_code, stdout.getvalue() + stderr.getvalue()
+
+    @tempdir()
+    def test_forward(self, tmp):
+        self._start_daemon(tmp.path)
+        self.assertEqual(0o600, os.stat(self.socket_path).st_mode & 0o777)
+
+        cwd = os.getcwd()
+        (exit_code, output) = self._forward('who_has_this_ip', ['--profile', 'production', '10.0.0.1'])
+
+        self.assertEqual(0, exit_code)
+        self.assertIn('ip_address_data', output)
+        self.mock_lookup.assert_called_once_with('production', False, '10.0.0.1')
+        self.assertEqual(cwd, os.getcwd())
+
+        (exit_code, output) = self._forward('who_has_this_ip', [])
+        self.assertEqual(2, exit_code)
+        self.assertIn("Missing argument 'IP_ADDRESS'", output)
+
+        self.mock_lookup.side_effect = RuntimeError('Lookup failed')
+        (exit_code, output) = self._forward('who_has_this_ip', ['--profile', 'production', '10.0.0.1'])
+        self.assertEqual(1, exit_code)
+        self.assertIn('Lookup failed', output)
+
+        self.mock_lookup.side_effect = ValueError('Unexpected')
+        (exit_code, output) = self._forward('who_has_this_ip', ['--profile', 'production', '10.0.0.1'])
+        self.assertEqual(1, exit_code)
+        self.assertIn('ValueError: Unexpected', output)
+
+        self.assertIsNone(self._forward('list_virtual_machines', [])[0])
+
+    @tempdir()
+    def test_forward_without_daemon(self, tmp):
+        self.socket_path = Path(tmp.path) / 'daemon.sock'
+        self.assertIsNone(self._forward('who_has_this_ip', [])[0])
+
+        # A socket left behind by a daemon that is gone
+        self.socket_path.touch()
+        self.assertIsNone(self._forward('who_has_this_ip', [])[0])
+
+    @tempdir()
+    def test_forward_disabled(self, tmp):
+        self._start_daemon(tmp.path)
+
+        with patch.dict(os.environ, {'COSMICOPS_NO_DAEMON': '1'}):
+            self.assertIsNone(self._forward('who_has_this_ip', [])[0])
+
+    @tempdir()
+    def test_stop(self, tmp):
+        self._start_daemon(tmp.path)
+        self.assertTrue(sql_pool.enabled)
+
+        self.daemon.server.shutdown()
+        self.daemon.stop()
+
+        self.assertFalse(self.socket_path.exists())
+        self.assertFalse(sql_pool.enabled)
@@ -0,0 +1,143 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from configparser import ConfigParser
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from testfixtures import tempdir
+
+from cosmicops.migration_history import CosmicHistory
+from cosmicops.log import logging, CosmicEvent
+
+
+class TestCosmicHistory(TestCase):
+    def setUp(self):
+        self.history = CosmicHistory()
+        self.addCleanup(self.history.disable)
+
+    def _event(self, operation='job.wait_for_vm_migration', bytes_transferred=1000, duration=10., **fields):
+        event = CosmicEvent(operation, 'id', bytes_transferred=bytes_transferred, **fields)
+        event.duration = duration
+
+        return event
+
+    def test_disabled(self):
+        self.history.record('vm.migrate', 1000, 10., target_host='host2')
+
+        self.assertFalse(self.history.enabled)
+        self.assertListEqual([], self.history.get_throughputs())
+        self.assertIsNone(self.history.throughput())
+        self.assertIsNone(self.history.estimate(1000))
+        self.assertDictEqual({}, self.history.get_stats())
+
+    @tempdir()
+    def test_enable(self, tmp):
+        path = str(Path(tmp.path) / 'history' / 'history.db')
+        self.history.enable(path)
+        self.history.enable()
+
+        self.assertEqual(path, self.history.path)
+        self.assertIn(self.history.observe_event, logging.event_listeners)
+
+        self.history.disable()
+        self.assertFalse(self.history.enabled)
+        self.assertNotIn(self.history.observe_event, logging.event_listeners)
+
+    @tempdir()
+    def test_enable_from_config(self, tmp):
+        path = str(Path(tmp.path) / 'history.db')
+        config = ConfigParser()
+        config.read_dict({'history': {'path': path}})
+
+        with patch('cosmicops.migration_history.get_config', return_value=config) as mock_get_config:
+            self.assertListEqual([], self.history.get_throughputs())
+            self.history.get_stats()
+
+        mock_get_config.assert_called_once()
+        self.assertTrue(self.history.enabled)
+        self.assertEqual(path, self.history.path)
+
+        # Once disabled, the configuration doesn't enable it again
+        self.history.disable()
+        self.history.get_throughputs()
+        self.assertFalse(self.history.enabled)
+
+    @tempdir()
+    def test_default_path(self, tmp):
+        with patch('pathlib.Path.home', return_value=Path(tmp.path)):
+            self.history.enable()
+
+        self.assertEqual(str(Path(tmp.path) / '.cosmicops' / 'history.db'), self.history.path)
+
+    @tempdir()
+    def test_observe_event(self, tmp):
+        self.history.enable(str(Path(tmp.path) / 'history.db'))
+
+        with logging.context(task='Test task'):
+            self.history.observe_event(self._event(source_host='host1', target_host='host2', dirty_rate=42))
+        self.history.observe_event(self._event(bytes_transferred=4000, source_host='host1', target_host='host2'))
+
+        # Dry runs, events without bytes or endpoints and failures don't predict anything
+        self.history.observe_event(self._event(dry_run=True, target_host='host2'))
+        self.history.observe_event(self._event(bytes_transferred=0, target_host='host2'))
+        self.history.observe_event(self._event())
+        failed = self._event(bytes_transferred=1, source_host='host1', target_host='host2')
+        failed.outcome = 'failure'
+        self.history.observe_event(failed)
+
+        self.assertListEqual([100., 400.], self.history.get_throughputs(source_host='host1', target_host='host2'))
+        self.assertListEqual([], self.history.get_throughputs(operation='volume.migrate'))
+        self.assertEqual(100., self.history.throughput())
+        self.assertEqual(400., self.history.throughput(95))
+        self.assertEqual(50., self.history.estimate(5000, target_host='host2'))
+        self.assertIsNone(self.history.estimate(5000, target_host='host3'))
+
+        (task, dirty_rate) = self.history.conn.execute('SELECT task, dirty_rate FROM migrations').fetchone()
+        self.assertEqual(('Test task', 42), (task, dirty_rate))
+
+    @tempdir()
+    def test_get_stats(self, tmp):
+        path = str(Path(tmp.path) / 'history.db')
+        self.history.enable(path)
+
+        for size in range(1, 21):
+            self.history.record('job.wait_for_vm_migration', size * 100, 10., source_host='host1',
+                                target_host='host2')
+        self.history.record('volume.migrate', 1000, 20., source_pool='pool1', target_pool='pool2')
+        self.history.record('volume.rsync', 3000, 20., source_host='host1', target_host='host3',
+                            source_pool='pool1', target_pool='pool2')
+        self.history.close()
+
+        # The store is persistent
+        self.history.enable(path)
+
+        self.assertDictEqual({
+            ('host1', 'host2'): {'count': 20, 'p50': 100., 'p95': 190.},
+            ('host1', 'host3'): {'count': 1, 'p50': 150., 'p95': 150.}
+        }, self.history.get_stats())
+        self.assertDictEqual({('pool1', 'pool2'): {'count': 2, 'p50': 50., 'p95': 150.}},
+                             self.history.get_stats('pool'))
+        self.assertDictEqual({('pool1', 'pool2'): {'count': 1, 'p50': 50., 'p95': 50.}},
+                             self.history.get_stats('pool', operation='volume.migrate'))
+
+    @tempdir()
+    def test_unknown_fields(self, tmp):
+        self.history.enable(str(Path(tmp.path) / 'history.db'))
+
+        self.assertRaises(ValueError, self.history.get_stats, 'cluster')
+        self.assertRaises(ValueError, self.history.get_throughputs, target_cluster='cluster1')
+        self.assertRaises(ValueError, self.history.record, 'vm.migrate', 1000, 10., target_cluster='cluster1')
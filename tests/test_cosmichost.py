@@ -27,12 +27,12 @@ from cosmicops.objects import CosmicHost, CosmicVM, CosmicProject, CosmicRouter
 
 class TestCosmicHost(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
 
-        connection_patcher = patch('cosmicops.objects.host.Connection')
+        connection_patcher = patch('fabric.Connection')
         self.mock_connection = connection_patcher.start()
         self.addCleanup(connection_patcher.stop)
         self.connection_instance = self.mock_connection.return_value
@@ -47,7 +47,7 @@ class TestCosmicHost(TestCase):
         self.addCleanup(ilo_patcher.stop)
         self.ilo_instance = self.mock_ilo.return_value
 
-        slack_patcher = patch('cosmicops.log.Slack')
+        slack_patcher = patch('slack_webhook.Slack')
         self.mock_slack = slack_patcher.start()
         self.addCleanup(slack_patcher.stop)
 
@@ -182,9 +182,15 @@ class TestCosmicHost(TestCase):
         tmp.write('config', config)
         with patch('cosmicops.config.Path.cwd') as path_cwd_mock:
             path_cwd_mock.return_value = Path(tmp.path)
-            CosmicHost(self.ops, {'name': 'config_test_host'})
+            host = CosmicHost(self.ops, {'name': 'config_test_host'})
 
-        self.mock_connection.assert_called_with('config_test_host', user='test_user',
+            # Connections are only set up on first use
+            self.mock_connection.assert_not_called()
+            self.mock_ilo.assert_not_called()
+            self.assertEqual(self.connection_instance, host._connection)
+            self.assertEqual(self.ilo_instance, host._ilo)
+
+        self.mock_connection.assert_called_once_with('config_test_host', user='test_user',
                                                 connect_kwargs={'key_filename': '/home/test_user/.ssh/id_rsa'})
         self.mock_ilo.assert_called_with('config_test_host.ilom', login='ilo_test_user',
                                          password='super_secret_ilo_password')
@@ -479,10 +485,19 @@ class TestCosmicHost(TestCase):
     def test_execute(self):
         self.host.execute('cmd')
         self.connection_instance.run.assert_called_with('cmd', hide=True, pty=False)
+        self.connection_instance.open.assert_not_called()
+
+        self.connection_instance.is_connected = False
+        self.host.execute('cmd')
+        self.connection_instance.open.assert_called_once()
 
         self.host.execute('cmd', True)
         self.connection_instance.sudo.assert_called_with('cmd', hide=True, pty=False)
 
+        out_stream = Mock()
+        self.host.execute('cmd', hide_stdout='err', out_stream=out_stream)
+        self.connection_instance.run.assert_called_with('cmd', hide='err', pty=False, out_stream=out_stream)
+
     def test_execute_dry_run(self):
         self.host.dry_run = True
 
@@ -694,6 +709,24 @@ class TestCosmicHost(TestCase):
         self.host.execute.return_value.return_code = 1
         self.assertFalse(self.host.set_iops_limit(vm, 100))
 
+    def test_migration_tuning(self):
+        self.host.execute = Mock(return_value=Mock(return_code=0, stdout='8796093022207\n'))
+
+        self.assertEqual(8796093022207, self.host.get_migration_max_speed('i-1-VM'))
+        self.host.execute.assert_called_with("/usr/bin/virsh migrate-getspeed 'i-1-VM'", sudo=True)
+        self.assertTrue(self.host.set_migration_max_speed('i-1-VM', 1000))
+        self.host.execute.assert_called_with("/usr/bin/virsh migrate-setspeed 'i-1-VM' 1000", sudo=True)
+        self.assertTrue(self.host.set_migration_max_downtime('i-1-VM', 500))
+        self.host.execute.assert_called_with("/usr/bin/virsh migrate-setmaxdowntime 'i-1-VM' 500", sudo=True)
+        self.assertTrue(self.host.abort_job('i-1-VM'))
+        self.host.execute.assert_called_with("/usr/bin/virsh domjobabort 'i-1-VM'", sudo=True)
+
+        self.host.execute.return_value.return_code = 1
+        self.assertIsNone(self.host.get_migration_max_speed('i-1-VM'))
+        self.assertFalse(self.host.set_migration_max_speed('i-1-VM', 1000))
+        self.assertFalse(self.host.set_migration_max_downtime('i-1-VM', 500))
+        self.assertFalse(self.host.abort_job('i-1-VM'))
+
     def test_merge_backing_files(self):
         self.host.execute = Mock(return_value=Mock(return_code=0))
         vm = CosmicVM(Mock(), {
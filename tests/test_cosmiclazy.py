@@ -0,0 +1,79 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import subprocess
+import sys
+import tempfile
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+
+from cosmicops.lazy import lazy_import, MissingModule
+
+HEAVY_MODULES = ['cs', 'fabric', 'hpilo', 'invoke', 'libvirt', 'paramiko', 'pymysql', 'requests', 'slack_webhook',
+                 'sqlite3']
+
+
+class TestCosmicLazy(TestCase):
+    def _loaded_modules(self, statement):
+        script = (f"import sys, types\n"
+                  f"{statement}\n"
+                  f"print(' '.join(m for m in {HEAVY_MODULES!r} if type(sys.modules.get(m)) is types.ModuleType))")
+
+        return subprocess.run([sys.executable, '-c', script], cwd=Path(__file__).parent.parent, check=True,
+                              capture_output=True, text=True).stdout.splitlines()[-1].split()
+
+    def test_lazy_import(self):
+        self.assertIs(sys.modules['json'], lazy_import('json'))
+
+        module = lazy_import('cosmicops.simulator')
+        self.assertIsInstance(module, types.ModuleType)
+        self.assertEqual(2 ** 30, module.GiB)
+
+    def test_lazy_import_missing_module(self):
+        module = lazy_import('cosmicops_missing_module')
+        self.assertIsInstance(module, MissingModule)
+        self.assertNotIn('cosmicops_missing_module', sys.modules)
+
+        with self.assertRaises(ModuleNotFoundError):
+            module.connect()
+
+    def test_lazy_import_threads(self):
+        with tempfile.TemporaryDirectory() as path:
+            # The attribute is only set after a while, threads must not see the module before it's fully loaded
+            (Path(path) / 'cosmicops_slow_module.py').write_text('import time\ntime.sleep(0.1)\nVALUE = 42\n')
+            sys.path.insert(0, path)
+            self.addCleanup(sys.path.remove, path)
+            self.addCleanup(sys.modules.pop, 'cosmicops_slow_module', None)
+
+            module = lazy_import('cosmicops_slow_module')
+            barrier = threading.Barrier(8)
+
+            def get_value():
+                barrier.wait()
+                return module.VALUE
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                futures = [executor.submit(get_value) for _ in range(8)]
+
+            self.assertEqual([42] * 8, [future.result() for future in futures])
+
+    def test_import_cosmicops(self):
+        self.assertEqual([], self._loaded_modules('import cosmicops'))
+        self.assertEqual([], self._loaded_modules('import cosmicops.who_has_this_ip'))
+        self.assertEqual([], self._loaded_modules('from cosmicops import CosmicOps, RebootAction'))
+        self.assertEqual(['pymysql'], self._loaded_modules('from cosmicops import sql; sql.pymysql.Error'))
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import threading
 from pathlib import Path
 from unittest import TestCase
 from unittest.mock import patch, Mock
@@ -19,12 +21,12 @@ from urllib.error import URLError
 
 from testfixtures import tempdir
 
-from cosmicops.log import CosmicLog, WARNING, ERROR, INFO
+from cosmicops.log import CosmicLog, WARNING, ERROR, INFO, DEBUG, timed_event
 
 
 class TestCosmicLog(TestCase):
     def setUp(self):
-        slack_patcher = patch('cosmicops.log.Slack')
+        slack_patcher = patch('slack_webhook.Slack')
         self.mock_slack = slack_patcher.start()
         self.addCleanup(slack_patcher.stop)
         self.slack_instance = self.mock_slack.return_value
@@ -73,6 +75,7 @@ class TestCosmicLog(TestCase):
         self.logging.zone_name = 'test_zone_name'
 
         self.logging._send_slack_message('test_message')
+        self.logging.flush()
 
         call_args = self.slack_instance.post.call_args
         attachment = call_args[1]['attachments'][0]
@@ -92,4 +95,154 @@ class TestCosmicLog(TestCase):
         self.slack_instance.post.side_effect = URLError(Mock())
         self.logging._slack = self.slack_instance
 
-        self.logging._send_slack_message('test_message_failure')
+        self.logging.slack_retry_delay = 0
+
+        with patch('builtins.print') as print_mock:
+            self.logging._send_slack_message('test_message_failure')
+            self.logging.flush()
+
+        self.assertEqual(3, self.slack_instance.post.call_count)
+        print_mock.assert_called_with('warning: Slack post failed.')
+
+    def test_send_slack_message_retry(self):
+        self.slack_instance.post.side_effect = [URLError(Mock()), None]
+        self.logging._slack = self.slack_instance
+        self.logging.slack_retry_delay = 0
+
+        self.logging._send_slack_message('test_message_retry')
+        self.logging.flush()
+
+        self.assertEqual(2, self.slack_instance.post.call_count)
+
+    def test_send_slack_message_batched(self):
+        self.logging._slack = self.slack_instance
+
+        self.logging.task = 'first_task'
+        self.logging._send_slack_message('first_message')
+        self.logging.task = 'second_task'
+        self.logging._send_slack_message('second_message', 'danger')
+        self.logging.flush()
+
+        self.slack_instance.post.assert_called_once()
+        attachments = self.slack_instance.post.call_args[1]['attachments']
+        self.assertEqual(['first_message', 'second_message'], [a['text'] for a in attachments])
+        self.assertEqual(['first_task', 'second_task'], [a['fields'][2]['value'] for a in attachments])
+        self.assertEqual('danger', attachments[1]['color'])
+
+    def test_send_slack_message_queue_full(self):
+        self.logging._slack = self.slack_instance
+        self.logging._start_slack_sender = Mock()
+        self.logging._slack_queue.maxsize = 1
+
+        with patch('builtins.print') as print_mock:
+            self.logging._send_slack_message('first_message')
+            self.logging._send_slack_message('second_message')
+
+        print_mock.assert_called_once_with('warning: Slack queue is full, dropping message')
+
+    def test_flush_without_sender(self):
+        self.logging.flush()
+        self.assertIsNone(self.logging._slack_sender)
+
+    @tempdir()
+    def test_event(self, tmp):
+        self.logging.event_file = f"{tmp.path}/events.jsonl"
+        self.logging.task = 'test_task'
+        self.logging.cluster = 'test_cluster'
+
+        with self.logging.event('test.operation', 'test_id', extra='test_extra') as event:
+            event.retries = 2
+
+        with self.assertRaises(RuntimeError):
+            with self.logging.event('test.error', 'test_id'):
+                raise RuntimeError
+
+        with open(self.logging.event_file) as f:
+            events = [json.loads(line) for line in f]
+
+        self.assertEqual(2, len(events))
+        self.assertEqual('test.operation', events[0]['operation'])
+        self.assertEqual('test_id', events[0]['object_id'])
+        self.assertEqual('success', events[0]['outcome'])
+        self.assertEqual(2, events[0]['retries'])
+        self.assertEqual('test_extra', events[0]['extra'])
+        self.assertEqual('test_task', events[0]['task'])
+        self.assertEqual('test_cluster', events[0]['cluster'])
+        self.assertGreaterEqual(events[0]['duration'], 0)
+        self.assertLessEqual(events[0]['start'], events[0]['end'])
+        self.assertEqual('error', events[1]['outcome'])
+
+    def test_event_without_event_file(self):
+        self.logging.event_file = None
+
+        with patch('builtins.open') as open_mock:
+            with self.logging.event('test.operation', 'test_id') as event:
+                pass
+
+        open_mock.assert_not_called()
+        self.assertEqual('success', event.outcome)
+        self.assertIsNotNone(event.duration)
+
+    def test_timed_event(self):
+        class TestObject(dict):
+            dry_run = False
+
+            @timed_event('test.method')
+            def method(self, result):
+                return result
+
+        test_object = TestObject(id='test_id', name='test_name')
+
+        with patch('cosmicops.log.logging._write_event') as write_event_mock:
+            self.assertTrue(test_object.method(True))
+            self.assertFalse(test_object.method(False))
+
+        (success_event,), _ = write_event_mock.call_args_list[0]
+        (failure_event,), _ = write_event_mock.call_args_list[1]
+        self.assertEqual('test.method', success_event.operation)
+        self.assertEqual('test_id', success_event.object_id)
+        self.assertEqual('test_name', success_event.fields['name'])
+        self.assertEqual('success', success_event.outcome)
+        self.assertEqual('failure', failure_event.outcome)
+
+    def test_context(self):
+        self.logging.cluster = 'outer_cluster'
+
+        with self.logging.context(cluster='inner_cluster', vm_name='inner_vm'):
+            self.assertEqual('inner_cluster', self.logging.cluster)
+            self.assertEqual('inner_vm', self.logging.vm_name)
+
+        self.assertEqual('outer_cluster', self.logging.cluster)
+        self.assertEqual('Undefined', self.logging.vm_name)
+
+        with self.assertRaises(ValueError):
+            with self.logging.context(unknown='value'):
+                pass
+
+    def test_context_is_thread_local(self):
+        self.logging.cluster = 'main_cluster'
+        thread_values = {}
+
+        def worker(name):
+            self.logging.cluster = name
+            thread_values[name] = self.logging.cluster
+
+        threads = [threading.Thread(target=worker, args=(f'cluster{i}',)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual({f'cluster{i}': f'cluster{i}' for i in range(4)}, thread_values)
+        self.assertEqual('main_cluster', self.logging.cluster)
+
+    def test_log_level_disabled(self):
+        self.logging.timestamp_format = '%H:%M:%S: '
+
+        with patch('cosmicops.log.logging_module') as logging_module_mock, \
+                patch('cosmicops.log.datetime') as datetime_mock:
+            logging_module_mock.getLogger.return_value.isEnabledFor.return_value = False
+            self.logging._log(DEBUG, 'debug message', False)
+
+        logging_module_mock.log.assert_not_called()
+        datetime_mock.now.assert_not_called()
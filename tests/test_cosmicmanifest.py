@@ -0,0 +1,66 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from testfixtures import tempdir
+
+from cosmicops.manifest import CosmicManifest
+from cosmicops.objects.storagepool import FileInfo
+
+
+class TestCosmicManifest(TestCase):
+    @tempdir()
+    def test_update(self, tmp):
+        manifest = CosmicManifest(str(Path(tmp.path) / 'manifests' / 'manifest.db'))
+
+        self.assertDictEqual({}, manifest.get_directories('p1'))
+        self.assertListEqual([], manifest.get_files('p1'))
+
+        files = [FileInfo(1, 512, 1.5, '/mnt/p1/volume1'), FileInfo(2, 1024, 2.5, '/mnt/p1/volume2')]
+        manifest.update('p1', {'/mnt/p1': 3.5}, files)
+        manifest.update('p2', {'/mnt/p2': 4.5}, [])
+
+        self.assertDictEqual({'/mnt/p1': 3.5}, manifest.get_directories('p1'))
+        self.assertListEqual(files, sorted(manifest.get_files('p1'), key=lambda f: f.path))
+
+        manifest.update('p1', {}, [])
+        self.assertDictEqual({}, manifest.get_directories('p1'))
+        self.assertDictEqual({'/mnt/p2': 4.5}, manifest.get_directories('p2'))
+        manifest.close()
+
+    @tempdir()
+    def test_record_run(self, tmp):
+        manifest = CosmicManifest(str(Path(tmp.path) / 'manifest.db'))
+
+        self.assertIsNone(manifest.get_last_run('p1'))
+
+        manifest.record_run('p1', {'volume1': 512, 'volume2': 1024})
+        self.assertDictEqual({'volume1': 512, 'volume2': 1024}, manifest.get_orphans('p1'))
+
+        manifest.record_run('p1', {'volume2': 2048})
+        self.assertDictEqual({'volume2': 2048}, manifest.get_orphans('p1'))
+        self.assertEqual((1, 2048), manifest.get_last_run('p1')[1:])
+        manifest.close()
+
+    @tempdir()
+    def test_default_path(self, tmp):
+        with patch('pathlib.Path.home') as path_home_mock:
+            path_home_mock.return_value = Path(tmp.path)
+            manifest = CosmicManifest()
+
+        self.assertEqual(str(Path(tmp.path) / '.cosmicops' / 'manifest.db'), manifest.path)
+        manifest.close()
@@ -0,0 +1,102 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from testfixtures import tempdir
+
+from cosmicops.log import logging, CosmicEvent
+from cosmicops.metrics import CosmicMetrics
+
+
+class TestCosmicMetrics(TestCase):
+    def setUp(self):
+        self.metrics = CosmicMetrics()
+        self.addCleanup(self._remove_listener)
+
+    def _remove_listener(self):
+        if self.metrics.observe_event in logging.event_listeners:
+            logging.event_listeners.remove(self.metrics.observe_event)
+
+    def test_inc_and_set(self):
+        self.metrics.inc('hosts_processed_total', task='test')
+        self.metrics.inc('hosts_processed_total', 2, task='test')
+        self.metrics.set('host_duration_seconds', 10, host='host1')
+        self.metrics.set('host_duration_seconds', 20, host='host1')
+
+        self.assertEqual(3, self.metrics.get('hosts_processed_total', task='test'))
+        self.assertEqual(20, self.metrics.get('host_duration_seconds', host='host1'))
+        self.assertEqual(0, self.metrics.get('host_duration_seconds', host='host2'))
+
+    def test_observe_event(self):
+        with logging.context(task='Test task'):
+            event = CosmicEvent('vm.migrate', 'v1', bytes_transferred=1000)
+            event.duration = 4.
+            self.metrics.observe_event(event)
+
+            event = CosmicEvent('vm.migrate', 'v2')
+            event.outcome = 'failure'
+            event.duration = 1.
+            self.metrics.observe_event(event)
+
+        self.assertEqual(1, self.metrics.get('operations_total', operation='vm.migrate', outcome='success',
+                                             task='Test task'))
+        self.assertEqual(1, self.metrics.get('operations_total', operation='vm.migrate', outcome='failure',
+                                             task='Test task'))
+        self.assertEqual(5., self.metrics.get('operation_duration_seconds_total', operation='vm.migrate',
+                                              task='Test task'))
+        self.assertEqual(1000, self.metrics.get('bytes_transferred_total', operation='vm.migrate', task='Test task'))
+        self.assertEqual(250., self.metrics.get('migration_throughput_bytes_per_second', operation='vm.migrate',
+                                                task='Test task'))
+
+    def test_render(self):
+        self.metrics.inc('hosts_processed_total', task='Rolling "Reboot"')
+
+        self.assertEqual(
+            '# HELP cosmicops_hosts_processed_total Number of hosts processed\n'
+            '# TYPE cosmicops_hosts_processed_total counter\n'
+            'cosmicops_hosts_processed_total{task="Rolling \\"Reboot\\""} 1\n',
+            self.metrics.render())
+
+    @tempdir()
+    def test_enable(self, tmp):
+        textfile = f"{tmp.path}/cosmicops.prom"
+        self.metrics.enable(textfile)
+        self.metrics.enable(textfile)
+
+        self.assertEqual(1, logging.event_listeners.count(self.metrics.observe_event))
+
+        with logging.event('host.reboot', 'h1'):
+            pass
+
+        with open(textfile) as f:
+            content = f.read()
+
+        self.assertIn('cosmicops_operations_total{operation="host.reboot",outcome="success"', content)
+        self.assertIn('cosmicops_last_update_timestamp_seconds', content)
+
+    def test_write_failure(self):
+        self.metrics.textfile = '/nonexistent/cosmicops.prom'
+
+        with patch('cosmicops.metrics.logging.warning') as mock_warning:
+            self.metrics.write()
+
+        mock_warning.assert_called()
+
+    def test_write_disabled(self):
+        with patch('cosmicops.metrics.tempfile') as mock_tempfile:
+            self.metrics.write()
+
+        mock_tempfile.NamedTemporaryFile.assert_not_called()
@@ -0,0 +1,461 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock, patch
+
+from cs import CloudStackException
+from requests.exceptions import ConnectionError
+
+from cosmicops import CosmicOps, logging
+from cosmicops.api_profiler import CosmicApiProfiler
+from cosmicops.migration import DEFAULT_THROUGHPUT, FAILED, HostEvacuationScheduler, MigrationClients, \
+    MigrationWindowScheduler, SUCCEEDED, VolumeMigrationScheduler, VolumeMigrationTracker
+from cosmicops.objects import CosmicCluster, CosmicHost, CosmicStoragePool, CosmicVM, CosmicVolume
+
+
+class TestVolumeMigrationTracker(TestCase):
+    def setUp(self):
+        cs_patcher = patch('cs.CloudStack')
+        self.mock_cs = cs_patcher.start()
+        self.addCleanup(cs_patcher.stop)
+        self.cs_instance = self.mock_cs.return_value
+
+        sleep_patcher = patch('time.sleep', return_value=None)
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+        self.events = []
+        logging.event_listeners.append(self.events.append)
+        self.addCleanup(logging.event_listeners.remove, self.events.append)
+
+        self.ops = CosmicOps(endpoint='https://localhost', key='key', secret='secret', dry_run=False)
+        self.cs_instance.migrateVolume.side_effect = self._migrate_volume
+        self.cs_instance.queryAsyncJobResult.side_effect = self._query_async_job_result
+        self.cs_instance.listVolumes.side_effect = self._list_volumes
+
+        self.source_pools = [CosmicStoragePool(self.ops, {'id': f'sp{i}', 'name': f'source_pool{i}'}) for i in (1, 2)]
+        self.target_pool = CosmicStoragePool(self.ops, {'id': 'tp1', 'name': 'target_pool'})
+
+        # Number of polls until each volume's migration job finishes
+        self.durations = {'v1': 3, 'v2': 1, 'v3': 5}
+        self.failing_jobs = set()
+        self.jobs = {}
+        self.started = []
+        self.max_running = {}
+
+        self.tracker = VolumeMigrationTracker(self.ops, max_per_source_pool=1, max_per_target_pool=2)
+        self.volumes = {}
+        for (volume_id, source_pool) in (('v1', 0), ('v2', 0), ('v3', 1)):
+            self.volumes[volume_id] = CosmicVolume(self.ops, {'id': volume_id, 'name': volume_id,
+                                                              'storageid': self.source_pools[source_pool]['id']})
+            self.tracker.add(self.volumes[volume_id], self.source_pools[source_pool], self.target_pool)
+
+    def _running(self, storage_id=None):
+        return [v for (v, polls) in self.jobs.items() if
+                polls > 0 and storage_id in (None, self.volumes[v]['storageid'])]
+
+    def _migrate_volume(self, volumeid, storageid, livemigrate):
+        self.jobs[volumeid] = self.durations[volumeid]
+        self.started.append(volumeid)
+
+        for storage_id in (None, self.volumes[volumeid]['storageid']):
+            self.max_running[storage_id] = max(self.max_running.get(storage_id, 0), len(self._running(storage_id)))
+
+        return {'jobid': f'job-{volumeid}'}
+
+    def _query_async_job_result(self, jobid):
+        volume_id = jobid[4:]
+        self.jobs[volume_id] -= 1
+        if self.jobs[volume_id] <= 0:
+            return {'jobstatus': 2 if volume_id in self.failing_jobs else 1}
+
+        return {'jobstatus': 0}
+
+    def _list_volumes(self, fetch_list, id):
+        state = 'Ready' if self.jobs[id] <= 0 else 'Migrating'
+        return [{'id': id, 'name': id, 'path': f'path-{id}', 'storageid': 'tp1', 'state': state}]
+
+    def test_run(self):
+        self.assertTrue(self.tracker.run())
+
+        self.assertEqual(['v1', 'v3', 'v2'], self.started)
+        self.assertEqual({None: 2, 'sp1': 1, 'sp2': 1}, self.max_running)
+        self.assertTrue(all(m.state == SUCCEEDED for m in self.tracker.migrations))
+        self.assertEqual('tp1', self.volumes['v1']['storageid'])
+        self.cs_instance.migrateVolume.assert_any_call(volumeid='v1', storageid='tp1', livemigrate=True)
+
+        self.assertEqual(['volume.migrate'] * 3, [e.operation for e in self.events])
+        self.assertEqual({'success'}, {e.outcome for e in self.events})
+        self.assertEqual(('source_pool1', 'target_pool'),
+                         (self.events[0].fields['source_pool'], self.events[0].fields['target_pool']))
+
+    def test_target_pool_limit(self):
+        self.tracker.max_per_source_pool = 2
+        self.tracker.max_per_target_pool = 1
+
+        self.assertTrue(self.tracker.run())
+        self.assertEqual(['v1', 'v2', 'v3'], self.started)
+        self.assertEqual(1, self.max_running[None])
+
+    def test_max_running(self):
+        self.tracker.max_per_source_pool = 2
+        self.tracker.max_running = 1
+
+        self.assertTrue(self.tracker.run())
+        self.assertEqual(1, self.max_running[None])
+
+    def test_zero_limit(self):
+        self.tracker.max_per_target_pool = 0
+
+        self.assertRaises(ValueError, self.tracker.run)
+        self.cs_instance.migrateVolume.assert_not_called()
+
+    @patch('builtins.print')
+    def test_show_progress(self, mock_print):
+        self.ops.show_progress = False
+
+        self.assertTrue(self.tracker.run())
+        mock_print.assert_not_called()
+
+    @patch('time.monotonic')
+    def test_byte_rate_budget(self, mock_monotonic):
+        now = [1000.]
+        mock_monotonic.side_effect = lambda: now[0]
+        self.mock_sleep.side_effect = lambda seconds: now.__setitem__(0, now[0] + seconds)
+
+        for (volume, size) in zip(self.volumes.values(), (100, 50, 10)):
+            volume['size'] = size
+        self.durations = {'v1': 1, 'v2': 1, 'v3': 1}
+        self.tracker.max_per_source_pool = 3
+        self.tracker.max_per_target_pool = 3
+        self.tracker.max_bytes_per_second = 10
+
+        start_times = {}
+        migrate_volume = self._migrate_volume
+        self.cs_instance.migrateVolume.side_effect = lambda volumeid, **kwargs: (
+            start_times.__setitem__(volumeid, now[0]), migrate_volume(volumeid, **kwargs))[1]
+
+        self.assertTrue(self.tracker.run())
+
+        # All migrations share the target pool, v1 reserves it for 10 seconds and v2 for 5 more
+        self.assertEqual(1000., start_times['v1'])
+        self.assertEqual(1010., start_times['v2'])
+        self.assertEqual(1015., start_times['v3'])
+
+    def test_failure(self):
+        def migrate_volume(volumeid, **kwargs):
+            if volumeid == 'v1':
+                raise CloudStackException(response=Mock())
+            return self._migrate_volume(volumeid, **kwargs)
+
+        self.cs_instance.migrateVolume.side_effect = migrate_volume
+
+        self.assertFalse(self.tracker.run())
+        self.assertEqual([FAILED, SUCCEEDED, SUCCEEDED], [m.state for m in self.tracker.migrations])
+        self.assertEqual(['failure', 'success', 'success'], [e.outcome for e in self.events])
+        self.assertEqual(['v2', 'v3'], self.started)
+
+        self.durations['v3'] = 1
+        self.failing_jobs.add('v3')
+        self.cs_instance.migrateVolume.side_effect = self._migrate_volume
+        tracker = VolumeMigrationTracker(self.ops)
+        migration = tracker.add(self.volumes['v3'], self.source_pools[1], self.target_pool)
+        self.assertFalse(tracker.run())
+        self.assertEqual(FAILED, migration.state)
+
+    def test_retries(self):
+        self.cs_instance.queryAsyncJobResult.side_effect = ConnectionError('Connection aborted')
+
+        self.assertFalse(self.tracker.run())
+
+        self.assertEqual({FAILED}, {m.state for m in self.tracker.migrations})
+        self.assertEqual(10, self.events[0].retries)
+
+    def test_progress(self):
+        source_host = MagicMock()
+        source_host.get_blkjobinfo.return_value = Mock(current=512, end=1024)
+        tracker = VolumeMigrationTracker(self.ops)
+        migration = tracker.add(self.volumes['v3'], self.source_pools[1], self.target_pool, source_host=source_host,
+                                vm_instancename='i-1-VM')
+
+        self.assertTrue(tracker.run())
+        source_host.get_blkjobinfo.assert_called_with('i-1-VM', 'path-v3')
+        self.assertEqual((512, 1024), (migration.bytes_copied, migration.bytes_total))
+        self.assertEqual(512, self.events[0].fields['bytes_transferred'])
+
+    def test_dry_run(self):
+        self.ops.dry_run = True
+        for volume in self.volumes.values():
+            volume.dry_run = True
+
+        self.assertTrue(self.tracker.run())
+        self.cs_instance.migrateVolume.assert_not_called()
+
+
+class TestVolumeMigrationScheduler(TestCase):
+    def setUp(self):
+        self.ops = Mock(dry_run=True, log_to_slack=False)
+        self.destination_pools = [
+            CosmicStoragePool(self.ops, {'id': 'dp1', 'name': 'pool1', 'disksizetotal': 1000, 'disksizeused': 600}),
+            CosmicStoragePool(self.ops, {'id': 'dp2', 'name': 'pool2', 'disksizetotal': 1000, 'disksizeused': 500})
+        ]
+        self.source_pool = CosmicStoragePool(self.ops, {'id': 'sp1', 'name': 'source_pool'})
+        self.scheduler = VolumeMigrationScheduler(self.ops, self.destination_pools, max_running=4)
+
+    def test_plan(self):
+        for (volume_id, size) in (('v1', 50), ('v2', 300), ('v3', 200), ('v4', 500)):
+            self.scheduler.add(CosmicVolume(self.ops, {'id': volume_id, 'name': volume_id, 'size': size}),
+                               self.source_pool)
+
+        migrations = self.scheduler.plan()
+
+        # Largest first, each to the pool with the most free space left, v3 doesn't fit anymore
+        self.assertEqual([('v4', 'dp2'), ('v2', 'dp1'), ('v1', 'dp1')],
+                         [(m.volume['id'], m.target_pool['id']) for m in migrations])
+        self.assertFalse(self.scheduler.tracker.live_migrate)
+        self.assertEqual(4, self.scheduler.tracker.max_running)
+
+    @patch('cosmicops.migration.logging')
+    @patch('cosmicops.migration.history')
+    def test_plan_estimate(self, mock_history, mock_logging):
+        mock_history.estimate.side_effect = [None, 120., None, None]
+        for (volume_id, size) in (('v1', 50), ('v2', 300)):
+            self.scheduler.add(CosmicVolume(self.ops, {'id': volume_id, 'name': volume_id, 'size': size}),
+                               self.source_pool)
+
+        self.scheduler.plan()
+
+        # Without history for the pool pair, the history of the destination pool is used
+        mock_history.estimate.assert_any_call(300, operation='volume.migrate', source_pool='source_pool',
+                                              target_pool='pool2')
+        mock_history.estimate.assert_any_call(300, operation='volume.migrate', target_pool='pool2')
+        mock_logging.info.assert_any_call(
+            "Volume 'v2' will be migrated from storage pool 'source_pool' to 'pool2', expected to take 120s")
+        mock_logging.info.assert_any_call("Volume 'v1' will be migrated from storage pool 'source_pool' to 'pool1'")
+
+    def test_run(self):
+        self.scheduler.add(CosmicVolume(self.ops, {'id': 'v1', 'name': 'v1', 'size': 50}), self.source_pool)
+
+        self.assertTrue(self.scheduler.run())
+        self.ops.cs.migrateVolume.assert_not_called()
+
+
+class TestMigrationWindowScheduler(TestCase):
+    def setUp(self):
+        time_patcher = patch('time.time')
+        self.mock_time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.now = 1000.
+        self.mock_time.side_effect = lambda: self.now
+
+        self.finished = []
+        self.scheduler = MigrationWindowScheduler(window_end=1100., throughput=10)
+
+    def _job(self, name, duration, result=True):
+        def func():
+            self.now += duration
+            self.finished.append(name)
+            return result
+
+        return func
+
+    def test_window(self):
+        self.scheduler.add('small', 100, self._job('small', 20))
+        self.scheduler.add('large', 500, self._job('large', 90))
+        self.scheduler.add('too_large', 1200, self._job('too_large', 120))
+
+        not_started = self.scheduler.run()
+
+        # The first migration was slower than assumed, so 'small' doesn't fit in the last 10 seconds anymore
+        self.assertEqual(['large'], self.finished)
+        self.assertEqual(['too_large', 'small'], [j.name for j in not_started])
+        self.assertAlmostEqual(90., self.scheduler.predict(500))
+
+    def test_failures(self):
+        self.scheduler.window_end = None
+        self.scheduler.add('failed', 500, self._job('failed', 10, False))
+
+        def broken():
+            raise RuntimeError('Lost connection')
+
+        self.scheduler.add('broken', 100, broken)
+        self.scheduler.add('small', 100, self._job('small', 20))
+
+        self.assertEqual([], self.scheduler.run())
+        self.assertEqual([False, False, True], [j.result for j in self.scheduler.jobs])
+        self.assertEqual([5.], self.scheduler.observed_throughputs)
+
+    @patch('cosmicops.migration.history')
+    def test_history_throughput(self, mock_history):
+        mock_history.throughput.return_value = 50.
+        self.assertEqual(50., MigrationWindowScheduler().throughput)
+        self.assertEqual(10., MigrationWindowScheduler(throughput=10.).throughput)
+
+        MigrationWindowScheduler(operation='job.wait_for_volume_migration', target_pool='pool1')
+        mock_history.throughput.assert_called_with(operation='job.wait_for_volume_migration', target_pool='pool1')
+
+        mock_history.throughput.return_value = None
+        self.assertEqual(DEFAULT_THROUGHPUT, MigrationWindowScheduler().throughput)
+
+    def test_concurrent(self):
+        scheduler = MigrationWindowScheduler(max_running=3)
+        for name in ('vm1', 'vm2', 'vm3'):
+            scheduler.add(name, 100, self._job(name, 0))
+
+        self.assertEqual([], scheduler.run())
+        self.assertEqual({'vm1', 'vm2', 'vm3'}, set(self.finished))
+
+
+class TestHostEvacuationScheduler(TestCase):
+    def setUp(self):
+        self.ops = Mock(dry_run=True, log_to_slack=False)
+        self.pools = [
+            CosmicStoragePool(self.ops, {'id': 'tp1', 'name': 'pool1', 'state': 'Up', 'disksizetotal': 1000,
+                                         'disksizeused': 600}),
+            CosmicStoragePool(self.ops, {'id': 'tp2', 'name': 'pool2', 'state': 'Up', 'disksizetotal': 1000,
+                                         'disksizeused': 500}),
+            CosmicStoragePool(self.ops, {'id': 'tp3', 'name': 'pool3', 'state': 'Maintenance', 'disksizetotal': 1000,
+                                         'disksizeused': 0})
+        ]
+        self.hosts = [CosmicHost(self.ops, {'id': f'h{i}', 'name': f'host{i}'}) for i in range(2)]
+        self.cluster = CosmicCluster(self.ops, {'id': 'tc1', 'name': 'target_cluster'})
+        self.cluster.get_storage_pools = Mock(return_value=self.pools)
+        self.cluster.find_migration_host = Mock(side_effect=lambda vm, capacity: self.hosts[len(vm['name']) % 2])
+        self.capacity = Mock()
+        self.scheduler = HostEvacuationScheduler(self.cluster, max_running=2, capacity=self.capacity)
+
+    def _add(self, name, *sizes):
+        vm = CosmicVM(self.ops, {'id': name, 'name': name})
+        vm.get_volumes = Mock(return_value=[CosmicVolume(self.ops, {'id': f'{name}-{i}', 'size': size}) for
+                                            (i, size) in enumerate(sizes)])
+        self.scheduler.add(vm)
+
+        return vm
+
+    def test_plan(self):
+        self._add('vm1', 50)
+        self._add('vm2', 200, 100)
+        self._add('vm3', 200)
+        self._add('vm4', 500)
+
+        evacuations = self.scheduler.plan()
+
+        # Largest first, each to the pool with the most free space left, vm3 doesn't fit anymore
+        self.assertEqual([('vm4', 'tp2', 500), ('vm2', 'tp1', 300), ('vm1', 'tp1', 50)],
+                         [(e.vm['id'], e.target_pool['id'], e.size) for e in evacuations])
+        self.assertEqual(['vm3'], [vm['id'] for vm in self.scheduler.skipped])
+        self.cluster.get_storage_pools.assert_called_once_with(scope='CLUSTER')
+        self.cluster.find_migration_host.assert_called_with(evacuations[-1].vm, capacity=self.capacity)
+
+    def test_plan_no_host(self):
+        self.cluster.find_migration_host.side_effect = None
+        self.cluster.find_migration_host.return_value = None
+        self._add('vm1', 50)
+
+        self.assertEqual([], self.scheduler.plan())
+        self.assertFalse(self.scheduler.run(Mock()))
+
+    def test_run(self):
+        lock = threading.Lock()
+        running = []
+        max_running = {'total': 0, 'tp1': 0, 'tp2': 0}
+
+        def migrate(vm, destination_host, target_pool):
+            with lock:
+                running.append(target_pool['id'])
+                max_running['total'] = max(max_running['total'], len(running))
+                max_running[target_pool['id']] = max(max_running[target_pool['id']], running.count(target_pool['id']))
+            time.sleep(0.01)
+            with lock:
+                running.remove(target_pool['id'])
+
+            return True
+
+        for i in range(6):
+            self._add(f'vm{i}', 100)
+
+        self.assertTrue(self.scheduler.run(migrate))
+        self.assertEqual({'total': 2, 'tp1': 1, 'tp2': 1}, max_running)
+        self.assertTrue(all(e.state == SUCCEEDED for e in self.scheduler.evacuations))
+
+    def test_run_failure(self):
+        vms = [self._add('vm1', 10), self._add('vm2', 20)]
+
+        def migrate(vm, destination_host, target_pool):
+            if vm is vms[0]:
+                raise RuntimeError('failed')
+
+            return True
+
+        self.assertFalse(self.scheduler.run(migrate))
+        self.assertEqual({'vm1': FAILED, 'vm2': SUCCEEDED},
+                         {e.vm['id']: e.state for e in self.scheduler.evacuations})
+
+
+class TestMigrationClients(TestCase):
+    def setUp(self):
+        self.co = Mock(dry_run=False, log_to_slack=True)
+        self.cs = Mock(dry_run=False)
+
+    def test_shared(self):
+        clients = MigrationClients(self.co, self.cs, 'profile', concurrent=False)
+
+        self.assertEqual((self.co, self.cs), clients.get())
+        self.assertEqual((self.co, self.cs), clients.get())
+
+    @patch('cosmicops.migration.CosmicSQL')
+    @patch('cosmicops.migration.CosmicOps')
+    def test_concurrent(self, mock_co, mock_cs):
+        mock_co.side_effect = lambda **kwargs: Mock()
+        clients = MigrationClients(self.co, None, 'profile', concurrent=True)
+        results = []
+
+        def get_clients():
+            results.append((clients.get(), clients.get()))
+
+        threads = [threading.Thread(target=get_clients) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every thread opens its own connections once
+        self.assertEqual(2, mock_co.call_count)
+        mock_co.assert_called_with(profile='profile', dry_run=False, log_to_slack=True, show_progress=False)
+        mock_cs.assert_not_called()
+        self.assertTrue(all(first == second for (first, second) in results))
+        self.assertEqual(2, len(set(co for ((co, _), _) in results)))
+        self.assertTrue(all(cs is None for ((_, cs), _) in results))
+
+    @patch('cosmicops.migration.CosmicSQL')
+    @patch('cosmicops.migration.CosmicOps')
+    def test_api_profiling(self, mock_co, mock_cs):
+        self.co.cs = CosmicApiProfiler(Mock())
+        (thread_co, thread_cs) = MigrationClients(self.co, self.cs, 'profile', concurrent=True).get()
+
+        self.assertIsInstance(thread_co.cs, CosmicApiProfiler)
+        self.assertIs(self.co.cs.stats, thread_co.cs.stats)
+        mock_cs.assert_called_once_with(server='profile', dry_run=False)
+
+    @patch('cosmicops.migration.CosmicSQL')
+    @patch('cosmicops.migration.CosmicOps')
+    def test_id_cache(self, mock_co, mock_cs):
+        self.cs._id_cache = {'service_offering': {'Small': 'so1'}}
+        (_, thread_cs) = MigrationClients(self.co, self.cs, 'profile', concurrent=True).get()
+
+        self.assertIs(self.cs._id_cache, thread_cs._id_cache)
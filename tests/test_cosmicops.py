@@ -14,14 +14,16 @@
 
 from pathlib import Path
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
 from cs import CloudStackException
 from requests.exceptions import ConnectionError
 from testfixtures import tempdir
 
-from cosmicops import CosmicOps
+from cosmicops import ConvergencePolicy, CosmicOps
 from cosmicops.objects import CosmicZone, CosmicPod
+from cosmicops.api_profiler import CosmicApiProfiler
+from cosmicops.objects.host import DomJobInfo
 from cosmicops.objects.object import CosmicObject
 # noinspection PyProtectedMember
 from cosmicops.ops import _load_cloud_monkey_profile
@@ -29,12 +31,12 @@ from cosmicops.ops import _load_cloud_monkey_profile
 
 class TestCosmicOps(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
 
-        slack_patcher = patch('cosmicops.log.Slack')
+        slack_patcher = patch('slack_webhook.Slack')
         self.mock_slack = slack_patcher.start()
         self.addCleanup(slack_patcher.stop)
 
@@ -44,6 +46,22 @@ class TestCosmicOps(TestCase):
 
         self.co = CosmicOps(endpoint='https://localhost', key='key', secret='secret')
 
+    @patch('cosmicops.ops.atexit')
+    def test_enable_api_profiling(self, mock_atexit):
+        profiler = self.co.enable_api_profiling('profile.json')
+
+        self.assertIsInstance(self.co.cs, CosmicApiProfiler)
+        self.assertEqual(profiler, self.co.enable_api_profiling())
+        mock_atexit.register.assert_called_once_with(self.co.report_api_profile, 'profile.json')
+
+        self.cs_instance.listZones.return_value = [{'id': 'z1', 'name': 'zone1'}]
+        self.co.get_zone(name='zone1')
+        self.assertEqual(1, profiler.stats[('Undefined', 'listZones')].count)
+
+        with patch.object(profiler, 'dump') as mock_dump:
+            self.co.report_api_profile('profile.json')
+            mock_dump.assert_called_with('profile.json')
+
     @patch('cosmicops.ops._load_cloud_monkey_profile')
     def test_init_with_profile(self, mock_load):
         mock_load.return_value = ('profile_endpoint', 'profile_key', 'profile_secret')
@@ -228,3 +246,108 @@ class TestCosmicOps(TestCase):
     def test_wait_for_job_failure(self):
         self.cs_instance.queryAsyncJobResult.return_value = {'jobstatus': '2'}
         self.assertFalse(self.co.wait_for_job('job'))
+
+    @patch('cosmicops.ops.ConvergenceController')
+    def test_wait_for_vm_migration_job(self, mock_controller):
+        self.cs_instance.queryAsyncJobResult.side_effect = [{'jobstatus': '0'}, {'jobstatus': '1'}]
+        source_host = MagicMock()
+        source_host.get_domjobstats.return_value = DomJobInfo(dataTotal=2048, dataProcessed=1024, memDirtyRate=10)
+        policy = ConvergencePolicy(max_downtime=1000)
+
+        self.assertTrue(self.co.wait_for_vm_migration_job('job', source_host=source_host, instancename='i-1-VM',
+                                                          convergence=policy))
+        mock_controller.assert_called_once_with(source_host, 'i-1-VM', policy)
+        mock_controller.return_value.update.assert_called_with(source_host.get_domjobstats.return_value)
+        self.assertEqual(2, mock_controller.return_value.update.call_count)
+
+        # Without job stats there's nothing to control
+        mock_controller.reset_mock()
+        self.cs_instance.queryAsyncJobResult.side_effect = [{'jobstatus': '1'}]
+        self.assertTrue(self.co.wait_for_vm_migration_job('job', convergence=policy))
+        mock_controller.assert_not_called()
+
+    @patch('builtins.print')
+    def test_wait_for_vm_migration_job_without_progress(self, mock_print):
+        self.cs_instance.queryAsyncJobResult.side_effect = [{'jobstatus': '0'}, {'jobstatus': '1'}]
+        source_host = MagicMock()
+        source_host.get_domjobstats.return_value = DomJobInfo(dataTotal=2048, dataProcessed=1024)
+
+        self.co.show_progress = False
+        self.assertTrue(self.co.wait_for_vm_migration_job('job', source_host=source_host, instancename='i-1-VM'))
+        mock_print.assert_not_called()
+
+    def test_wait_for_volume_migration_job(self):
+        self.cs_instance.queryAsyncJobResult.side_effect = [{'jobstatus': '0'}, {'jobstatus': '0'}, {'jobstatus': '1'},
+                                                            {'jobstatus': '1'}]
+        self.cs_instance.listVolumes.side_effect = [[{'id': 'v1', 'path': 'p1', 'state': state}] for state in
+                                                    ('Ready', 'Migrating', 'Migrating', 'Ready')]
+        source_host = Mock()
+        source_host.get_blkjobinfo.return_value = Mock(current=1024, end=2048)
+
+        self.assertTrue(self.co.wait_for_volume_migration_job('v1', 'job', source_host=source_host,
+                                                              vm_instancename='i-1-VM'))
+        source_host.get_blkjobinfo.assert_called_with('i-1-VM', 'p1')
+        self.assertEqual(3, self.mock_sleep.call_count)
+        self.assertLess(max(c[0][0] for c in self.mock_sleep.call_args_list), 60)
+
+    def test_wait_for_volume_migration_job_event(self):
+        events = []
+        with patch('cosmicops.log.logging.event_listeners', [events.append]):
+            self.cs_instance.queryAsyncJobResult.return_value = {'jobstatus': '1'}
+            self.cs_instance.listVolumes.return_value = [{'id': 'v1', 'path': 'p1', 'state': 'Ready', 'size': 4096}]
+            self.assertTrue(self.co.wait_for_volume_migration_job('v1', 'job', source_pool='pool1', target_pool='pool2'))
+
+        # Without block job info the volume size is taken as the transferred bytes
+        self.assertDictEqual({'volume_id': 'v1', 'source_pool': 'pool1', 'target_pool': 'pool2',
+                              'bytes_transferred': 4096}, events[0].fields)
+
+        # The event of a caller gets the bytes instead of a separate job event
+        event = Mock(fields={})
+        with patch('cosmicops.log.logging.event_listeners', [events.append]):
+            self.assertTrue(self.co.wait_for_volume_migration_job('v1', 'job', event=event))
+        self.assertEqual(1, len(events))
+        self.assertEqual(4096, event.fields['bytes_transferred'])
+
+    def test_wait_for_volume_migration_job_failure(self):
+        self.cs_instance.queryAsyncJobResult.return_value = {'jobstatus': '2'}
+        self.cs_instance.listVolumes.return_value = [{'id': 'v1', 'path': 'p1', 'state': 'Ready'}]
+        self.assertFalse(self.co.wait_for_volume_migration_job('v1', 'job'))
+
+        self.cs_instance.queryAsyncJobResult.return_value = {'jobstatus': '0'}
+        self.cs_instance.listVolumes.return_value = []
+        self.assertFalse(self.co.wait_for_volume_migration_job('v1', 'job'))
+
+    def test_poll_volume_migration(self):
+        event = Mock(fields={})
+        source_host = Mock()
+        source_host.get_blkjobinfo.return_value = Mock(current=1024, end=2048)
+        self.cs_instance.queryAsyncJobResult.side_effect = [{'jobstatus': '0'}, {'jobstatus': '1'}, {'jobstatus': '1'}]
+        self.cs_instance.listVolumes.side_effect = [[{'id': 'v1', 'path': 'p1', 'state': state, 'size': 4096}] for
+                                                    state in ('Migrating', 'Migrating', 'Ready')]
+
+        self.assertEqual((0, 1024, 2048), self._poll(event, source_host))
+        self.assertEqual(1024, event.fields['bytes_transferred'])
+
+        # A finished job only counts once the volume is Ready again
+        self.assertEqual((0, 0, 0), self._poll(event, source_host))
+        self.assertEqual((1, 0, 0), self._poll(event, source_host))
+        self.assertEqual(1, source_host.get_blkjobinfo.call_count)
+        self.assertEqual(1024, event.fields['bytes_transferred'])
+
+        self.cs_instance.queryAsyncJobResult.side_effect = None
+        self.cs_instance.queryAsyncJobResult.return_value = {'jobstatus': '1'}
+        self.cs_instance.listVolumes.side_effect = None
+        self.cs_instance.listVolumes.return_value = []
+        self.assertEqual((2, None, 0, 0), self.co.poll_volume_migration('v1', 'job', event))
+
+    def _poll(self, event, source_host):
+        (job_status, volume, current, end) = self.co.poll_volume_migration('v1', 'job', event, source_host, 'i-1-VM')
+        self.assertEqual('v1', volume['id'])
+
+        return job_status, current, end
+
+    def test_wait_for_volume_migration_job_retries(self):
+        self.cs_instance.queryAsyncJobResult.side_effect = ConnectionError('Connection aborted')
+        self.cs_instance.listVolumes.return_value = [{'id': 'v1', 'path': 'p1', 'state': 'Migrating'}]
+        self.assertFalse(self.co.wait_for_volume_migration_job('v1', 'job'))
+        self.assertEqual(10, self.cs_instance.queryAsyncJobResult.call_count)
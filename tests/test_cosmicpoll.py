@@ -0,0 +1,50 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from cosmicops.poll import AdaptivePoll
+
+
+class TestAdaptivePoll(TestCase):
+    def setUp(self):
+        self.poll = AdaptivePoll(minimum=1., maximum=10., factor=2.)
+
+    def test_backoff(self):
+        self.assertEqual([1., 2., 4., 8., 10., 10.], [self.poll.next_interval('Migrating') for _ in range(6)])
+        self.assertEqual(1., self.poll.next_interval('Ready'))
+        self.assertEqual(2., self.poll.next_interval('Ready'))
+
+    @patch('time.monotonic')
+    def test_progress(self, mock_monotonic):
+        for _ in range(4):
+            self.poll.next_interval()
+
+        mock_monotonic.return_value = 100.
+        self.assertEqual(10., self.poll.next_interval(current=0, end=1000))
+
+        # 100 bytes per second leaves 3 seconds
+        mock_monotonic.return_value = 107.
+        self.assertEqual(3., self.poll.next_interval(current=700, end=1000))
+
+        mock_monotonic.return_value = 110.
+        self.assertEqual(1., self.poll.next_interval(current=1000, end=1000))
+
+    @patch('time.sleep')
+    def test_sleep(self, mock_sleep):
+        self.poll.sleep()
+        self.poll.sleep()
+        self.assertEqual([((1.,),), ((2.,),)], mock_sleep.call_args_list)
@@ -21,7 +21,7 @@ from cosmicops.objects import CosmicRouter
 
 class TestCosmicRouter(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
@@ -0,0 +1,134 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from invoke import Result, UnexpectedExit
+
+from cosmicops import logging
+from cosmicops.objects import CosmicHost, CosmicStoragePool, CosmicVolume
+from cosmicops.rsync import FAILED, RsyncEngine, SUCCEEDED
+
+
+class TestRsyncEngine(TestCase):
+    def setUp(self):
+        self.ops = Mock(dry_run=False, log_to_slack=False)
+        self.source_host = CosmicHost(self.ops, {'id': 'sh1', 'name': 'source_host'})
+        self.target_host = CosmicHost(self.ops, {'id': 'th1', 'name': 'target_host', 'ipaddress': '10.0.0.2'})
+        self.source_pool = CosmicStoragePool(self.ops, {'id': 'sp1', 'name': 'source_pool'})
+        self.target_pool = CosmicStoragePool(self.ops, {'id': 'tp1', 'name': 'target_pool'})
+
+        self.events = []
+        logging.event_listeners.append(self.events.append)
+        self.addCleanup(logging.event_listeners.remove, self.events.append)
+
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.concurrent = threading.Event()
+        self.failures = {}
+        self.source_host.execute = Mock(side_effect=self._execute)
+        self.target_host.execute = Mock(side_effect=self._execute)
+
+        self.engine = RsyncEngine(streams=2)
+        self.volumes = [CosmicVolume(self.ops, {'id': f'v{i}', 'name': f'volume{i}', 'path': f'path{i}',
+                                                'size': i * 1024}) for i in (1, 2, 3)]
+        for volume in self.volumes:
+            self.engine.add(volume, self.source_host, self.source_pool, self.target_host, self.target_pool)
+
+    def _execute(self, command, **_):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            if self.running > 1:
+                self.concurrent.set()
+
+        # Give the other streams a chance to start
+        self.concurrent.wait(.5)
+
+        try:
+            path = command.split()[-1] if command.startswith('md5sum') else command.split()[-2]
+            if self.failures.get(path):
+                self.failures[path] -= 1
+                raise UnexpectedExit(Result(stderr='connection reset', exited=12))
+
+            return Result(stdout=f'checksum-{path.split("/")[-1]}  {path}')
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def test_command(self):
+        transfer = self.engine.transfers[0]
+        self.assertEqual(
+            'rsync -avP --sparse --block-size=4096 --whole-file /mnt/sp1/path1 rsync://10.0.0.2/tp1',
+            self.engine.command(transfer))
+
+        self.engine.resume = True
+        self.engine.checksum = True
+        self.assertEqual(
+            'rsync -avP --sparse --block-size=4096 --partial-dir=.rsync-partial --checksum /mnt/sp1/path1 '
+            'rsync://10.0.0.2/tp1',
+            self.engine.command(transfer))
+
+    def test_run(self):
+        self.assertTrue(self.engine.run())
+
+        self.assertEqual(2, self.max_running)
+        self.assertEqual({SUCCEEDED}, {t.state for t in self.engine.transfers})
+        self.assertEqual(3, self.source_host.execute.call_count)
+        self.target_host.execute.assert_not_called()
+
+        self.assertEqual(['volume.rsync'] * 3, [e.operation for e in self.events])
+        event = next(e for e in self.events if e.object_id == 'v2')
+        self.assertEqual(2048, event.fields['bytes_transferred'])
+        self.assertEqual(('source_pool', 'target_pool'), (event.fields['source_pool'], event.fields['target_pool']))
+
+    def test_resume(self):
+        self.failures['/mnt/sp1/path1'] = 2
+        self.failures['/mnt/sp1/path2'] = 3
+
+        self.assertFalse(self.engine.run())
+
+        self.assertEqual([SUCCEEDED, FAILED, SUCCEEDED], [t.state for t in self.engine.transfers])
+        self.assertEqual([3, 3, 1], [t.attempts for t in self.engine.transfers])
+        self.assertEqual({'v1': ('success', 2), 'v2': ('failure', 2), 'v3': ('success', 0)},
+                         {e.object_id: (e.outcome, e.retries) for e in self.events})
+
+    def test_verify(self):
+        self.engine.verify = True
+        self.assertTrue(self.engine.run())
+        self.target_host.execute.assert_any_call('md5sum /mnt/tp1/staging/path1', sudo=True)
+
+        self.target_host.execute.side_effect = lambda command, **_: Result(stdout=f'corrupted  {command.split()[-1]}')
+        self.assertFalse(self.engine.run())
+        self.assertEqual({FAILED}, {t.state for t in self.engine.transfers})
+
+        self.target_host.execute.side_effect = UnexpectedExit(Result(stderr='No such file', exited=1))
+        self.assertFalse(self.engine.run())
+
+    @patch('cosmicops.objects.host.CosmicHost._run')
+    def test_dry_run(self, mock_run):
+        self.ops.dry_run = True
+        for host in (self.source_host, self.target_host):
+            host.dry_run = True
+            del host.execute
+
+        self.engine.verify = True
+        self.assertTrue(self.engine.run())
+
+        mock_run.assert_not_called()
+        self.assertEqual({True}, {e.fields['dry_run'] for e in self.events})
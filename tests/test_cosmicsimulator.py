@@ -0,0 +1,195 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from cs import CloudStack, CloudStackApiException
+from cs.client import transform
+
+from cosmicops import CosmicOps
+from cosmicops.simulator import CosmicSimulator, create_server, generate_inventory, MiB
+
+
+class TestCosmicSimulator(TestCase):
+    def setUp(self):
+        slack_patcher = patch('slack_webhook.Slack')
+        slack_patcher.start()
+        self.addCleanup(slack_patcher.stop)
+
+        self.inventory = generate_inventory(zones=1, pods=1, clusters=2, hosts=3, vms=4, routers=1, seed=1)
+        self.simulator = CosmicSimulator(self.inventory, key='test_key', secret='test_secret', time_scale=0.)
+        self.signer = CloudStack('http://localhost', 'test_key', 'test_secret')
+
+    def _request(self, command, **kwargs):
+        (_, params) = self.signer._prepare_request(command, **kwargs)
+        transform(params)
+        self.signer._sign(params)
+
+        return self.simulator.handle(params)
+
+    def test_generate_inventory(self):
+        self.assertEqual(2, len(self.inventory['clusters']))
+        self.assertEqual(6, len(self.inventory['hosts']))
+        self.assertEqual(24, len(self.inventory['virtualmachines']))
+        self.assertEqual(6, len(self.inventory['routers']))
+        self.assertEqual(2, len(self.inventory['systemvms']))
+        self.assertEqual(4, len(self.inventory['storagepools']))
+        self.assertEqual(generate_inventory(seed=1)['hosts'][0]['id'],
+                         generate_inventory(seed=1)['hosts'][0]['id'])
+
+        host = self.inventory['hosts'][0]
+        host_vms = [vm for vm in self.inventory['virtualmachines'] if vm['hostid'] == host['id']]
+        self.assertLessEqual(sum(vm['memory'] for vm in host_vms) * MiB, host['memoryallocated'])
+
+    def test_signature(self):
+        (status, response) = self._request('listZones')
+        self.assertEqual(200, status)
+        self.assertEqual('zone0', response['listzonesresponse']['zone'][0]['name'])
+
+        (_, params) = self.signer._prepare_request('listZones')
+        params['signature'] = 'invalid'
+        (status, response) = self.simulator.handle(params)
+        self.assertEqual(401, status)
+        self.assertIn('errortext', response['listzonesresponse'])
+
+    def test_list_filters(self):
+        host = self.inventory['hosts'][0]
+
+        (_, response) = self._request('listVirtualMachines', hostid=host['id'], listall='true')
+        vms = response['listvirtualmachinesresponse'].get('virtualmachine', [])
+        self.assertTrue(all(vm['hostid'] == host['id'] and 'projectid' not in vm for vm in vms))
+
+        (_, response) = self._request('listVirtualMachines', projectid='-1', listall='true')
+        project_vms = response['listvirtualmachinesresponse'].get('virtualmachine', [])
+        self.assertTrue(all('projectid' in vm for vm in project_vms))
+        self.assertEqual(24, len(vms) + len(project_vms) + sum(
+            1 for vm in self.inventory['virtualmachines'] if vm['hostid'] != host['id'] and 'projectid' not in vm))
+
+        (_, response) = self._request('listVirtualMachines', keyword='i-3-VM', listall='true')
+        self.assertIn(response['listvirtualmachinesresponse'].get('count', 0), (0, 1))
+
+        (_, response) = self._request('listServiceOfferings', issystem=True)
+        self.assertEqual(1, response['listserviceofferingsresponse']['count'])
+
+        (_, response) = self._request('listHosts', id='unknown')
+        self.assertEqual({}, response['listhostsresponse'])
+
+    def test_list_pagination(self):
+        (_, response) = self._request('listHosts', page=2, pagesize=4)
+        self.assertEqual(6, response['listhostsresponse']['count'])
+        self.assertEqual(2, len(response['listhostsresponse']['host']))
+
+    def test_unknown_command(self):
+        (status, response) = self._request('deployVirtualMachine')
+        self.assertEqual(432, status)
+
+    def test_migrate_virtual_machine(self):
+        vm = self.inventory['virtualmachines'][0]
+        source_host = self.simulator._index['hosts'][vm['hostid']]
+        source_memory = source_host['memoryallocated']
+
+        (_, response) = self._request('findHostsForMigration', virtualmachineid=vm['id'])
+        hosts = response['findhostsformigrationresponse']['host']
+        target_host = next(h for h in hosts if not h['requiresStorageMotion'])
+        self.assertTrue(target_host['suitableformigration'])
+
+        (_, response) = self._request('listVirtualMachines', hostid=target_host['id'], listall='true')
+        self.assertNotIn(vm, response['listvirtualmachinesresponse'].get('virtualmachine', []))
+
+        (_, response) = self._request('migrateVirtualMachine', virtualmachineid=vm['id'], hostid=target_host['id'])
+        job_id = response['migratevirtualmachineresponse']['jobid']
+
+        (_, response) = self._request('queryAsyncJobResult', jobid=job_id)
+        job = response['queryasyncjobresultresponse']
+        self.assertEqual(1, job['jobstatus'])
+        self.assertEqual(target_host['id'], job['jobresult']['virtualmachine']['hostid'])
+        self.assertEqual(source_memory - vm['memory'] * MiB, source_host['memoryallocated'])
+
+        (_, response) = self._request('listVirtualMachines', hostid=target_host['id'], listall='true')
+        self.assertIn(vm, response['listvirtualmachinesresponse']['virtualmachine'])
+
+        (status, _) = self._request('migrateVirtualMachine', virtualmachineid=vm['id'], hostid=target_host['id'])
+        self.assertEqual(431, status)
+
+    def test_failure_injection(self):
+        self.simulator.failure_rate = 1.
+        volume = self.inventory['volumes'][0]
+        target_pool = next(p for p in self.inventory['storagepools'] if p['id'] != volume['storageid'])
+
+        (_, response) = self._request('migrateVolume', volumeid=volume['id'], storageid=target_pool['id'])
+        (_, response) = self._request('queryAsyncJobResult', jobid=response['migratevolumeresponse']['jobid'])
+
+        self.assertEqual(2, response['queryasyncjobresultresponse']['jobstatus'])
+        self.assertEqual('Ready', volume['state'])
+        self.assertNotEqual(target_pool['id'], volume['storageid'])
+
+    def test_job_duration(self):
+        self.simulator.time_scale = 1.
+        vm = self.inventory['virtualmachines'][0]
+
+        (_, response) = self._request('stopVirtualMachine', id=vm['id'])
+        (_, response) = self._request('queryAsyncJobResult', jobid=response['stopvirtualmachineresponse']['jobid'])
+
+        self.assertEqual(0, response['queryasyncjobresultresponse']['jobstatus'])
+        self.assertEqual('Running', vm['state'])
+
+    def test_job_completion_order(self):
+        self.simulator.time_scale = 1.
+        now = [0.]
+        self.simulator.clock = lambda: now[0]
+        router = self.inventory['routers'][0]
+        vm = self.inventory['virtualmachines'][0]
+
+        (_, response) = self._request('rebootRouter', id=router['id'])
+        slow_job = response['rebootrouterresponse']['jobid']
+        now[0] = 1.
+        (_, response) = self._request('stopVirtualMachine', id=vm['id'])
+        fast_job = response['stopvirtualmachineresponse']['jobid']
+
+        # Only jobs which are due are looked at, finished jobs are no longer checked on every request
+        now[0] = self.simulator.jobs[fast_job]['done_at']
+        self._request('listZones')
+        self.assertEqual(1, self.simulator.jobs[fast_job]['jobstatus'])
+        self.assertEqual(0, self.simulator.jobs[slow_job]['jobstatus'])
+        self.assertEqual(1, len(self.simulator._pending_jobs))
+
+        now[0] = self.simulator.jobs[slow_job]['done_at']
+        self._request('listZones')
+        self.assertEqual(1, self.simulator.jobs[slow_job]['jobstatus'])
+        self.assertEqual([], self.simulator._pending_jobs)
+
+    def test_with_cosmicops(self):
+        server = create_server(self.simulator, port=0)
+        self.addCleanup(server.server_close)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+
+        co = CosmicOps(endpoint=f"http://127.0.0.1:{server.server_address[1]}/client/api", key='test_key',
+                       secret='test_secret', dry_run=False)
+
+        cluster = co.get_cluster(name='cluster0-0-0')
+        host = cluster.get_all_hosts()[0]
+
+        with patch('time.sleep'):
+            self.assertTrue(host.disable())
+            (total, success, failed) = host.empty()
+
+        self.assertEqual((total, 0), (success, failed))
+        self.assertEqual([], host.get_all_vms())
+        self.assertEqual('Disabled', co.get_host(id=host['id'])['resourcestate'])
+
+        with self.assertRaises(CloudStackApiException):
+            co.cs.migrateVirtualMachine(virtualmachineid='unknown', hostid=host['id'])
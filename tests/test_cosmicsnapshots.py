@@ -0,0 +1,115 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest.mock import Mock, call, patch
+
+from cs import CloudStackException
+
+from cosmicops import CosmicOps, SnapshotIndex
+from cosmicops.objects import CosmicVM, CosmicVolume
+
+
+class TestSnapshotIndex(TestCase):
+    def setUp(self):
+        cs_patcher = patch('cs.CloudStack')
+        self.mock_cs = cs_patcher.start()
+        self.addCleanup(cs_patcher.stop)
+        self.cs_instance = self.mock_cs.return_value
+
+        self.ops = CosmicOps(endpoint='https://localhost', key='key', secret='secret')
+        self.vm = CosmicVM(self.ops, {'id': 'vm1', 'name': 'vm1'})
+        self.volume = CosmicVolume(self.ops, {'id': 'v1', 'name': 'volume1'})
+
+        self.cs_instance.listVMSnapshot.side_effect = lambda **kwargs: [
+            {'id': 'vs2', 'name': 'project_vm_snapshot', 'virtualmachineid': 'vm2'}
+        ] if 'projectid' in kwargs else [
+            {'id': 'vs1', 'name': 'vm_snapshot1', 'virtualmachineid': 'vm1'},
+            {'id': 'vs3', 'name': 'vm_snapshot2', 'virtualmachineid': 'vm1'}
+        ]
+        self.cs_instance.listSnapshots.side_effect = lambda **kwargs: [
+            {'id': 's2', 'name': 'project_snapshot', 'volumeid': 'v2'}
+        ] if 'projectid' in kwargs else [
+            {'id': 's1', 'name': 'snapshot', 'volumeid': 'v1'}
+        ]
+
+    def test_load(self):
+        snapshots = SnapshotIndex(self.ops, zoneid='z1')
+        self.assertTrue(snapshots.load())
+
+        self.cs_instance.listVMSnapshot.assert_has_calls([
+            call(fetch_list=True, listall='true'),
+            call(fetch_list=True, listall='true', projectid=-1)
+        ])
+        self.cs_instance.listSnapshots.assert_has_calls([
+            call(fetch_list=True, listall='true', zoneid='z1'),
+            call(fetch_list=True, listall='true', projectid=-1, zoneid='z1')
+        ])
+
+        self.assertEqual(['vs1', 'vs3'], [s['id'] for s in snapshots.get_vm_snapshots(self.vm)])
+        self.assertEqual(['vs2'], [s['id'] for s in snapshots.get_vm_snapshots(CosmicVM(self.ops, {'id': 'vm2'}))])
+        self.assertEqual(['s1'], [s['id'] for s in snapshots.get_volume_snapshots(self.volume)])
+        self.assertEqual([], snapshots.get_volume_snapshots(CosmicVolume(self.ops, {'id': 'v3'})))
+
+        # Nothing is listed per volume anymore, and VMs with snapshots in the index aren't checked again
+        self.assertEqual(2, self.cs_instance.listVMSnapshot.call_count)
+        self.assertEqual(2, self.cs_instance.listSnapshots.call_count)
+
+    def test_domain(self):
+        SnapshotIndex(self.ops, domainid='d1').load()
+
+        self.cs_instance.listVMSnapshot.assert_called_with(fetch_list=True, listall='true', projectid=-1,
+                                                           domainid='d1')
+        self.cs_instance.listSnapshots.assert_called_with(fetch_list=True, listall='true', projectid=-1,
+                                                          domainid='d1')
+
+    def test_not_loaded(self):
+        snapshots = SnapshotIndex(self.ops)
+        self.vm.get_snapshots = Mock(return_value=[{'id': 'vs1'}])
+        self.volume.get_snapshots = Mock(return_value=[])
+
+        self.assertEqual([{'id': 'vs1'}], snapshots.get_vm_snapshots(self.vm))
+        self.assertEqual([], snapshots.get_volume_snapshots(self.volume))
+        self.vm.get_snapshots.assert_called_once()
+        self.volume.get_snapshots.assert_called_once()
+
+    def test_load_failure(self):
+        self.cs_instance.listSnapshots.side_effect = CloudStackException(response=Mock())
+        snapshots = SnapshotIndex(self.ops)
+        self.vm.get_snapshots = Mock(return_value=[])
+
+        self.assertFalse(snapshots.load())
+        self.assertFalse(snapshots.loaded)
+        self.assertEqual([], snapshots.get_vm_snapshots(self.vm))
+        self.vm.get_snapshots.assert_called_once()
+
+    def test_batch(self):
+        snapshots = SnapshotIndex(self.ops)
+        snapshots.load()
+
+        # A VM snapshot made while the batch runs is found by checking the VM again before it's migrated
+        self.cs_instance.listVMSnapshot.side_effect = lambda **kwargs: [
+            {'id': 'vs4', 'name': 'new_vm_snapshot', 'virtualmachineid': 'vm3'}
+        ] if kwargs.get('virtualmachineid') == 'vm3' else []
+        for vm_id in ('vm3', 'vm4', 'vm5'):
+            vm = CosmicVM(self.ops, {'id': vm_id})
+            self.assertEqual(['vs4'] if vm_id == 'vm3' else [], [s['id'] for s in snapshots.get_vm_snapshots(vm)])
+            snapshots.get_volume_snapshots(CosmicVolume(self.ops, {'id': f'v-{vm_id}'}))
+
+        # The snapshots of the whole batch are listed once, only the VMs are checked again
+        self.assertEqual(2, len([c for c in self.cs_instance.listVMSnapshot.call_args_list
+                                 if 'virtualmachineid' not in c.kwargs]))
+        self.assertEqual(3, len([c for c in self.cs_instance.listVMSnapshot.call_args_list
+                                 if 'virtualmachineid' in c.kwargs]))
+        self.assertEqual(2, self.cs_instance.listSnapshots.call_count)
@@ -129,6 +129,27 @@ class TestCosmicSQL(TestCase):
 
         self.assertFalse(self.cs.kill_jobs_of_instance('i-1-VM'))
 
+    def test_update_storage_pool_ids(self):
+        self.assertTrue(self.cs.update_storage_pool_ids([(1, 10, 20), (2, 11, 20)]))
+
+        self.mock_cursor.executemany.assert_called_once_with('UPDATE volumes SET pool_id=%s, last_pool_id=%s WHERE id=%s',
+                                                             [(20, 10, 1), (20, 11, 2)])
+        self.mock_connect.return_value.commit.assert_called_once()
+
+    def test_update_storage_pool_ids_dry_run(self):
+        self.cs = CosmicSQL(server='localhost', password='password', dry_run=True)
+
+        self.assertTrue(self.cs.update_storage_pool_ids([(1, 10, 20)]))
+        self.mock_cursor.executemany.assert_called_once()
+        self.mock_connect.return_value.commit.assert_not_called()
+
+    def test_update_storage_pool_ids_failure(self):
+        self.mock_cursor.executemany.side_effect = pymysql.Error('Mock query error')
+
+        self.assertFalse(self.cs.update_storage_pool_ids([(1, 10, 20), (2, 11, 20)]))
+        self.mock_connect.return_value.rollback.assert_called_once()
+        self.mock_connect.return_value.commit.assert_not_called()
+
     def test_list_ha_workers(self):
         self.assertIsNotNone(self.cs.list_ha_workers())
 
@@ -227,3 +248,69 @@ class TestCosmicSQL(TestCase):
         self.assertTrue(self.cs.add_vm_to_affinity_group('instance_name', 'affinity_group_name'))
         self.assertIn("(instance_id, affinity_group_id)", self.mock_cursor.execute.call_args[0][0])
         self.assertEqual(('instance_id', 'affinity_group_id'), self.mock_cursor.execute.call_args[0][1])
+
+    def test_get_id_from_name_is_cached(self):
+        self.mock_cursor.fetchall.return_value = ((1,),)
+
+        self.assertEqual(1, self.cs.get_instance_id_from_name('instance'))
+        self.assertEqual(1, self.cs.get_instance_id_from_name('instance'))
+        self.mock_cursor.execute.assert_called_once()
+
+        self.cs.invalidate_id_cache('instance')
+        self.assertEqual(1, self.cs.get_instance_id_from_name('instance'))
+        self.assertEqual(2, self.mock_cursor.execute.call_count)
+
+    def test_prefetch_offering_ids(self):
+        self.mock_cursor.fetchall.side_effect = [
+            (('service_offering', 10), ('service_offering', 11)),
+            (('disk_offering', 20),)
+        ]
+
+        self.cs.prefetch_offering_ids()
+        self.assertEqual(2, self.mock_cursor.execute.call_count)
+
+        self.assertEqual(10, self.cs.get_service_offering_id_from_name('service_offering'))
+        self.assertEqual(20, self.cs.get_disk_offering_id_from_name('disk_offering'))
+        self.assertEqual(2, self.mock_cursor.execute.call_count)
+
+        self.cs.invalidate_id_cache()
+        self.mock_cursor.fetchall.side_effect = None
+        self.mock_cursor.fetchall.return_value = ((21,),)
+        self.assertEqual(21, self.cs.get_disk_offering_id_from_name('disk_offering'))
+
+    def test_prefetch_instance_ids(self):
+        self.mock_cursor.fetchall.return_value = (('i-1-VM', 1), ('i-2-VM', 2))
+
+        self.cs.prefetch_instance_ids(['i-1-VM', 'i-2-VM'])
+        self.assertIn("instance_name IN ('i-1-VM', 'i-2-VM')", self.mock_cursor.execute.call_args[0][0])
+        self.assertEqual(2, self.cs.get_instance_id_from_name('i-2-VM'))
+        self.mock_cursor.execute.assert_called_once()
+
+        self.cs.prefetch_instance_ids([])
+        self.mock_cursor.execute.assert_called_once()
+
+    def test_get_inventory_hosts(self):
+        self.assertIsNotNone(self.cs.get_inventory_hosts(cluster_name='cluster1', pod_name='pod1', zone_name='zone1'))
+
+        query = self.mock_cursor.execute.call_args[0][0]
+        self.assertIn("cluster.name = 'cluster1'", query)
+        self.assertIn("host_pod_ref.name = 'pod1'", query)
+        self.assertIn("data_center.name = 'zone1'", query)
+
+    def test_get_inventory_vms(self):
+        self.assertIsNotNone(self.cs.get_inventory_vms(domain_name='domain1', keyword_filter='keyword'))
+
+        query = self.mock_cursor.execute.call_args[0][0]
+        self.assertIn("domain.name = 'domain1' AND projects.id IS NULL", query)
+        self.assertIn("vm.name LIKE '%keyword%'", query)
+        self.assertNotIn('cluster.name =', query)
+
+        self.cs.get_inventory_vms(only_project=True)
+        self.assertIn('projects.id IS NOT NULL', self.mock_cursor.execute.call_args[0][0])
+
+    def test_get_inventory_routers(self):
+        self.assertIsNotNone(self.cs.get_inventory_routers(project_name='project1'))
+
+        query = self.mock_cursor.execute.call_args[0][0]
+        self.assertIn("projects.name = 'project1'", query)
+        self.assertIn("vm.type = 'DomainRouter'", query)
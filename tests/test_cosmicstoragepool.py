@@ -17,11 +17,12 @@ from unittest.mock import patch, Mock
 
 from cosmicops import CosmicOps
 from cosmicops.objects import CosmicStoragePool
+from cosmicops.objects.storagepool import FileInfo
 
 
 class TestCosmicStoragePool(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
@@ -61,10 +62,61 @@ class TestCosmicStoragePool(TestCase):
         self.assertFalse(self.storage_pool.get_orphaned_volumes())
 
     def test_get_file_list(self):
+        def execute(command, **kwargs):
+            if 'out_stream' in kwargs:
+                kwargs['out_stream'].write('1073741824\t2048\t1.5\t/mount/storage_pool_path/orphan_path\n2\t')
+                kwargs['out_stream'].write('8\t2.5\t/mount/storage_pool_path/something_else.qcow2\nunexpected line\n')
+                kwargs['out_stream'].write('3\t0\t3.5\t/mount/storage_pool_path/no_newline')
+
+            return Mock(stdout='/ip_address:/path /mount/storage_pool_path nfs4 list_of_options 0 0\n')
+
         host_mock = Mock()
-        host_mock.execute.side_effect = [
-            Mock(stdout='/ip_address:/path /mount/storage_pool_path nfs4 list_of_options 0 0\n'),
-            Mock(stdout='1\t/mount/storage_pool_path/orphan_path\n2\t/mount/storage_pool_path/something_else\n')
-        ]
+        host_mock.execute.side_effect = execute
+
+        self.assertDictEqual({
+            'orphan_path': FileInfo(1073741824, 1048576, 1.5, '/mount/storage_pool_path/orphan_path'),
+            'something_else': FileInfo(2, 4096, 2.5, '/mount/storage_pool_path/something_else.qcow2'),
+            'no_newline': FileInfo(3, 0, 3.5, '/mount/storage_pool_path/no_newline')
+        }, self.storage_pool.get_file_list(host_mock))
+        self.assertIn("find -H /mount/storage_pool_path -type f -printf '%s\\t%b\\t%T@\\t%p\\n'",
+                      host_mock.execute.call_args[0][0])
+
+    def test_get_file_list_without_mount(self):
+        host_mock = Mock()
+        host_mock.execute.return_value = Mock(stdout='')
+
+        self.assertDictEqual({}, self.storage_pool.get_file_list(host_mock))
+        self.assertDictEqual({}, self.storage_pool.get_incremental_file_list(host_mock, Mock()))
+        self.assertEqual(2, host_mock.execute.call_count)
+
+    def test_get_incremental_file_list(self):
+        unchanged_file = FileInfo(1, 512, 1.0, '/mount/pool/unchanged/volume1')
+        removed_file = FileInfo(2, 512, 1.0, '/mount/pool/removed/volume2')
+        stale_file = FileInfo(3, 512, 1.0, '/mount/pool/volume3')
+
+        manifest = Mock()
+        manifest.get_directories.return_value = {'/mount/pool': 1.0, '/mount/pool/unchanged': 2.0,
+                                                 '/mount/pool/removed': 3.0}
+        manifest.get_files.return_value = [unchanged_file, removed_file, stale_file]
+
+        def execute(command, **kwargs):
+            if 'out_stream' in kwargs:
+                kwargs['out_stream'].write('4\t8\t5.0\t/mount/pool/volume4\n')
+                return Mock()
+            elif command.startswith('cat /proc/mounts'):
+                return Mock(stdout='/ip_address:/path /mount/pool nfs4 list_of_options 0 0\n')
+
+            return Mock(stdout='5.0\t/mount/pool\n2.0\t/mount/pool/unchanged\ninvalid\n')
+
+        host_mock = Mock()
+        host_mock.execute.side_effect = execute
+
+        self.assertDictEqual({
+            'volume1': unchanged_file,
+            'volume4': FileInfo(4, 4096, 5.0, '/mount/pool/volume4')
+        }, self.storage_pool.get_incremental_file_list(host_mock, manifest))
 
-        self.assertDictEqual({'orphan_path': '1', 'something_else': '2'}, self.storage_pool.get_file_list(host_mock))
+        manifest.get_directories.assert_called_with('p1')
+        self.assertIn("find -H /mount/pool -maxdepth 1 -type f", host_mock.execute.call_args[0][0])
+        manifest.update.assert_called_with('p1', {'/mount/pool': 5.0, '/mount/pool/unchanged': 2.0},
+                                           [unchanged_file, FileInfo(4, 4096, 5.0, '/mount/pool/volume4')])
@@ -21,12 +21,12 @@ from cosmicops.objects import CosmicSystemVM, CosmicHost
 
 class TestCosmicSystemVM(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
 
-        slack_patcher = patch('cosmicops.log.Slack')
+        slack_patcher = patch('slack_webhook.Slack')
         self.mock_slack = slack_patcher.start()
         self.addCleanup(slack_patcher.stop)
 
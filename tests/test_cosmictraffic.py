@@ -0,0 +1,159 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import pymysql
+from cs import CloudStackApiException
+from invoke import UnexpectedExit, Result
+from testfixtures import tempdir
+
+from cosmicops import CosmicOps, CosmicSQL
+from cosmicops.objects import CosmicHost
+from cosmicops.traffic import CosmicTraffic, SCRUBBED
+
+
+class TestCosmicTraffic(TestCase):
+    def setUp(self):
+        self.traffic = CosmicTraffic()
+        for module in ['cosmicops.ops', 'cosmicops.sql', 'cosmicops.objects.host']:
+            traffic_patcher = patch(f'{module}.traffic', self.traffic)
+            traffic_patcher.start()
+            self.addCleanup(traffic_patcher.stop)
+
+        atexit_patcher = patch('cosmicops.traffic.atexit')
+        self.mock_atexit = atexit_patcher.start()
+        self.addCleanup(atexit_patcher.stop)
+
+        cs_patcher = patch('cs.CloudStack')
+        self.mock_cs = cs_patcher.start()
+        self.addCleanup(cs_patcher.stop)
+        self.cs_instance = self.mock_cs.return_value
+
+        pymysql_connect_patcher = patch('pymysql.connect')
+        self.mock_connect = pymysql_connect_patcher.start()
+        self.addCleanup(pymysql_connect_patcher.stop)
+        self.mock_cursor = self.mock_connect.return_value.cursor.return_value
+
+        connection_patcher = patch('fabric.Connection')
+        self.mock_connection = connection_patcher.start()
+        self.addCleanup(connection_patcher.stop)
+        self.connection_instance = self.mock_connection.return_value
+
+        ilo_patcher = patch('hpilo.Ilo')
+        ilo_patcher.start()
+        self.addCleanup(ilo_patcher.stop)
+
+        sleep_patcher = patch('cosmicops.traffic.time.sleep', return_value=None)
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def _record(self, path):
+        self.traffic.record(path)
+        self.mock_atexit.register.assert_called_with(self.traffic.save)
+
+        self.cs_instance.listZones.return_value = [{'id': 'z1', 'name': 'zone1'}]
+        self.cs_instance.listUsers.return_value = [{'id': 'u1', 'apikey': 'user_api_key'}]
+        self.cs_instance.listHosts.side_effect = CloudStackApiException('test error', error={}, response=Mock())
+        self.cs_instance.queryAsyncJobResult.side_effect = [{'jobstatus': 0}, {'jobstatus': 1}]
+        self.mock_cursor.fetchall.return_value = ((1, 'pool1'),)
+        self.connection_instance.run.return_value = Mock(stdout='output test_api_key', stderr='', return_code=0)
+        self.connection_instance.sudo.side_effect = UnexpectedExit(
+            Result(stdout='', stderr='failed', command='false', exited=1))
+
+        ops = CosmicOps(endpoint='https://localhost', key='test_api_key', secret='test_secret_key', dry_run=False)
+        self.assertEqual('zone1', ops.get_zone(name='zone1')['name'])
+        ops.cs.listUsers(fetch_list=True, apikey='test_api_key')
+        self.assertRaises(CloudStackApiException, ops.cs.listHosts, fetch_list=True)
+        ops.cs.queryAsyncJobResult(jobid='j1')
+        ops.cs.queryAsyncJobResult(jobid='j1')
+
+        sql = CosmicSQL(server='localhost', password='test_sql_password', dry_run=False)
+        self.assertEqual(((1, 'pool1'),), sql._execute_select_query('SELECT id, name\n  FROM storage_pool'))
+        self.assertTrue(sql._execute_update_query('UPDATE volumes SET state=%s', ('Ready',)))
+
+        host = CosmicHost(ops, {'id': 'h1', 'name': 'host1'})
+        self.assertEqual('output test_api_key', host.execute('hostname').stdout)
+        self.assertRaises(UnexpectedExit, host.execute, 'false', sudo=True)
+
+        self.traffic.save()
+        self.traffic.disable()
+
+    @tempdir()
+    def test_record(self, tmp):
+        path = f"{tmp.path}/traffic.json.gz"
+        self._record(path)
+
+        with gzip.open(path, 'rt') as f:
+            archive = f.read()
+
+        self.assertNotIn('test_api_key', archive)
+        self.assertNotIn('test_secret_key', archive)
+        self.assertNotIn('user_api_key', archive)
+        self.assertIn(SCRUBBED, archive)
+
+    @tempdir()
+    def test_replay(self, tmp):
+        path = f"{tmp.path}/traffic.json.gz"
+        self._record(path)
+
+        self.mock_cs.reset_mock()
+        self.mock_connect.reset_mock()
+        self.connection_instance.reset_mock()
+
+        self.traffic.replay(path, latency={'api': 0.1}, time_scale=0.)
+
+        ops = CosmicOps(endpoint='https://localhost', key='test_api_key', secret='test_secret_key', dry_run=False)
+        self.assertEqual('zone1', ops.get_zone(name='zone1')['name'])
+        self.assertEqual(SCRUBBED, ops.cs.listUsers(fetch_list=True, apikey='test_api_key')[0]['apikey'])
+        self.assertRaises(CloudStackApiException, ops.cs.listHosts, fetch_list=True)
+        self.assertEqual([0, 1, 1], [ops.cs.queryAsyncJobResult(jobid='j1')['jobstatus'] for _ in range(3)])
+        self.assertRaises(RuntimeError, ops.cs.listVirtualMachines, fetch_list=True)
+        self.cs_instance.listZones.assert_not_called()
+        self.mock_sleep.assert_called_with(0.1)
+
+        sql = CosmicSQL(server='localhost', password='test_sql_password', dry_run=False)
+        self.assertEqual(((1, 'pool1'),), sql._execute_select_query('SELECT id, name FROM storage_pool'))
+        self.assertTrue(sql._execute_update_query('UPDATE volumes SET state=%s', ('Ready',)))
+        self.mock_connect.assert_not_called()
+
+        out_stream = Mock()
+        host = CosmicHost(ops, {'id': 'h1', 'name': 'host1'})
+        self.assertEqual(f'output {SCRUBBED}', host.execute('hostname', out_stream=out_stream).stdout)
+        out_stream.write.assert_called_with(f'output {SCRUBBED}')
+        with self.assertRaises(UnexpectedExit) as e:
+            host.execute('false', sudo=True)
+        self.assertEqual(1, e.exception.result.exited)
+        self.connection_instance.run.assert_not_called()
+
+    @tempdir()
+    def test_replay_unsupported_version(self, tmp):
+        path = f"{tmp.path}/traffic.json.gz"
+        with gzip.open(path, 'wt') as f:
+            f.write('{"version": 0}')
+
+        self.assertRaises(RuntimeError, self.traffic.replay, path)
+        self.assertIsNone(self.traffic.mode)
+
+    def test_sql_error(self):
+        self.traffic.record('unused')
+        self.mock_cursor.execute.side_effect = pymysql.Error('test error')
+
+        sql = CosmicSQL(server='localhost', password='test_sql_password', dry_run=False)
+        self.assertRaises(pymysql.Error, sql._execute_select_query, 'SELECT 1')
+
+        self.traffic.mode = 'replay'
+        self.assertRaises(pymysql.Error, sql._execute_select_query, 'SELECT 1')
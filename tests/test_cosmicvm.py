@@ -23,12 +23,12 @@ from cosmicops.objects import CosmicVM, CosmicHost
 
 class TestCosmicVM(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
 
-        slack_patcher = patch('cosmicops.log.Slack')
+        slack_patcher = patch('slack_webhook.Slack')
         self.mock_slack = slack_patcher.start()
         self.addCleanup(slack_patcher.stop)
 
@@ -124,6 +124,12 @@ class TestCosmicVM(TestCase):
         self.cs_instance.migrateVirtualMachineWithVolume.assert_called_with(virtualmachineid=self.vm['id'],
                                                                             hostid=self.target_host['id'])
 
+        volume_pools = [({'id': 'v1'}, {'id': 'p1'}), ({'id': 'v2'}, {'id': 'p1'})]
+        self.assertTrue(self.vm.migrate(self.target_host, with_volume=True, volume_pools=volume_pools))
+        self.cs_instance.migrateVirtualMachineWithVolume.assert_called_with(
+            virtualmachineid=self.vm['id'], hostid=self.target_host['id'],
+            migrateto=[{'volume': 'v1', 'pool': 'p1'}, {'volume': 'v2', 'pool': 'p1'}])
+
     def test_migrate_with_migrate_virtual_machine_failure(self):
         self.cs_instance.migrateVirtualMachine.return_value = None
         self.assertFalse(self.vm.migrate(self.target_host))
@@ -21,7 +21,7 @@ from cosmicops.objects import CosmicVolume, CosmicStoragePool
 
 class TestCosmicVolume(TestCase):
     def setUp(self):
-        cs_patcher = patch('cosmicops.ops.CloudStack')
+        cs_patcher = patch('cs.CloudStack')
         self.mock_cs = cs_patcher.start()
         self.addCleanup(cs_patcher.stop)
         self.cs_instance = self.mock_cs.return_value
@@ -50,11 +50,20 @@ class TestCosmicVolume(TestCase):
 
     def test_migrate(self):
         self.volume.refresh = Mock()
-        self.assertTrue(self.volume.migrate(self.storage_pool))
+        events = []
+        with patch('cosmicops.log.logging.event_listeners', [events.append]):
+            self.assertTrue(self.volume.migrate(self.storage_pool))
+            self.ops.wait_for_volume_migration_job.return_value = False
+            self.assertFalse(self.volume.migrate(self.storage_pool))
+
         self.cs_instance.migrateVolume.assert_called_with(volumeid=self.volume['id'], storageid=self.storage_pool['id'],
                                                           livemigrate=False)
-        self.ops.wait_for_volume_migration_job.return_value = False
-        self.assertFalse(self.volume.migrate(self.storage_pool))
+        self.ops.wait_for_volume_migration_job.assert_called_with(volume_id='vol1', job_id=1, event=events[1])
+
+        # The bytes of the job are recorded on the migration event, with the same operation as the tracker uses
+        self.assertEqual(['volume.migrate'] * 2, [e.operation for e in events])
+        self.assertEqual(['success', 'failure'], [e.outcome for e in events])
+        self.assertEqual('pool1', events[0].fields['target_pool'])
 
     def test_migrate_dry_run(self):
         self.volume._ops.dry_run = True
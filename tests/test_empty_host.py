@@ -28,7 +28,7 @@ class TestEmptyHost(TestCase):
         self.addCleanup(co_patcher.stop)
         self.co_instance = self.co.return_value
 
-        slack_patcher = patch('cosmicops.log.Slack')
+        slack_patcher = patch('slack_webhook.Slack')
         self.mock_slack = slack_patcher.start()
         self.addCleanup(slack_patcher.stop)
 
@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from pathlib import Path
 from unittest import TestCase
 from unittest.mock import Mock, patch
 
 from click.testing import CliRunner
+from testfixtures import tempdir
 
 import list_orphaned_disks
 from cosmicops.objects import CosmicStoragePool, CosmicCluster, CosmicZone
+from cosmicops.objects.storagepool import FileInfo
 
 
 class TestListOrphanedDisks(TestCase):
@@ -41,7 +44,7 @@ class TestListOrphanedDisks(TestCase):
         }]
 
         self.storage_pool = CosmicStoragePool(Mock(), {'name': 'storage_pool1'})
-        self.storage_pool.get_file_list = Mock(return_value={'orphan1_path': '1'})
+        self.storage_pool.get_file_list = Mock(return_value={'orphan1_path': FileInfo(1073741824, 1048576)})
         self.storage_pool.get_orphaned_volumes = Mock(return_value=orphans)
         self.cluster = CosmicCluster(Mock(), {'name': 'cluster1'})
         self.cluster.get_storage_pools = Mock(return_value=[self.storage_pool])
@@ -71,3 +74,40 @@ class TestListOrphanedDisks(TestCase):
         self.co_instance.get_all_clusters.return_value = []
         result = self.runner.invoke(list_orphaned_disks.main, ['--profile', 'profile', 'zone1'])
         self.assertEqual(0, result.exit_code)
+
+    def test_main_with_multiple_storage_pools(self):
+        self._setup_mocks()
+        storage_pool2 = CosmicStoragePool(Mock(), {'name': 'storage_pool2'})
+        storage_pool2.get_file_list = Mock(return_value={})
+        storage_pool2.get_orphaned_volumes = Mock(return_value=[])
+        self.cluster.get_storage_pools.return_value = [self.storage_pool, storage_pool2]
+
+        result = self.runner.invoke(list_orphaned_disks.main,
+                                    ['--profile', 'profile', '--max-workers', '2', '--max-ssh-sessions', '1', 'zone1'])
+
+        self.assertEqual(0, result.exit_code)
+        for storage_pool in [self.storage_pool, storage_pool2]:
+            storage_pool.get_file_list.assert_called_once_with(self.host)
+            storage_pool.get_orphaned_volumes.assert_called_once()
+        self.assertLess(result.output.index('storage_pool1'), result.output.index('storage_pool2'))
+
+    @tempdir()
+    def test_main_incremental(self, tmp):
+        self._setup_mocks()
+        self.storage_pool['id'] = 'p1'
+        self.storage_pool.get_incremental_file_list = Mock(return_value={'orphan1_path': FileInfo(1073741824, 1048576)})
+        manifest_file = str(Path(tmp.path) / 'manifest.db')
+
+        result = self.runner.invoke(list_orphaned_disks.main,
+                                    ['--profile', 'profile', '--incremental', '--manifest-file', manifest_file, 'zone1'])
+        self.assertEqual(0, result.exit_code)
+        self.storage_pool.get_file_list.assert_not_called()
+        self.storage_pool.get_incremental_file_list.assert_called_once()
+        self.assertIn('First run', result.output)
+
+        self.storage_pool.get_orphaned_volumes.return_value = []
+        self.cluster.get_all_hosts.return_value = [self.host]
+        result = self.runner.invoke(list_orphaned_disks.main,
+                                    ['--profile', 'profile', '--incremental', '--manifest-file', manifest_file, 'zone1'])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn('-1 MiB', result.output)
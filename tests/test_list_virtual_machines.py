@@ -322,3 +322,43 @@ class TestListVirtualMachines(TestCase):
 
         self.co_instance.get_network.return_value = None
         self.assertEqual(0, self.runner.invoke(list_virtual_machines.main, ['-p', 'profile']).exit_code)
+
+    @patch('list_virtual_machines.CosmicSQL')
+    def test_source_db(self, mock_sql):
+        sql_instance = mock_sql.return_value
+        sql_instance.get_inventory_hosts.return_value = [('cluster1', 'host1', 25017704448)]
+        sql_instance.get_inventory_vms.return_value = [
+            ('cluster1', 'vm1', 52428800, 'tiny mock vm', 512, 1, 'i-1-VM', 'host1', 'ROOT', 'admin', None,
+             '2020-10-06 09:41:57', '6.9.2-SNAPSHOT'),
+            ('cluster1', 'vm2', 52428800, 'tiny mock vm', 512, 1, 'i-2-VM', 'host1', 'ignored', 'admin', None,
+             '2020-10-06 09:41:57', '6.9.2-SNAPSHOT')
+        ]
+        sql_instance.get_inventory_routers.return_value = [
+            ('cluster1', 'router1', '20.3.30', 4, 1024, 2, 'host1', 'ROOT', 'admin', None, '2020-10-06 09:41:57',
+             '6.9.2-SNAPSHOT', 0, 'UNKNOWN', 1, 'vpc1'),
+            ('cluster1', 'router2', '20.3.30', 2, None, None, 'host1', 'ROOT', 'admin', 'project1',
+             '2020-10-06 09:41:57', '6.9.2-SNAPSHOT', 1, 'MASTER', None, None)
+        ]
+
+        result = self.runner.invoke(list_virtual_machines.main,
+                                    ['-p', 'profile', '--source', 'db', '--ignore-domains', 'ignored', '--zone',
+                                     'zone1', '--router-nic-count', '4', '--nic-count-is-minimum'])
+        self.assertEqual(0, result.exit_code)
+
+        mock_sql.assert_called_with(server='profile', dry_run=False)
+        self.co.assert_not_called()
+        sql_instance.get_inventory_hosts.assert_called_with(None, None, 'zone1')
+        sql_instance.get_inventory_vms.assert_called_with(None, None, 'zone1', None, None, False, None)
+        sql_instance.get_inventory_routers.assert_called_with(None, None, 'zone1', None, None, False)
+
+        sql_instance.reset_mock()
+        self.assertEqual(0, self.runner.invoke(list_virtual_machines.main,
+                                               ['-p', 'profile', '--source', 'db', '--only-routers']).exit_code)
+        sql_instance.get_inventory_vms.assert_not_called()
+
+        self.assertEqual(0, self.runner.invoke(list_virtual_machines.main,
+                                               ['-p', 'profile', '--source', 'db', '--no-routers']).exit_code)
+        sql_instance.get_inventory_routers.assert_called_once()
+
+        self.assertEqual(1, self.runner.invoke(list_virtual_machines.main,
+                                               ['-p', 'profile', '--source', 'db', '--calling-credentials']).exit_code)
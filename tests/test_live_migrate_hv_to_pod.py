@@ -18,7 +18,7 @@ from unittest.mock import patch, Mock
 from click.testing import CliRunner
 
 import live_migrate_hv_to_pod
-from cosmicops.objects import CosmicCluster, CosmicHost, CosmicVM
+from cosmicops.objects import CosmicCluster, CosmicHost, CosmicStoragePool, CosmicVM
 
 
 class TestLiveMigrateHVToPod(TestCase):
@@ -26,23 +26,41 @@ class TestLiveMigrateHVToPod(TestCase):
         co_patcher = patch('live_migrate_hv_to_pod.CosmicOps')
         cs_patcher = patch('live_migrate_hv_to_pod.CosmicSQL')
         lm_patcher = patch('live_migrate_hv_to_pod.live_migrate')
+        snapshots_patcher = patch('live_migrate_hv_to_pod.SnapshotIndex')
         sleep_patcher = patch('time.sleep', return_value=None)
         self.co = co_patcher.start()
         self.cs = cs_patcher.start()
         self.lm = lm_patcher.start()
+        self.snapshots = snapshots_patcher.start()
         sleep_patcher.start()
         self.addCleanup(co_patcher.stop)
         self.addCleanup(cs_patcher.stop)
         self.addCleanup(lm_patcher.stop)
+        self.addCleanup(snapshots_patcher.stop)
         self.addCleanup(sleep_patcher.stop)
         self.co_instance = self.co.return_value
         self.cs_instance = self.cs.return_value
         self.runner = CliRunner()
 
+        self.source_cluster = CosmicCluster(Mock(), {
+            'id': 'sc1',
+            'name': 'source_cluster'
+        })
         self.target_cluster = CosmicCluster(Mock(), {
             'id': 'tc1',
             'name': 'target_cluster'
         })
+        self.destination_host = CosmicHost(Mock(), {
+            'id': 'dh1',
+            'name': 'destination_host'
+        })
+        self.target_pool = CosmicStoragePool(Mock(), {
+            'id': 'tp1',
+            'name': 'target_pool',
+            'state': 'Up',
+            'disksizetotal': 1000,
+            'disksizeused': 0
+        })
         self.vms = [
             CosmicVM(Mock(), {
                 'id': 'vm1',
@@ -66,12 +84,32 @@ class TestLiveMigrateHVToPod(TestCase):
         self.source_host = CosmicHost(Mock(), {
             'id': 'sh1',
             'name': 'source_host',
-            'clusterid': 'sc1'
+            'clusterid': 'sc1',
+            'zoneid': 'z1'
         })
 
         self.co_instance.get_host.return_value = self.source_host
+        self.co_instance.get_cluster.side_effect = lambda **kwargs: \
+            self.source_cluster if 'id' in kwargs else self.target_cluster
+        self.target_cluster.get_capacity_model = Mock()
+        self.target_cluster.get_storage_pools = Mock(return_value=[self.target_pool])
+        self.target_cluster.find_migration_host = Mock(return_value=self.destination_host)
         self.source_host.get_all_vms = Mock(return_value=self.vms)
         self.source_host.get_all_project_vms = Mock(return_value=self.project_vms)
+        for vm in self.vms + self.project_vms:
+            vm.get_volumes = Mock(return_value=[])
+
+    def _assert_migrated(self, dry_run, co=None, cs=None):
+        self.assertEqual(4, self.lm.call_count)
+        for vm in self.vms + self.project_vms:
+            self.target_cluster.find_migration_host.assert_any_call(
+                vm, capacity=self.target_cluster.get_capacity_model.return_value)
+            self.lm.assert_any_call(add_affinity_group=None, cluster='target_cluster', co=co or self.co_instance,
+                                    cs=cs or self.cs_instance, destination_dc=None, dry_run=dry_run, is_project_vm=None,
+                                    log_to_slack=not dry_run, vm_name=vm['name'], zwps_to_cwps=None,
+                                    target_cluster=self.target_cluster, source_host=self.source_host,
+                                    source_cluster=self.source_cluster, destination_host=self.destination_host,
+                                    target_pool=self.target_pool, snapshots=self.snapshots.return_value)
 
     def test_main(self):
         self.assertEqual(0, self.runner.invoke(live_migrate_hv_to_pod.main,
@@ -81,13 +119,25 @@ class TestLiveMigrateHVToPod(TestCase):
         self.cs.assert_called_with(server='profile', dry_run=False)
 
         self.co_instance.get_host.assert_called_with(name='source_host')
+        self.co_instance.get_cluster.assert_any_call(id='sc1')
+        self.co_instance.get_cluster.assert_called_with(name='target_cluster')
+        self.target_cluster.get_capacity_model.assert_called_once()
+        self.target_cluster.get_storage_pools.assert_called_once_with(scope='CLUSTER')
+        self.snapshots.assert_called_once_with(self.co_instance, zoneid='z1')
+        self.snapshots.return_value.load.assert_called_once()
         self.source_host.get_all_vms.assert_called()
         self.source_host.get_all_project_vms.assert_called()
+        self.cs_instance.prefetch_offering_ids.assert_not_called()
 
-        for vm in self.vms + self.project_vms:
-            self.lm.assert_any_call(add_affinity_group=None, cluster='target_cluster', co=self.co_instance,
-                                    cs=self.cs_instance, destination_dc=None, dry_run=False, is_project_vm=None,
-                                    log_to_slack=True, vm_name=vm['name'], zwps_to_cwps=None)
+        self._assert_migrated(dry_run=False)
+
+    def test_main_destination_dc(self):
+        self.assertEqual(0, self.runner.invoke(live_migrate_hv_to_pod.main,
+                                               ['--exec', '-d', 'dc2', '-p', 'profile', 'source_host',
+                                                'target_cluster']).exit_code)
+
+        self.cs_instance.prefetch_offering_ids.assert_called_once()
+        self.assertEqual(4, self.lm.call_count)
 
     def test_main_dry_run(self):
         self.assertEqual(0, self.runner.invoke(live_migrate_hv_to_pod.main,
@@ -100,13 +150,55 @@ class TestLiveMigrateHVToPod(TestCase):
         self.source_host.get_all_vms.assert_called()
         self.source_host.get_all_project_vms.assert_called()
 
-        for vm in self.vms + self.project_vms:
-            self.lm.assert_any_call(add_affinity_group=None, cluster='target_cluster', co=self.co_instance,
-                                    cs=self.cs_instance, destination_dc=None, dry_run=True, is_project_vm=None,
-                                    log_to_slack=False, vm_name=vm['name'], zwps_to_cwps=None)
+        self._assert_migrated(dry_run=True)
+
+    @patch('cosmicops.migration.CosmicSQL')
+    @patch('cosmicops.migration.CosmicOps')
+    def test_main_parallel(self, mock_thread_co, mock_thread_cs):
+        self.co_instance.dry_run = False
+        self.co_instance.log_to_slack = True
+        self.cs_instance.dry_run = False
+
+        self.assertEqual(0, self.runner.invoke(live_migrate_hv_to_pod.main,
+                                               ['--exec', '--parallel', '--max-running', '2', '--max-per-pool', '2',
+                                                '-p', 'profile', 'source_host', 'target_cluster']).exit_code)
+
+        # Concurrent migrations don't share connections, and don't print progress
+        mock_thread_co.assert_called_with(profile='profile', dry_run=False, log_to_slack=True, show_progress=False)
+        mock_thread_cs.assert_called_with(server='profile', dry_run=False)
+        self.assertLessEqual(mock_thread_co.call_count, 2)
+        self._assert_migrated(dry_run=False, co=mock_thread_co.return_value, cs=mock_thread_cs.return_value)
+
+    def test_zero_limits(self):
+        for option in ('--max-running', '--max-per-pool'):
+            self.assertEqual(2, self.runner.invoke(live_migrate_hv_to_pod.main,
+                                                   ['--exec', '--parallel', option, '0', '-p', 'profile',
+                                                    'source_host', 'target_cluster']).exit_code)
+        self.lm.assert_not_called()
+
+    def test_migration_failure(self):
+        self.lm.side_effect = lambda **kwargs: kwargs['vm_name'] != 'vm2'
+
+        self.assertEqual(1, self.runner.invoke(live_migrate_hv_to_pod.main,
+                                               ['--exec', '-p', 'profile', 'source_host', 'target_cluster']).exit_code)
+        self.assertEqual(4, self.lm.call_count)
+
+    def test_no_destination_host(self):
+        self.target_cluster.find_migration_host.return_value = None
+
+        self.assertEqual(1, self.runner.invoke(live_migrate_hv_to_pod.main,
+                                               ['--exec', '-p', 'profile', 'source_host', 'target_cluster']).exit_code)
+        self.lm.assert_not_called()
 
     def test_host_not_found(self):
         self.co_instance.get_host.return_value = None
 
         self.assertEqual(1, self.runner.invoke(live_migrate_hv_to_pod.main,
                                                ['--exec', '-p', 'profile', 'source_host', 'target_cluster']).exit_code)
+
+    def test_cluster_not_found(self):
+        self.co_instance.get_cluster.side_effect = lambda **kwargs: self.source_cluster if 'id' in kwargs else None
+
+        self.assertEqual(1, self.runner.invoke(live_migrate_hv_to_pod.main,
+                                               ['--exec', '-p', 'profile', 'source_host', 'target_cluster']).exit_code)
+        self.lm.assert_not_called()
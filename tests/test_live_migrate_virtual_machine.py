@@ -18,6 +18,7 @@ from unittest.mock import patch, Mock, call
 from click.testing import CliRunner
 
 import live_migrate_virtual_machine
+from cosmicops import ConvergencePolicy
 from cosmicops.objects import CosmicCluster, CosmicHost, CosmicVM, CosmicVolume, CosmicStoragePool
 
 
@@ -161,13 +162,14 @@ class TestLiveMigrateVirtualMachine(TestCase):
         self.co_instance.get_host.assert_called_with(id=self.vm['hostid'])
         self.cs_instance.update_zwps_to_cwps.assert_not_called()
         self.cs_instance.update_service_offering_of_vm.assert_not_called()
-        self.target_cluster.find_migration_host.assert_called_with(self.vm)
+        self.target_cluster.find_migration_host.assert_called_with(self.vm, capacity=None)
         self.source_host.get_disks.assert_called_with(self.vm['instancename'])
         self.cs_instance.get_volume_size.assert_called_with('path1')
         self.cs_instance.update_volume_size.assert_not_called()
         self.vm.migrate_within_cluster.assert_called()
-        self.vm.migrate.assert_called_with(self.destination_host, with_volume=True, source_host=self.source_host,
-                                           instancename=self.vm['instancename'])
+        self.vm.migrate.assert_called_with(self.destination_host, with_volume=True, volume_pools=None,
+                                           source_host=self.source_host,
+                                           instancename=self.vm['instancename'], convergence=None)
         self.vm.refresh.assert_called()
         self.cs_instance.add_vm_to_affinity_group.assert_not_called()
 
@@ -184,7 +186,7 @@ class TestLiveMigrateVirtualMachine(TestCase):
         self.co_instance.get_host.assert_called_with(id=self.vm['hostid'])
         self.cs_instance.update_zwps_to_cwps.assert_not_called()
         self.cs_instance.update_service_offering_of_vm.assert_not_called()
-        self.target_cluster.find_migration_host.assert_called_with(self.vm)
+        self.target_cluster.find_migration_host.assert_called_with(self.vm, capacity=None)
         self.source_host.get_disks.assert_not_called()
         self.cs_instance.get_volume_size.assert_not_called()
         self.cs_instance.update_volume_size.assert_not_called()
@@ -336,8 +338,9 @@ class TestLiveMigrateVirtualMachine(TestCase):
                                                ['--exec', '-p', 'profile', '--skip-within-cluster', 'vm',
                                                 'target_cluster']).exit_code)
         self.vm.migrate_within_cluster.assert_not_called()
-        self.vm.migrate.assert_called_with(self.destination_host, with_volume=True, source_host=self.source_host,
-                                           instancename=self.vm['instancename'])
+        self.vm.migrate.assert_called_with(self.destination_host, with_volume=True, volume_pools=None,
+                                           source_host=self.source_host,
+                                           instancename=self.vm['instancename'], convergence=None)
 
     def test_skip_within_cluster_dryrun(self):
         self.assertEqual(0, self.runner.invoke(live_migrate_virtual_machine.main,
@@ -403,3 +406,118 @@ class TestLiveMigrateVirtualMachine(TestCase):
         self.co_instance.get_storage_pool.assert_called_with(name='zwps_pool')
         self.root_volume.migrate.assert_called_with(self.zwps_storage_pool, live_migrate=True,
                                                     source_host=self.source_host, vm_instancename=self.vm['instancename'])
+
+    def test_live_migrate_planned(self):
+        self.co_instance.get_cluster.side_effect = None
+
+        self.assertTrue(live_migrate_virtual_machine.live_migrate(
+            self.co_instance, self.cs_instance, 'target_cluster', 'vm', None, None, None, None, False, False,
+            target_cluster=self.target_cluster, source_host=self.source_host, source_cluster=self.source_cluster,
+            destination_host=self.destination_host, target_pool=self.cwps_storage_pool))
+
+        self.co_instance.get_cluster.assert_not_called()
+        self.co_instance.get_host.assert_not_called()
+        self.target_cluster.find_migration_host.assert_not_called()
+        self.co_instance.get_all_storage_pools.assert_not_called()
+        self.co_instance.clean_old_disk_file.assert_called_once_with(host=self.destination_host, dry_run=False,
+                                                                     volume=self.root_volume,
+                                                                     target_pool_name='cwps_pool')
+        self.vm.migrate.assert_called_with(self.destination_host, with_volume=True,
+                                           volume_pools=[(self.root_volume, self.cwps_storage_pool)],
+                                           source_host=self.source_host, instancename=self.vm['instancename'],
+                                           convergence=None)
+
+        # The VM moved to another host since the evacuation was planned
+        self.vm._data['hostid'] = 'sh2'
+        self.co_instance.get_cluster.return_value = self.source_cluster
+        self.assertTrue(live_migrate_virtual_machine.live_migrate(
+            self.co_instance, self.cs_instance, 'target_cluster', 'vm', None, None, None, None, False, False,
+            target_cluster=self.target_cluster, source_host=self.source_host, source_cluster=self.source_cluster,
+            destination_host=self.destination_host, target_pool=self.cwps_storage_pool))
+        self.co_instance.get_host.assert_called_with(id='sh2')
+
+    def test_live_migrate_snapshots(self):
+        snapshots = Mock()
+        snapshots.get_vm_snapshots.return_value = []
+        snapshots.get_volume_snapshots.return_value = [{'name': 'snapshot'}]
+
+        self.assertFalse(live_migrate_virtual_machine.live_migrate(
+            self.co_instance, self.cs_instance, 'target_cluster', 'vm', None, None, None, None, False, False,
+            snapshots=snapshots))
+        snapshots.get_vm_snapshots.assert_called_with(self.vm)
+        snapshots.get_volume_snapshots.assert_called_with(self.root_volume)
+        self.vm.get_snapshots.assert_not_called()
+        self.root_volume.get_snapshots.assert_not_called()
+        self.vm.migrate.assert_not_called()
+
+    def test_convergence(self):
+        self.assertEqual(0, self.runner.invoke(live_migrate_virtual_machine.main,
+                                               ['--exec', '-p', 'profile', '--max-migration-bandwidth', '1000',
+                                                '--max-migration-downtime', '2000', 'vm', 'target_cluster']).exit_code)
+
+        policy = ConvergencePolicy(max_bandwidth=1000, max_downtime=2000)
+        self.vm.migrate_within_cluster.assert_called_with(vm=self.vm, source_cluster=self.source_cluster,
+                                                          source_host=self.source_host,
+                                                          instancename=self.vm['instancename'], convergence=policy)
+        self.vm.migrate.assert_called_with(self.destination_host, with_volume=True, volume_pools=None,
+                                           source_host=self.source_host,
+                                           instancename=self.vm['instancename'], convergence=policy)
+
+    @patch('live_migrate_virtual_machine.RsyncEngine')
+    def test_migrate_offline_with_rsync(self, mock_rsync_engine):
+        rsync_engine = mock_rsync_engine.return_value
+        rsync_engine.transfers = [Mock(), Mock()]
+        self.vm._data['state'] = 'Stopped'
+        self.co_instance.get_vm.side_effect = [self.vm, CosmicVM(Mock(), {**self.vm._data, 'state': 'Migrating'})]
+        self.co_instance.get_cluster.side_effect = [self.target_cluster, self.source_cluster, self.source_cluster]
+        self.co_instance.get_volume.return_value = {'storageid': 'pool_cwps'}
+        self.target_cluster.get_all_hosts = Mock(return_value=[self.destination_host])
+        self.target_cluster.get_storage_pools.return_value = [self.cwps_storage_pool]
+        self.source_cluster.get_all_hosts = Mock(return_value=[self.source_host])
+        self.source_host.execute = Mock()
+        self.cwps_storage_pool._data.update({'state': 'Up', 'disksizetotal': 1000, 'disksizeused': 0})
+        self.root_storage_pool._data['clusterid'] = 'sc1'
+        for volume in (self.root_volume, self.hwps_volume):
+            volume._data['size'] = 100
+        self.vm.get_volumes.return_value = [self.root_volume, self.hwps_volume]
+        self.cs_instance.get_volume_db_id.side_effect = [1, 2]
+        self.cs_instance.get_storage_pool_id_from_name.side_effect = [10, 20, 11, 20]
+
+        self.assertEqual(0, self.runner.invoke(live_migrate_virtual_machine.main,
+                                               ['--exec', '-p', 'profile', '--migrate-offline-with-rsync',
+                                                '--rsync-target-host', 'destination_host', '--skip-backingfile-merge',
+                                                '--rsync-streams', '2', '--rsync-verify', 'vm',
+                                                'target_cluster']).exit_code)
+
+        mock_rsync_engine.assert_called_with(streams=2, checksum=False, verify=True, resume=False, log_to_slack=True)
+        rsync_engine.add.assert_has_calls([
+            call(self.root_volume, self.source_host, self.root_storage_pool, self.source_host, self.cwps_storage_pool),
+            call(self.hwps_volume, self.source_host, self.root_storage_pool, self.source_host, self.cwps_storage_pool)
+        ])
+        rsync_engine.run.assert_called_once()
+        self.cs_instance.update_storage_pool_ids.assert_called_once_with([(1, 10, 20), (2, 11, 20)])
+        self.cs_instance.update_storage_pool_id.assert_not_called()
+        self.cs_instance.set_vm_state.assert_called_with(instance_name=self.vm['instancename'], status_name='Stopped')
+
+    @patch('live_migrate_virtual_machine.RsyncEngine')
+    def test_migrate_offline_with_rsync_failure(self, mock_rsync_engine):
+        mock_rsync_engine.return_value.run.return_value = False
+        self.vm._data['state'] = 'Stopped'
+        self.co_instance.get_cluster.side_effect = [self.target_cluster, self.source_cluster]
+        self.target_cluster.get_all_hosts = Mock(return_value=[self.destination_host])
+        self.target_cluster.get_storage_pools.return_value = [self.cwps_storage_pool]
+        self.source_cluster.get_all_hosts = Mock(return_value=[self.source_host])
+        self.source_host.execute = Mock()
+        self.cwps_storage_pool._data.update({'state': 'Up', 'disksizetotal': 1000, 'disksizeused': 0})
+        self.root_storage_pool._data['clusterid'] = 'sc1'
+        self.root_volume._data['size'] = 100
+
+        self.assertEqual(1, self.runner.invoke(live_migrate_virtual_machine.main,
+                                               ['--exec', '-p', 'profile', '--migrate-offline-with-rsync',
+                                                '--rsync-target-host', 'destination_host', '--skip-backingfile-merge',
+                                                'vm', 'target_cluster']).exit_code)
+
+        mock_rsync_engine.return_value.run.assert_called_once()
+        self.cs_instance.update_storage_pool_ids.assert_not_called()
+        self.cs_instance.set_vm_state.assert_called_once_with(instance_name=self.vm['instancename'],
+                                                              status_name='Migrating')
@@ -228,3 +228,25 @@ class TestLiveMigrateVirtualMachineVolumes(TestCase):
         self.volume.refresh.side_effect = refresh_effect
         self.assertEqual(0, self.runner.invoke(live_migrate_virtual_machine_volumes.main,
                                                ['--exec', '-p', 'profile', 'vm', 'target_pool']).exit_code)
+
+    @patch('live_migrate_virtual_machine_volumes.VolumeMigrationTracker')
+    def test_parallel(self, mock_tracker):
+        tracker = mock_tracker.return_value
+        tracker.run.return_value = True
+
+        self.assertEqual(0, self.runner.invoke(live_migrate_virtual_machine_volumes.main,
+                                               ['--exec', '--parallel', '--max-per-source-pool', '2', '-p', 'profile',
+                                                'vm', 'target_pool']).exit_code)
+
+        mock_tracker.assert_called_with(self.co_instance, 2, 2, log_to_slack=True)
+        tracker.add.assert_called_with(self.volume, self.source_storage_pool, self.target_storage_pool,
+                                       source_host=self.host, vm_instancename=self.vm['instancename'])
+        tracker.run.assert_called()
+        self.volume.migrate.assert_not_called()
+        self.host.set_iops_limit.assert_called_with(self.vm['instancename'], 0)
+
+        self._setup_mocks()
+        tracker.run.return_value = False
+        self.assertEqual(0, self.runner.invoke(live_migrate_virtual_machine_volumes.main,
+                                               ['--exec', '--parallel', '-p', 'profile', 'vm',
+                                                'target_pool']).exit_code)
@@ -203,3 +203,34 @@ class TestMigrateOfflineVolumes(TestCase):
                                                ['--exec', 'source_cluster', '--destination-cluster-name',
                                                 'destination_cluster']).exit_code)
         self.volume.migrate.assert_called()
+
+    @patch('migrate_offline_volumes.VolumeMigrationScheduler')
+    def test_parallel(self, mock_scheduler):
+        scheduler = mock_scheduler.return_value
+
+        self.assertEqual(0, self.runner.invoke(migrate_offline_volumes.main,
+                                               ['--exec', '--parallel', '--max-running', '8', '--max-pool-rate', '100',
+                                                'source_cluster', '--destination-cluster-name',
+                                                'destination_cluster']).exit_code)
+
+        mock_scheduler.assert_called_with(self.co_instance, [self.destination_storage_pool], max_running=8,
+                                          max_per_source_pool=1, max_per_target_pool=1,
+                                          max_bytes_per_second=100 * 1024 * 1024)
+        scheduler.add.assert_called_with(self.volume, self.source_storage_pool)
+        scheduler.run.assert_called()
+        self.volume.migrate.assert_not_called()
+
+        self._setup_mocks()
+        scheduler.run.return_value = False
+        self.assertEqual(1, self.runner.invoke(migrate_offline_volumes.main,
+                                               ['--exec', '--parallel', 'source_cluster', '--destination-cluster-name',
+                                                'destination_cluster']).exit_code)
+        scheduler.run.return_value = True
+
+        self._setup_mocks()
+        scheduler.reset_mock()
+        self.volume['storage'] = self.destination_storage_pool['name']
+        self.assertEqual(0, self.runner.invoke(migrate_offline_volumes.main,
+                                               ['--exec', '--parallel', 'source_cluster', '--destination-cluster-name',
+                                                'destination_cluster']).exit_code)
+        scheduler.add.assert_not_called()
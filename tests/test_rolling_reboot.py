@@ -28,7 +28,7 @@ class TestRollingReboot(TestCase):
         self.addCleanup(co_patcher.stop)
         self.co_instance = self.co.return_value
 
-        slack_patcher = patch('cosmicops.log.Slack')
+        slack_patcher = patch('slack_webhook.Slack')
         self.mock_slack = slack_patcher.start()
         self.addCleanup(slack_patcher.stop)
 
@@ -73,6 +73,7 @@ class TestRollingReboot(TestCase):
         self.assertEqual(0, result.exit_code)
 
         self.co.assert_called_with(profile='config', dry_run=False, log_to_slack=True)
+        self.co_instance.enable_api_profiling.assert_not_called()
         self.co_instance.get_cluster.assert_called_with(name='cluster1')
 
         self.cluster.get_all_hosts.assert_called()
@@ -84,6 +85,26 @@ class TestRollingReboot(TestCase):
             host.wait_until_online.assert_called()
             host.enable.assert_called()
 
+    def test_profile_api(self):
+        self._mock_cluster_with_hosts()
+
+        result = self.runner.invoke(rolling_reboot.main,
+                                    ['--exec', '--profile-api', '--profile-api-file', 'profile.json', 'cluster1'])
+        self.assertEqual(0, result.exit_code)
+
+        self.co_instance.enable_api_profiling.assert_called_with('profile.json')
+
+    @patch('rolling_reboot.metrics')
+    def test_metrics_file(self, mock_metrics):
+        self._mock_cluster_with_hosts()
+
+        result = self.runner.invoke(rolling_reboot.main, ['--exec', '--metrics-file', 'cosmicops.prom', 'cluster1'])
+        self.assertEqual(0, result.exit_code)
+
+        mock_metrics.enable.assert_called_with('cosmicops.prom')
+        self.assertEqual(3, mock_metrics.inc.call_count)
+        mock_metrics.inc.assert_called_with('hosts_processed_total', task='Rolling Reboot')
+
     def test_ignore_hosts(self):
         self._mock_cluster_with_hosts()
 
@@ -0,0 +1,89 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from testfixtures import tempdir
+
+import run_benchmarks
+from benchmarks.harness import compare_results
+
+
+class TestRunBenchmarks(TestCase):
+    def setUp(self):
+        slack_patcher = patch('slack_webhook.Slack')
+        slack_patcher.start()
+        self.addCleanup(slack_patcher.stop)
+
+        self.runner = CliRunner()
+
+    def _result(self, name='wait_for_job', size=10, median=1., api_calls=10, sql_queries=0):
+        return {'name': name, 'size': size, 'median': median, 'api_calls': api_calls, 'sql_queries': sql_queries}
+
+    @tempdir()
+    def test_main(self, tmp):
+        output = Path(tmp.path) / 'results.json'
+
+        result = self.runner.invoke(run_benchmarks.main,
+                                    ['--only', 'wait_for_job, get_file_list', '--sizes', '10', '--repeat', '2',
+                                     '--output', str(output)])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('wait_for_job[10]', result.output)
+
+        document = json.loads(output.read_text())
+        self.assertEqual(1, document['version'])
+        self.assertEqual(['wait_for_job', 'get_file_list'], [result['name'] for result in document['results']])
+
+        wait_for_job = document['results'][0]
+        self.assertEqual(2, wait_for_job['repeat'])
+        self.assertEqual(wait_for_job['api_calls'], wait_for_job['api_commands']['queryAsyncJobResult'])
+        self.assertGreater(wait_for_job['api_calls'], 1)
+        self.assertEqual(0, document['results'][1]['api_calls'])
+
+        result = self.runner.invoke(run_benchmarks.main,
+                                    ['--only', 'get_file_list', '--sizes', '10', '--repeat', '1', '--compare',
+                                     str(output), '--threshold', '1000'])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('Baseline', result.output)
+
+    @tempdir()
+    def test_main_regression(self, tmp):
+        baseline = Path(tmp.path) / 'baseline.json'
+        baseline.write_text(json.dumps({'results': [self._result('get_file_list', 10, median=1e-9, api_calls=0)]}))
+
+        result = self.runner.invoke(run_benchmarks.main, ['--only', 'get_file_list', '--sizes', '10', '--repeat', '1',
+                                                          '--compare', str(baseline)])
+        self.assertEqual(1, result.exit_code)
+        self.assertIn('REGRESSION', result.output)
+
+    def test_main_unknown_benchmark(self):
+        result = self.runner.invoke(run_benchmarks.main, ['--only', 'unknown'])
+        self.assertEqual(1, result.exit_code)
+
+    def test_compare_results(self):
+        baseline = {'results': [self._result(), self._result(size=20), self._result(size=30),
+                                self._result('cosmicsql_queries', sql_queries=2)]}
+        current = {'results': [self._result(median=1.1), self._result(size=20, median=1.5),
+                               self._result(size=30, api_calls=11), self._result('cosmicsql_queries', sql_queries=3),
+                               self._result(size=40)]}
+
+        rows = compare_results(baseline, current, threshold=0.2)
+
+        self.assertEqual([(10, False), (20, True), (30, True), (10, True)],
+                         [(row['size'], row['regressed']) for row in rows])
+        self.assertEqual(0.5, rows[1]['change'])
@@ -0,0 +1,47 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import signal
+from unittest import TestCase
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+import run_daemon
+
+
+class TestRunDaemon(TestCase):
+    def setUp(self):
+        daemon_patcher = patch('run_daemon.CosmicDaemon')
+        self.mock_daemon = daemon_patcher.start()
+        self.addCleanup(daemon_patcher.stop)
+        self.daemon = self.mock_daemon.return_value
+
+        signal_patcher = patch('signal.signal')
+        self.mock_signal = signal_patcher.start()
+        self.addCleanup(signal_patcher.stop)
+
+        self.runner = CliRunner()
+
+    def test_main(self):
+        self.daemon.serve_forever.side_effect = KeyboardInterrupt
+
+        result = self.runner.invoke(run_daemon.main, ['--socket', '/tmp/cosmicops.sock', '--cache-ttl', '60'])
+        self.assertEqual(0, result.exit_code)
+
+        self.mock_daemon.assert_called_with('/tmp/cosmicops.sock', run_daemon.DAEMON_COMMANDS, 60)
+        self.daemon.start.assert_called()
+        self.daemon.serve_forever.assert_called()
+        self.assertEqual(signal.SIGTERM, self.mock_signal.call_args[0][0])
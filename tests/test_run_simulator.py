@@ -0,0 +1,43 @@
+# Copyright 2020, Schuberg Philis B.V
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+import run_simulator
+
+
+class TestRunSimulator(TestCase):
+    def setUp(self):
+        server_patcher = patch('run_simulator.create_server')
+        self.mock_create_server = server_patcher.start()
+        self.addCleanup(server_patcher.stop)
+        self.server = self.mock_create_server.return_value
+
+        self.runner = CliRunner()
+
+    def test_main(self):
+        self.server.serve_forever.side_effect = KeyboardInterrupt
+
+        result = self.runner.invoke(run_simulator.main, ['--hosts', '2', '--vms', '3', '--port', '9000',
+                                                         '--time-scale', '0.01'])
+        self.assertEqual(0, result.exit_code)
+
+        (simulator, listen, port) = self.mock_create_server.call_args[0]
+        self.assertEqual(('127.0.0.1', 9000), (listen, port))
+        self.assertEqual(12, len(simulator.inventory['virtualmachines']))
+        self.assertEqual(0.01, simulator.time_scale)
+        self.server.server_close.assert_called()
@@ -17,6 +17,7 @@ import click
 import click_log
 
 from cosmicops import CosmicOps, logging
+from cosmicops.daemon import forward_or_run
 
 
 @click.command()
@@ -44,4 +45,4 @@ def main(profile, host, tags, add, dry_run):
 
 
 if __name__ == '__main__':
-    main()
+    forward_or_run(main)
@@ -18,6 +18,7 @@ import click
 import click_log
 
 from cosmicops import logging
+from cosmicops.daemon import forward_or_run
 from cosmicops.who_has_this_mac import who_has_this_mac
 
 
@@ -49,4 +50,4 @@ def main(profile, all_databases, mac_address):
 
 
 if __name__ == '__main__':
-    main()
+    forward_or_run(main)